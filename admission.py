@@ -0,0 +1,97 @@
+import threading
+
+from rtt import MAX_PEERS
+
+# Priority classes, most important first. A method has one (see
+# BaseRPCServer.register_method); batch requests count as LOW at best.
+HIGH = 0
+NORMAL = 1
+LOW = 2
+QUEUE_SHARES = (1.0, 0.9, 0.5)  # Fraction of max_queue each class may fill
+
+MAX_QUEUE = 1024  # Requests executing or waiting for a worker
+BUSY_RETRY = 0.05  # Retry-after, in seconds, given when the queue is full
+MAX_RETRY_AFTER = 10.0
+
+# Reasons for refusing a request, as counted in the metrics.
+QUEUE_FULL = 'queue'
+RATE_LIMITED = 'rate'
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+
+
+class RateLimiter:
+    """Token buckets of rate calls per second and burst depth, one per key.
+
+    delay() takes cost tokens from the key's bucket and returns 0, or takes
+    nothing and returns the seconds until the bucket holds enough. Idle keys
+    are forgotten once there are more than max_keys; a full bucket is what
+    a new key starts with anyway.
+    """
+
+    def __init__(self, rate, burst=None, max_keys=MAX_PEERS):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def delay(self, key, now, cost=1):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._forget_full(now)
+                bucket = self._buckets[key] = TokenBucket(self.burst, now)
+            else:
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+                bucket.updated = now
+            # A request costing more than the burst is let through from a full bucket, leaving it in debt.
+            needed = min(cost, self.burst)
+            if bucket.tokens < needed:
+                # At least one token's time: clients space their retries by it.
+                return max(needed - bucket.tokens, 1) / self.rate
+            bucket.tokens -= cost
+            return 0.0
+
+    def _forget_full(self, now):
+        full = [key for key, bucket in self._buckets.items()
+                if bucket.tokens + (now - bucket.updated) * self.rate >= self.burst]
+        for key in full:
+            del self._buckets[key]
+        if len(self._buckets) >= self.max_keys:
+            self._buckets.clear()
+
+
+class AdmissionControl:
+    """Decides whether the server takes on a request.
+
+    A request of priority class p is refused while max_queue * shares[p] or
+    more requests are queued, so low priority work is shed first and HIGH
+    keeps the last slots. With rate, each key (a user, or a client address)
+    is also held to rate calls per second with bursts of burst. admit()
+    returns None for an admitted request and (reason, retry_after) for a
+    refused one, retry_after being the seconds the client should wait.
+    """
+
+    def __init__(self, max_queue=MAX_QUEUE, rate=None, burst=None, shares=QUEUE_SHARES, retry_after=BUSY_RETRY):
+        self.max_queue = max_queue
+        self.limits = None if max_queue is None else [max_queue * share for share in shares]
+        self.limiter = RateLimiter(rate, burst) if rate else None
+        self.retry_after = retry_after
+
+    def admit(self, key, priority, queued, now, cost=1):
+        if self.limits is not None and queued >= self.limits[priority]:
+            # Lower classes wait longer, so they come back after the higher ones.
+            return QUEUE_FULL, self.retry_after * (1 + priority)
+        if self.limiter is not None:
+            delay = self.limiter.delay(key, now, cost)
+            if delay:
+                return RATE_LIMITED, min(delay, MAX_RETRY_AFTER)
+        return None
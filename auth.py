@@ -0,0 +1,88 @@
+import os
+import hmac
+import time
+import base64
+import hashlib
+import threading
+
+from credentials import VALID
+from registry import DESCRIBE
+
+# A session token is '<username>.<expiry>.<signature>': the username in
+# URL-safe base64, the expiry in hex seconds since the epoch, and the first
+# 16 bytes of an HMAC-SHA256 of the two under the server's secret. Any
+# process holding the secret can check a token without looking anything up.
+
+LOGIN = 'rpc.login'
+PUBLIC_METHODS = frozenset([LOGIN, DESCRIBE])  # Callable without a token when authentication is required
+TOKEN_TTL = 12 * 3600.0  # Seconds a token stays valid
+SIGNATURE_BYTES = 16
+MAX_CACHED_TOKENS = 65536
+SECRET_BYTES = 32
+
+
+def _encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class Authenticator:
+    """Logs users in against a CredentialStore and checks their tokens.
+
+    login() returns a token for valid credentials and an error string
+    otherwise. user_for() returns the username a token was issued to, or None
+    when it is missing, forged or expired. Tokens that passed the HMAC check
+    are cached, so checking one again costs a dict lookup. Servers that share
+    secret accept each other's tokens. With required, calls other than
+    PUBLIC_METHODS are refused without a valid token.
+    """
+
+    def __init__(self, credentials, secret=None, ttl=TOKEN_TTL, required=True):
+        self.credentials = credentials
+        self.secret = secret if secret is not None else os.urandom(SECRET_BYTES)
+        self.ttl = ttl
+        self.required = required
+        self._verified = {}  # token -> (username, expires)
+        self._lock = threading.Lock()
+
+    def login(self, username, password):
+        if self.credentials.verify(username, password) != VALID:
+            return "Error: Invalid username or password"
+        return self.issue(username)
+
+    def issue(self, username, now=None):
+        expires = int((time.time() if now is None else now) + self.ttl)
+        message = f'{_encode(username.encode())}.{expires:x}'
+        return f'{message}.{_encode(self._sign(message))}'
+
+    def user_for(self, token, now=None):
+        if not isinstance(token, str):
+            return None
+        now = time.time() if now is None else now
+        verified = self._verified.get(token)
+        if verified is None:
+            verified = self._check(token)
+            if verified is None:
+                return None
+            with self._lock:
+                if len(self._verified) >= MAX_CACHED_TOKENS:
+                    self._verified.clear()
+                self._verified[token] = verified
+        username, expires = verified
+        return username if now < expires else None
+
+    def _check(self, token):
+        try:
+            message, _, signature = token.rpartition('.')
+            if not hmac.compare_digest(_decode(signature), self._sign(message)):
+                return None
+            username, expires = message.split('.')
+            return _decode(username).decode(), int(expires, 16)
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+    def _sign(self, message):
+        return hmac.new(self.secret, message.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES]
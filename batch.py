@@ -0,0 +1,106 @@
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# A batch request carries many invocations under one sequence number. When
+# every invocation names the same method without keyword arguments, the
+# request names that method and its args are the list of argument lists;
+# otherwise the function name is None and each entry is [name, args, kwargs].
+# The response is the list of results in the same order.
+
+VECTORIZE_MIN = 8  # Smaller batches are cheaper to run one call at a time
+_INT64_LIMIT = 1 << 63
+# From 3.12 sum() compensates float rounding, which only matches a plain
+# column-by-column sum for up to two terms.
+_MAX_FLOAT_TERMS = None if sys.version_info < (3, 12) else 2
+
+
+def encode_batch(calls):
+    names = {function_name for function_name, args, kwargs in calls}
+    if len(names) == 1 and not any(kwargs for function_name, args, kwargs in calls):
+        return names.pop(), [list(args) for function_name, args, kwargs in calls]
+    return None, [[function_name, list(args), kwargs or {}] for function_name, args, kwargs in calls]
+
+
+def decode_batch(function_name, entries):
+    if function_name is not None:
+        calls = [(function_name, args, {}) for args in entries]
+    else:
+        calls = [(entry[0], entry[1], entry[2] if len(entry) > 2 else {}) for entry in entries]
+    for name, args, kwargs in calls:
+        if type(name) is not str or not isinstance(args, list) or not isinstance(kwargs, dict):
+            raise TypeError('Each call needs a name, a list of arguments and a dict of keyword arguments')
+    return calls
+
+
+def batch_results(response, count):
+    # A server without batch support answers with one error string for the whole request.
+    if isinstance(response, list) and len(response) == count:
+        return response
+    return [response] * count
+
+
+def _matrix(rows, bound):
+    """rows as a 2-D float64 or int64 array, or None when the results could
+    differ from the scalar methods (ragged rows, mixed or non-numeric types,
+    or integers whose result could overflow 64 bits)."""
+    width = len(rows[0])
+    if width < 2 or any(len(row) != width for row in rows):
+        return None
+    kinds = {type(value) for row in rows for value in row}
+    if kinds == {float}:
+        return np.array(rows, dtype=np.float64)
+    if kinds != {int}:
+        return None
+    try:
+        matrix = np.array(rows, dtype=np.int64)
+    except OverflowError:
+        return None
+    largest = int(np.abs(matrix).max()) if matrix.min() > -_INT64_LIMIT else _INT64_LIMIT
+    return matrix if bound(largest, width) < _INT64_LIMIT else None
+
+
+def _float_sum_differs(matrix, terms):
+    return matrix.dtype == np.float64 and _MAX_FLOAT_TERMS is not None and terms > _MAX_FLOAT_TERMS
+
+
+# Each kernel reduces column by column, in the same order as the scalar
+# method, so float results are bit-for-bit identical.
+
+def _add(rows):
+    matrix = _matrix(rows, lambda largest, width: largest * width)
+    if matrix is None or _float_sum_differs(matrix, matrix.shape[1]):
+        return None
+    total = np.zeros(len(rows), dtype=matrix.dtype)
+    for column in matrix.T:
+        total += column
+    return total.tolist()
+
+
+def _subtract(rows):
+    matrix = _matrix(rows, lambda largest, width: largest * width)
+    if matrix is None or _float_sum_differs(matrix, matrix.shape[1] - 1):
+        return None
+    rest = np.zeros(len(rows), dtype=matrix.dtype)
+    for column in matrix.T[1:]:
+        rest += column
+    return (matrix[:, 0] - rest).tolist()
+
+
+def _multiply(rows):
+    matrix = _matrix(rows, lambda largest, width: largest ** width)
+    if matrix is None:
+        return None
+    product = matrix[:, 0].copy()
+    for column in matrix.T[1:]:
+        product *= column
+    return product.tolist()
+
+
+# Vectorized versions of the methods in register_builtin_methods. A kernel
+# takes the list of argument lists and returns the list of results, or None
+# to fall back to calling the method once per entry.
+BUILTIN_KERNELS = {'add': _add, 'subtract': _subtract, 'multiply': _multiply} if np is not None else {}
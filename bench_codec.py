@@ -0,0 +1,102 @@
+import sys
+import time
+import timeit
+import socket
+import argparse
+import tracemalloc
+
+from protocol import CODECS, codec_for
+from bulkio import BulkSocket
+
+# Representative calls: the built-in two-argument methods and a numeric-heavy one.
+CALLS = [
+    ('add', [3, 4], {}),
+    ('multiply', [2.5, 4.125], {}),
+    ('add', [float(i) / 7 for i in range(64)], {}),
+    ('subtract', list(range(-500, 500, 7)), {}),
+]
+
+
+def round_trip(codec, function_name, args, kwargs, sequence_number):
+    request = codec.encode_request(function_name, args, kwargs, sequence_number, {'piggyback': True})
+    function_name, args, kwargs, sequence_number, options = codec.decode_request(request)
+    _, response = codec.encode_response(args, sequence_number)
+    codec.decode_response(response)
+    return len(request), len(response)
+
+
+def _receive_recvfrom(sock, io):
+    datagrams = []
+    while True:
+        try:
+            datagrams.append(sock.recvfrom(65535))
+        except BlockingIOError:
+            return datagrams
+
+
+def _receive_pool(sock, io):
+    return io.recv_batch()
+
+
+def receive_path(codec, receive, rounds, batch=32):
+    """(us per datagram, tracemalloc peak in bytes per batch) to receive and
+    decode batch requests queued on a loopback socket."""
+    function_name, args, kwargs = CALLS[2]
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock, \
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        sock.bind(('127.0.0.1', 0))
+        sock.setblocking(False)
+        address = sock.getsockname()
+        io = BulkSocket(sock, batch)
+        packets = [codec.encode_request(function_name, args, kwargs, index, {'piggyback': True}) for index in range(batch)]
+
+        def one_batch():
+            for packet in packets:
+                sender.sendto(packet, address)
+            started = time.perf_counter()
+            for data, _ in receive(sock, io):
+                codec_for(data).decode_request(data)
+            return time.perf_counter() - started
+
+        for _ in range(10):
+            one_batch()
+        seconds = sum(one_batch() for _ in range(rounds))
+        tracemalloc.start()
+        try:
+            peak = 0
+            for _ in range(10):
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                one_batch()
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+        finally:
+            tracemalloc.stop()
+    return seconds / (rounds * batch) * 1e6, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='bench_codec', description='Compare the JSON and binary wire formats')
+    parser.add_argument('--number', type=int, default=20000, help='round trips per measurement')
+    parser.add_argument('--rounds', type=int, default=300, help='batches of 32 datagrams per receive-path measurement')
+    options = parser.parse_args(argv)
+
+    print(f"{'call':<32}{'codec':<8}{'request B':>10}{'response B':>11}{'us/call':>9}")
+    for function_name, args, kwargs in CALLS:
+        label = f'{function_name}({len(args)} args)'
+        for name, codec in CODECS.items():
+            request_size, response_size = round_trip(codec, function_name, args, kwargs, 12345)
+            seconds = timeit.timeit(lambda: round_trip(codec, function_name, args, kwargs, 12345), number=options.number)
+            print(f'{label:<32}{name:<8}{request_size:>10}{response_size:>11}{seconds / options.number * 1e6:>9.2f}')
+
+    # Receiving a request: a fresh bytes object per recvfrom, against views
+    # into the preallocated pool of BulkSocket parsed in place.
+    print(f"\n{'receive path':<32}{'codec':<8}{'us/datagram':>12}{'peak KiB/batch':>16}")
+    for label, receive in (('recvfrom', _receive_recvfrom), ('buffer pool', _receive_pool)):
+        for name, codec in CODECS.items():
+            micros, peak = receive_path(codec, receive, options.rounds)
+            print(f'{label:<32}{name:<8}{micros:>12.2f}{peak / 1024:>16.1f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
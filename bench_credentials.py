@@ -0,0 +1,59 @@
+import os
+import sys
+import time
+import timeit
+import argparse
+import tempfile
+
+from credentials import CredentialStore, hash_password
+
+
+def legacy_login(path, username, password):
+    # The original LoginWindow.login: read and split every line per attempt.
+    with open(path, 'r') as login_database:
+        data = login_database.readlines()
+        users = [line.strip().split() for line in data]
+        for current_user, current_password in users:
+            if current_user == username:
+                return current_password == password
+    return None
+
+
+def write_accounts(directory, accounts, iterations):
+    """A plaintext file in the original format and a hashed log in the new
+    one, both with accounts users. Every hashed entry shares one hash, which
+    is as fast to load as distinct ones and saves hashing them all."""
+    encoded = hash_password('password', iterations)
+    legacy, log = os.path.join(directory, 'legacy.txt'), os.path.join(directory, 'log.txt')
+    with open(legacy, 'w') as plain, open(log, 'w') as hashed:
+        for index in range(accounts):
+            plain.write(f'user{index} password\n')
+            hashed.write(f'user{index}\t{encoded}\tuser{index}@example.com\n')
+    return legacy, log
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='bench_credentials', description='Credential store load and lookup times')
+    parser.add_argument('--accounts', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--iterations', type=int, default=1000, help='PBKDF2 rounds of the generated hashes')
+    parser.add_argument('--number', type=int, default=20, help='logins per measurement')
+    options = parser.parse_args(argv)
+
+    print(f"{'accounts':>9}{'load ms':>10}{'store login ms':>16}{'file-scan login ms':>20}{'hash ms':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        for accounts in options.accounts:
+            legacy, log = write_accounts(directory, accounts, options.iterations)
+            started = time.perf_counter()
+            store = CredentialStore(log, iterations=options.iterations)
+            load = time.perf_counter() - started
+            last = f'user{accounts - 1}'
+            store_login = timeit.timeit(lambda: store.verify(last, 'password'), number=options.number)
+            scan_login = timeit.timeit(lambda: legacy_login(legacy, last, 'password'), number=options.number)
+            hashing = timeit.timeit(lambda: hash_password('password', options.iterations), number=options.number)
+            print(f'{accounts:>9}{load * 1e3:>10.1f}{store_login / options.number * 1e3:>16.3f}'
+                  f'{scan_login / options.number * 1e3:>20.3f}{hashing / options.number * 1e3:>9.3f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import functools
+import threading
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from client_backend import WINDOW_SIZE, ReliableUDPClient
+from protocol import BINARY, CODECS
+from histogram import Histogram
+from netem import add_impairment_arguments, impairment_argv, impairment_from
+
+STARTUP_TIMEOUT = 10.0
+
+
+def parse_mix(text):
+    """'add=3,multiply=1' -> ([names], [weights])"""
+    names, weights = [], []
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        names.append(name.strip())
+        weights.append(float(weight or 1))
+    return names, weights
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(engine, processes, port, io='bulk'):
+    """A headless server in a child process, so it does not share our GIL."""
+    command = [sys.executable, '-m', 'server_backend', 'serve', '--quiet', '--host', '127.0.0.1', '--port', str(port),
+               '--engine', engine, '--processes', str(processes), '--io', io]
+    return subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL)
+
+
+def start_proxy(target, port, options):
+    command = [sys.executable, '-m', 'netem', '--listen', f'127.0.0.1:{port}', '--target', f'{target[0]}:{target[1]}',
+               *impairment_argv(options)]
+    return subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL)
+
+
+def wait_for_server(address, timeout=STARTUP_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    client = ReliableUDPClient(address)
+    try:
+        while time.monotonic() < deadline:
+            response, response_time = client.send_request('add', [0, 0])
+            if response_time is not None:
+                return
+        raise TimeoutError(f'No server answering on {address[0]}:{address[1]}')
+    finally:
+        client.close()
+
+
+class _Worker:
+    """One client socket and the calls it keeps in flight."""
+
+    def __init__(self, address, options, seed):
+        self.client = ReliableUDPClient(address, window=options.window, codec=CODECS[options.codec])
+        self.options = options
+        self.names, self.weights = parse_mix(options.mix)
+        self.random = random.Random(seed)
+        self.histogram = Histogram()
+        self.completed = 0
+        self.errors = 0
+        self.measure_from = None
+        self._lock = threading.Lock()
+
+    def _submit(self, intended):
+        function_name = self.random.choices(self.names, self.weights)[0]
+        args = [self.random.uniform(0.5, 1.5) for _ in range(self.options.payload)]
+        future = self.client.submit(function_name, args)
+        future.add_done_callback(functools.partial(self._done, intended))
+        return future
+
+    def _done(self, intended, future):
+        # Latency runs from when the call was due, not when it went out, so a
+        # stalled open-loop sender still counts its queueing time.
+        latency = time.perf_counter() - intended
+        response, response_time = future.result()
+        with self._lock:
+            if intended < self.measure_from:
+                return
+            if response_time is None or (isinstance(response, str) and response.startswith('Error')):
+                self.errors += 1
+            else:
+                self.completed += 1
+                self.histogram.record(latency * 1e6)
+
+    def run(self, start, deadline, rate):
+        self.measure_from = start + self.options.warmup
+        outstanding = set()
+        if rate:
+            interval = 1 / rate
+            intended = start + self.random.uniform(0, interval)
+            while intended < deadline:
+                delay = intended - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                outstanding.add(self._submit(intended))
+                outstanding = {future for future in outstanding if not future.done()}
+                intended += interval
+        else:
+            while time.perf_counter() < deadline:
+                while len(outstanding) < self.options.concurrency:
+                    outstanding.add(self._submit(time.perf_counter()))
+                _, outstanding = wait(outstanding, timeout=deadline - time.perf_counter(), return_when=FIRST_COMPLETED)
+        wait(outstanding)
+
+    def close(self):
+        self.client.close()
+
+
+def run_benchmark(address, options):
+    workers = [_Worker(address, options, options.seed + index) for index in range(options.clients)]
+    rate = options.rate / options.clients if options.rate else 0
+    start = time.perf_counter()
+    deadline = start + options.warmup + options.duration
+    threads = [threading.Thread(target=worker.run, args=(start, deadline, rate), daemon=True) for worker in workers]
+    for thread in threads:
+        thread.start()
+    time.sleep(options.warmup)
+    retransmits_before = sum(worker.client.tracker.retransmits for worker in workers)
+    failures_before = sum(worker.client.tracker.failures for worker in workers)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start - options.warmup
+
+    histogram = Histogram()
+    for worker in workers:
+        histogram.merge(worker.histogram)
+        worker.close()
+    completed = sum(worker.completed for worker in workers)
+    return {
+        'completed': completed,
+        'errors': sum(worker.errors for worker in workers),
+        'seconds': elapsed,
+        'throughput': completed / elapsed,
+        'retransmits': sum(worker.client.tracker.retransmits for worker in workers) - retransmits_before,
+        'failures': sum(worker.client.tracker.failures for worker in workers) - failures_before,
+        'latency_us': histogram.summary(),
+        'histogram_us': histogram.buckets(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Lines describing the change from baseline, and whether it regressed."""
+    lines, regressed = [], False
+    checks = [('throughput', results['throughput'], baseline['throughput'], True),
+              ('p99 latency', results['latency_us']['p99'], baseline['latency_us']['p99'], False)]
+    for label, current, previous, higher_is_better in checks:
+        if not previous or current is None:
+            continue
+        change = current / previous - 1
+        worse = -change if higher_is_better else change
+        flag = 'REGRESSION' if worse > tolerance else 'ok'
+        regressed |= worse > tolerance
+        lines.append(f'{label:<12}{previous:>12.1f} -> {current:<12.1f}{change:+8.1%}  {flag}')
+    return lines, regressed
+
+
+def print_results(results):
+    latency = results['latency_us']
+    print(f"calls {results['completed']}  errors {results['errors']}  in {results['seconds']:.2f} s  "
+          f"throughput {results['throughput']:.0f} calls/s  retransmits {results['retransmits']}  "
+          f"failed {results['failures']}")
+    if latency['count']:
+        print('latency us: ' + '  '.join(f'{key} {latency[key]}' for key in ('min', 'p50', 'p90', 'p99', 'p999', 'max')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='bench_rpc', description='Load generator and latency benchmark for the RPC stack')
+    parser.add_argument('--server', help='host:port of a running server (default: start one on loopback)')
+    parser.add_argument('--engine', choices=['asyncio', 'threads'], default='asyncio', help='engine of the started server')
+    parser.add_argument('--processes', type=int, default=1, help='processes of the started server')
+    parser.add_argument('--io', choices=['bulk', 'plain'], default='bulk', help='datagram I/O of the started server')
+    parser.add_argument('--clients', type=int, default=4, help='client sockets')
+    parser.add_argument('--concurrency', type=int, default=8, help='calls in flight per client (closed loop)')
+    parser.add_argument('--rate', type=float, default=0, help='total calls per second (open loop); 0 for closed loop')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds measured')
+    parser.add_argument('--warmup', type=float, default=1.0, help='seconds run before measuring')
+    parser.add_argument('--mix', default='add=1', help='methods and weights, e.g. add=3,multiply=1')
+    parser.add_argument('--payload', type=int, default=2, help='numeric arguments per call')
+    parser.add_argument('--codec', choices=sorted(CODECS), default=BINARY.name)
+    parser.add_argument('--window', type=int, default=WINDOW_SIZE, help='client window (sequence numbers in flight)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', metavar='PATH', help="write the results as JSON ('-' for stdout)")
+    parser.add_argument('--baseline', metavar='PATH', help='JSON results to compare with; exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed relative regression (default 0.10)')
+    add_impairment_arguments(parser)
+    options = parser.parse_args(argv)
+    if options.concurrency > options.window:
+        parser.error('--concurrency cannot exceed --window')
+
+    children = []
+    if options.server:
+        address = parse_address(options.server)
+    else:
+        address = ('127.0.0.1', _free_port())
+        children.append(start_server(options.engine, options.processes, address[1], options.io))
+    try:
+        if impairment_from(options).active():
+            target, address = address, ('127.0.0.1', _free_port())
+            children.append(start_proxy(target, address[1], options))
+        wait_for_server(address)
+        results = run_benchmark(address, options)
+    finally:
+        for child in children:
+            child.terminate()
+            child.wait()
+
+    report = {
+        'config': {key: value for key, value in vars(options).items() if key not in ('json', 'baseline')},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S%z')},
+        'results': results,
+    }
+    print_results(results)
+    if options.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif options.json:
+        with open(options.json, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        lines, regressed = compare(results, baseline, options.tolerance)
+        print('\n'.join(lines))
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
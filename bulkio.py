@@ -0,0 +1,323 @@
+import sys
+import errno
+import select
+import socket
+import struct
+import asyncio
+import ctypes
+import ctypes.util
+from collections import deque
+
+from rtt import MAX_PEERS
+
+# Bulk datagram I/O: recvmmsg/sendmmsg move a whole batch of datagrams per
+# system call where libc has them (Linux), and a non-blocking recvfrom_into /
+# sendto loop stands in elsewhere. Sockets must be non-blocking.
+#
+# Received datagrams are read-only memoryviews into a pool of preallocated
+# slots, not bytes: nothing is allocated or copied per datagram beyond the
+# view itself, and the decoders parse the views in place. A view is only
+# valid until the next recv_batch() on the same socket, so whatever must
+# outlive the handling of a datagram has to be copied out of it.
+
+BATCH_SIZE = 32  # Datagrams per recvmmsg/sendmmsg call
+SLOT_SIZE = 65535  # Receive buffer per datagram: the largest UDP payload
+_SOCKADDR_SIZE = 128  # sizeof(struct sockaddr_storage)
+_RETRY = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_iovec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t), ('msg_flags', ctypes.c_int)]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _msghdr), ('msg_len', ctypes.c_uint)]
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        recvmmsg, sendmmsg = libc.recvmmsg, libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int]
+    recvmmsg.restype = sendmmsg.restype = ctypes.c_int
+    return recvmmsg, sendmmsg
+
+
+_LIBC = _load_libc()
+_PORT = struct.Struct('!H')
+_FAMILY = struct.Struct('=H')
+_INET_KEY = struct.Struct('=Q')  # Family, port and IPv4 address: the first 8 bytes of a sockaddr_in
+
+
+def _decode_sockaddr(raw):
+    family = _FAMILY.unpack_from(raw)[0]
+    if family == socket.AF_INET:
+        return socket.inet_ntop(socket.AF_INET, raw[4:8]), _PORT.unpack_from(raw, 2)[0]
+    if family == socket.AF_INET6:
+        flowinfo, = struct.unpack_from('!I', raw, 4)
+        scope_id, = struct.unpack_from('=I', raw, 24)
+        return socket.inet_ntop(socket.AF_INET6, raw[8:24]), _PORT.unpack_from(raw, 2)[0], flowinfo, scope_id
+    raise OSError(errno.EAFNOSUPPORT, f'Unsupported address family {family}')
+
+
+def _encode_sockaddr(address):
+    if len(address) == 2:
+        return _FAMILY.pack(socket.AF_INET) + _PORT.pack(address[1]) + socket.inet_pton(socket.AF_INET, address[0]) + bytes(8)
+    host, port, flowinfo, scope_id = address
+    return (_FAMILY.pack(socket.AF_INET6) + _PORT.pack(port) + struct.pack('!I', flowinfo) +
+            socket.inet_pton(socket.AF_INET6, host) + struct.pack('=I', scope_id))
+
+
+class BulkSocket:
+    """Batched receive and send on a non-blocking UDP socket.
+
+    recv_batch() returns up to batch (data, address) pairs that are already
+    queued, without waiting, with data a memoryview valid until the next
+    recv_batch(); send_batch() sends (data, address) pairs in
+    order and returns how many went out before the send buffer filled up.
+    A datagram that fails for any other reason is dropped, as the network
+    would, after passing the error to on_error. Both use one system call per
+    batch when libc has recvmmsg and sendmmsg, and one per datagram
+    otherwise. Only one thread may receive at a time; any may send.
+    """
+
+    def __init__(self, sock, batch=BATCH_SIZE, on_error=None, vectored=True):
+        self.sock = sock
+        self.batch = batch
+        self.on_error = on_error
+        self.vectored = vectored and _LIBC is not None
+        self._buffer = bytearray(batch * SLOT_SIZE)
+        self._slots = [memoryview(self._buffer)[index * SLOT_SIZE:(index + 1) * SLOT_SIZE] for index in range(batch)]
+        self._view = memoryview(self._buffer).toreadonly()  # What handlers get, so they cannot write to the pool
+        self._addresses = {}  # sockaddr key -> address tuple
+        self._sockaddrs = {}  # address tuple -> raw sockaddr
+        if self.vectored:
+            self._setup_recvmmsg()
+
+    def _setup_recvmmsg(self):
+        base = ctypes.addressof((ctypes.c_char * len(self._buffer)).from_buffer(self._buffer))
+        self._names = ctypes.create_string_buffer(self.batch * _SOCKADDR_SIZE)
+        names = ctypes.addressof(self._names)
+        self._iovecs = (_iovec * self.batch)()
+        self._messages = (_mmsghdr * self.batch)()
+        for index in range(self.batch):
+            self._iovecs[index].iov_base = base + index * SLOT_SIZE
+            self._iovecs[index].iov_len = SLOT_SIZE
+            header = self._messages[index].msg_hdr
+            header.msg_name = names + index * _SOCKADDR_SIZE
+            header.msg_iov = ctypes.pointer(self._iovecs[index])
+            header.msg_iovlen = 1
+
+    def recv_batch(self):
+        if self.vectored:
+            return self._recvmmsg()
+        datagrams = []
+        view = self._view
+        for index, slot in enumerate(self._slots):
+            try:
+                size, address = self.sock.recvfrom_into(slot)
+            except (BlockingIOError, InterruptedError):
+                break
+            start = index * SLOT_SIZE
+            datagrams.append((view[start:start + size], address))
+        return datagrams
+
+    def _recvmmsg(self):
+        messages = self._messages
+        for index in range(self.batch):
+            messages[index].msg_hdr.msg_namelen = _SOCKADDR_SIZE
+        count = _LIBC[0](self.sock.fileno(), messages, self.batch, socket.MSG_DONTWAIT, None)
+        if count < 0:
+            error = ctypes.get_errno()
+            if error in _RETRY:
+                return []
+            raise OSError(error, f'recvmmsg: {errno.errorcode.get(error, error)}')
+        datagrams = []
+        view = self._view
+        for index in range(count):
+            start = index * SLOT_SIZE
+            datagrams.append((view[start:start + messages[index].msg_len],
+                              self._address(index * _SOCKADDR_SIZE, messages[index].msg_hdr.msg_namelen)))
+        return datagrams
+
+    def _address(self, offset, length):
+        # IPv4 peers are looked up by an int read in place; others by their bytes.
+        if length == 16:
+            key = _INET_KEY.unpack_from(self._names, offset)[0]
+        else:
+            key = ctypes.string_at(ctypes.addressof(self._names) + offset, length)
+        address = self._addresses.get(key)
+        if address is None:
+            if len(self._addresses) >= MAX_PEERS:
+                self._addresses.clear()
+            address = self._addresses[key] = _decode_sockaddr(
+                ctypes.string_at(ctypes.addressof(self._names) + offset, length))
+        return address
+
+    def _sockaddr(self, address):
+        name = self._sockaddrs.get(address)
+        if name is None:
+            if len(self._sockaddrs) >= MAX_PEERS:
+                self._sockaddrs.clear()
+            name = self._sockaddrs[address] = _encode_sockaddr(address)
+        return name
+
+    def send_batch(self, packets):
+        sent = 0
+        while sent < len(packets):
+            if self.vectored and len(packets) - sent > 1:
+                count = self._sendmmsg(packets, sent)
+            else:
+                count = self._sendto(*packets[sent])
+            if count == 0:
+                break
+            sent += count
+        return sent
+
+    def _sendto(self, data, address):
+        try:
+            self.sock.sendto(data, address)
+        except (BlockingIOError, InterruptedError):
+            return 0
+        except OSError as exc:
+            self._failed(exc)
+        return 1
+
+    def _sendmmsg(self, packets, start):
+        chunk = packets[start:start + self.batch]
+        try:
+            names = [self._sockaddr(address) for _, address in chunk]
+        except (OSError, ValueError, TypeError):
+            return self._sendto(*chunk[0])  # Not a numeric address; let sendto resolve it
+        datas = [data if isinstance(data, bytes) else bytes(data) for data, _ in chunk]
+        iovecs = (_iovec * len(chunk))()
+        messages = (_mmsghdr * len(chunk))()
+        for index, (data, name) in enumerate(zip(datas, names)):
+            iovecs[index].iov_base = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p)
+            iovecs[index].iov_len = len(data)
+            header = messages[index].msg_hdr
+            header.msg_name = ctypes.cast(ctypes.c_char_p(name), ctypes.c_void_p)
+            header.msg_namelen = len(name)
+            header.msg_iov = ctypes.pointer(iovecs[index])
+            header.msg_iovlen = 1
+        count = _LIBC[1](self.sock.fileno(), messages, len(chunk), 0)
+        if count >= 0:
+            return count
+        error = ctypes.get_errno()
+        if error in _RETRY:
+            return 0
+        # The first datagram failed; drop it and carry on with the rest.
+        self._failed(OSError(error, f'sendmmsg: {errno.errorcode.get(error, error)}'))
+        return 1
+
+    def _failed(self, exc):
+        if self.on_error is not None:
+            self.on_error(exc)
+
+    def wait_writable(self, timeout):
+        select.select([], [self.sock], [], timeout)
+
+
+class BulkDatagramTransport(asyncio.DatagramTransport):
+    """A datagram transport for the event loop that reads with BulkSocket.
+
+    Every wakeup drains a batch of datagrams into the protocol, and the
+    datagrams the protocol sends while handling them go out together in one
+    send_batch() once the batch is done. Sends that find the socket buffer
+    full wait in a queue for the socket to become writable.
+    """
+
+    def __init__(self, loop, sock, protocol, batch=BATCH_SIZE):
+        super().__init__()
+        sock.setblocking(False)
+        self._loop = loop
+        self._sock = sock
+        self._protocol = protocol
+        self._io = BulkSocket(sock, batch, on_error=protocol.error_received)
+        self._outbox = None  # Sends held back while a batch is handled
+        self._backlog = deque()  # Sends waiting for the socket to become writable
+        self._closing = False
+        self._extra = {'socket': sock, 'sockname': sock.getsockname()}
+        loop.add_reader(sock.fileno(), self._read_ready)
+        loop.call_soon(protocol.connection_made, self)
+
+    def get_extra_info(self, name, default=None):
+        return self._extra.get(name, default)
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self._sock.fileno())
+        self._loop.remove_writer(self._sock.fileno())
+        self._backlog.clear()
+        self._loop.call_soon(self._call_connection_lost)
+
+    def abort(self):
+        self.close()
+
+    def _call_connection_lost(self):
+        try:
+            self._protocol.connection_lost(None)
+        finally:
+            self._sock.close()
+
+    def get_write_buffer_size(self):
+        return sum(len(data) for data, _ in self._backlog)
+
+    def sendto(self, data, addr=None):
+        if self._closing:
+            return
+        if self._outbox is not None:
+            self._outbox.append((data, addr))
+        elif self._backlog:
+            self._backlog.append((data, addr))
+        else:
+            self._send([(data, addr)])
+
+    def _send(self, packets):
+        sent = self._io.send_batch(packets)
+        if sent < len(packets):
+            if not self._backlog:
+                self._loop.add_writer(self._sock.fileno(), self._write_ready)
+            self._backlog.extend(packets[sent:])
+
+    def _write_ready(self):
+        packets = list(self._backlog)
+        self._backlog.clear()
+        sent = self._io.send_batch(packets)
+        self._backlog.extend(packets[sent:])
+        if not self._backlog:
+            self._loop.remove_writer(self._sock.fileno())
+
+    def _read_ready(self):
+        try:
+            datagrams = self._io.recv_batch()
+        except OSError as exc:
+            self._protocol.error_received(exc)
+            return
+        self._outbox = []
+        try:
+            for data, addr in datagrams:
+                self._protocol.datagram_received(data, addr)
+        finally:
+            outbox, self._outbox = self._outbox, None
+            if outbox and not self._closing:
+                if self._backlog:
+                    self._backlog.extend(outbox)
+                else:
+                    self._send(outbox)
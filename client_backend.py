@@ -0,0 +1,1200 @@
+import os
+import sys
+import json
+import time
+import heapq
+import socket
+import asyncio
+import getpass
+import argparse
+import select
+import selectors
+import functools
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from protocol import (MAX_RETRIES, ACK_DELAY, ACK_EVERY, MAX_SELECTIVE_ACKS, JSON, BINARY, CODECS, codec_for)
+from fragment import MAX_DATAGRAM, Fragmenter, is_fragment, path_mtu, set_buffer_sizes
+from batch import batch_results, encode_batch
+from rtt import RTTEstimator
+from registry import DESCRIBE
+from auth import LOGIN
+from bulkio import BulkSocket
+from streaming import STREAM_ACK_EVERY, STREAM_WINDOW, IncomingStream
+
+RECV_SIZE = 65535
+RECV_BATCH = 8  # Datagrams per receive call, each with a 64 KiB slot of the pool
+WINDOW_SIZE = 32  # Outstanding sequence numbers allowed per client
+INITIAL_CWND = 4  # Congestion window of a new client, grown by slow start
+MIN_CWND = 1
+RESPONSE_TIMEOUT = 5.0  # Wait after an ACK before asking again
+MAX_RETRY_TIME = 5.0  # Longest a request goes unacknowledged before the call fails, whatever the attempts left
+MAX_BUSY_WAIT = 30.0  # Longest a call keeps retrying while the server answers busy
+BUSY_ERROR = 'Error: Server busy'
+DEADLINE_ERROR = 'Error: Deadline exceeded'
+POLL_INTERVAL = 0.5
+INVALID_REQUEST = b'Error: Invalid request format'
+
+# Events passed to a call's progress callback as progress(event, attempt).
+SENT = 'sent'
+ACKED = 'acked'
+
+
+def _ignore(message, *args):
+    pass
+
+
+def _resolve_future(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _resolve_batch(future, count, result):
+    response, response_time = result
+    _resolve_future(future, (batch_results(response, count), response_time))
+
+
+def _resolve_methods(future, tracker, result):
+    response, response_time = result
+    _resolve_future(future, tracker.learn_methods(response))
+
+
+def _resolve_login(future, tracker, result):
+    response, response_time = result
+    _resolve_future(future, tracker.learn_token(response, response_time))
+
+
+def _stream_error(result):
+    # The error a finished streamed call ends its iteration with, or None.
+    response, response_time = result
+    if response_time is None or isinstance(response, str):
+        return response or 'Error: Function call failed'
+    return None
+
+
+class StreamError(RuntimeError):
+    pass
+
+
+class _Call:
+    __slots__ = ('sequence_number', 'request', 'batch', 'request_packet', 'message_id', 'callback', 'progress',
+                 'acked', 'attempts', 'deadline', 'start_time', 'sent_at', 'unacked_since', 'busy', 'expires',
+                 'stream')
+
+    def __init__(self, sequence_number, request, batch, callback, progress, now, timeout=None, stream=None):
+        self.sequence_number = sequence_number
+        self.request = request
+        self.batch = batch
+        self.request_packet = None
+        self.message_id = None
+        self.callback = callback
+        self.progress = progress
+        self.acked = False
+        self.attempts = 0
+        self.deadline = None
+        self.start_time = now
+        self.sent_at = now
+        self.unacked_since = None  # First send the server has not acknowledged yet
+        self.busy = False  # Waiting out a busy answer rather than a lost datagram
+        self.expires = None if timeout is None else now + timeout  # The call fails at this time
+        self.stream = stream  # IncomingStream of a call whose items stream back
+
+
+class CallTracker:
+    """Transport-independent state for a pipelined client.
+
+    Keeps a sliding window of outstanding sequence numbers, matches responses
+    to calls by sequence number in whatever order they arrive, and decides
+    when to retransmit. The socket wrappers below feed it datagrams and clock
+    ticks and send whatever packets it hands back; completed calls are
+    returned as (call, response, response_time) so callbacks can run outside
+    any lock.
+
+    In piggyback mode the server's response doubles as the ACK for the
+    request, and the client's ACKs for responses are cumulative, held back
+    for up to ACK_DELAY and carried on the next request when there is one.
+
+    A server that rejects the binary framing or the piggyback option with an
+    'Invalid request format' error is talked down to JSON, then to the plain
+    JSON protocol, and the outstanding calls are re-sent in the new format.
+
+    Requests and responses larger than max_datagram travel as fragments (see
+    fragment.py); retransmitting one sends a probe instead of the whole
+    message.
+
+    The calls in flight are limited by the least of window, the receive
+    window the server advertises in its responses, and a congestion window
+    run like TCP's AIMD: slow start from INITIAL_CWND, one more call per
+    window of responses after that, and halved when a request times out
+    unacknowledged (at most once per window, as those losses are usually one
+    event).
+
+    A call started with a timeout fails with DEADLINE_ERROR once it runs
+    out, and the request tells the server how long that is, so the server
+    drops it rather than run it late. A cancelled call that reached the
+    server is cancelled there too.
+
+    A call started with an IncomingStream asks for its result as a stream
+    (see streaming.py). Items are acknowledged in CREDIT frames, held back
+    like ACKs, and the credit grows as the consumer calls consumed().
+    """
+
+    def __init__(self, window=WINDOW_SIZE, on_log=_ignore, piggyback=True, codec=BINARY, max_datagram=MAX_DATAGRAM):
+        self.window = window
+        self.piggyback = piggyback
+        self.codec = codec
+        self.fragmenter = Fragmenter(max_datagram)
+        self.sequence_number = 0
+        self.calls = {}  # sequence_number -> _Call, in ascending order
+        self.on_log = on_log
+        self.rtt = RTTEstimator()
+        self._awaiting_ack = deque()  # one entry per request datagram sent, for plain ACKs
+        self._timers = []  # heap of (deadline, sequence_number)
+        self._unacked_responses = []  # responses received since our last ACK
+        self._stream_acks = set()  # streamed calls with items received since our last CREDIT
+        self._ack_deadline = None
+        self._stale_rejections = 0
+        self.retransmits = 0  # Request datagrams (or probes) sent again
+        self.failures = 0  # Calls that ran out of retries
+        self.busy_answers = 0  # Requests the server refused as busy
+        self._busy_until = 0.0  # When the last call refused as busy goes out again
+        self._busy_spacing = 0.0  # Retry-after of the last busy answer
+        self.cwnd = min(INITIAL_CWND, window)
+        self.ssthresh = window
+        self.peer_window = None  # Receive window last advertised by the server
+        self._recovery = 0  # Losses below this sequence number were already answered
+        self.method_ids = {}  # name -> id from the server's method list; binary requests use the id
+        self.token = None  # Session token from rpc.login, sent with every request
+
+    def window_open(self):
+        return self.window_free() > 0
+
+    def window_free(self):
+        return self._base() + self.send_window() - self.sequence_number
+
+    def send_window(self):
+        window = min(self.window, int(self.cwnd))
+        return window if self.peer_window is None else min(window, self.peer_window)
+
+    def _grow(self):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += 1
+        else:
+            self.cwnd += 1 / self.cwnd
+        self.cwnd = min(self.cwnd, self.window)
+
+    def _congested(self, sequence_number):
+        if sequence_number < self._recovery:
+            return
+        self.ssthresh = max(self.cwnd / 2, MIN_CWND)
+        self.cwnd = self.ssthresh
+        self._recovery = self.sequence_number
+        self.on_log('Congestion window reduced to %.1f', self.cwnd)
+
+    def _base(self):
+        return next(iter(self.calls), self.sequence_number)
+
+    def start(self, function_name, args, kwargs, callback, now, batch=False, progress=None, timeout=None, stream=None):
+        sequence_number = self.sequence_number
+        self.sequence_number += 1
+        call = _Call(sequence_number, (function_name, list(args), kwargs), batch, callback, progress, now, timeout,
+                     stream)
+        options = self._options(call)
+        if options and self._unacked_responses:
+            options['ack'] = self._take_ack_fields()
+        encode_start = time.perf_counter()
+        call.request_packet = self._encode(call, options)
+        self.calls[sequence_number] = call
+        # Large requests take a while to encode; the retransmit timer starts once they are ready to send.
+        now += time.perf_counter() - encode_start
+
+        self.on_log("--- Request %s ---", sequence_number)
+        if batch:
+            self.on_log("Batch: %s calls to %s", len(args), function_name or 'several functions')
+        else:
+            self.on_log("Function: %s", function_name)
+            self.on_log("Arguments: %s", list(args))
+            self.on_log("Keyword Arguments: %s", kwargs)
+        if self._busy_until > now:
+            # The server asked us to hold off; new calls queue behind the refused ones.
+            call.busy = True
+            self._defer(call, now)
+            return sequence_number, []
+        return sequence_number, self._transmit(call, now)
+
+    def _defer(self, call, now):
+        self._busy_until = max(now, self._busy_until) + self._busy_spacing
+        self._schedule(call, self._busy_until)
+
+    def cancel(self, sequence_number):
+        # The call is forgotten: no more retransmits, and a late response is
+        # only acknowledged. Returns the packets that tell the server, or None
+        # when the call was not outstanding.
+        call = self.calls.get(sequence_number)
+        if call is None:
+            return None
+        self.on_log('Request %s cancelled', sequence_number)
+        self._finish(call, None, None)
+        if not self.piggyback or not call.attempts:
+            # Servers of the plain protocol do not know the message, and a
+            # call held back by a busy answer is not on the server.
+            return []
+        return [self.codec.encode_cancel(sequence_number)]
+
+    def consumed(self, sequence_number):
+        # The consumer took an item of a streamed call; returns the credit
+        # to send once enough were taken.
+        call = self.calls.get(sequence_number)
+        if call is None or call.stream is None or not call.stream.consume():
+            return []
+        self._stream_acks.discard(sequence_number)
+        return [self._credit(call)]
+
+    def _credit(self, call):
+        received, limit = call.stream.credit()
+        return self.codec.encode_credit(call.sequence_number, received, limit)
+
+    def learn_methods(self, response):
+        # The discovery method's answer, or None from a server without one.
+        if not isinstance(response, list) or not all(isinstance(method, dict) for method in response):
+            return None
+        self.method_ids = {method['name']: method['id'] for method in response if method.get('id')}
+        return response
+
+    def learn_token(self, response, response_time):
+        # rpc.login answers with a token, or an error string.
+        if response_time is None:
+            return 'Error: Function call failed'
+        if isinstance(response, str) and not response.startswith('Error'):
+            self.token = response
+        return response
+
+    def _encode(self, call, options):
+        if self.codec is BINARY and not call.batch:
+            method_id = self.method_ids.get(call.request[0], 0)
+            return self.codec.encode_request(*call.request, call.sequence_number, options, method_id)
+        return self.codec.encode_request(*call.request, call.sequence_number, options)
+
+    def _options(self, call):
+        options = {}
+        if self.piggyback:
+            # Servers that take piggybacked ACKs also advertise a receive window.
+            options['piggyback'] = True
+            options['flow'] = True
+        if call.batch:
+            options['batch'] = True
+        if self.token is not None:
+            options['token'] = self.token
+        if call.expires is not None:
+            options['timeout'] = max(1, round((call.expires - call.start_time) * 1000))
+        if call.stream is not None:
+            options['stream'] = True
+        return options
+
+    def _transmit(self, call, now):
+        call.attempts += 1
+        if call.attempts > 1:
+            self.retransmits += 1
+        if call.acked or call.unacked_since is None:
+            call.unacked_since = now
+        call.acked = False
+        call.sent_at = now
+        self._schedule(call, now + self.rtt.rto)
+        self.on_log('Sent request with sequence %s (Attempt %s/%s)', call.sequence_number, call.attempts, MAX_RETRIES)
+        if call.progress is not None:
+            call.progress(SENT, call.attempts)
+        if call.message_id is not None:
+            packets = self.fragmenter.probe(call.message_id)
+            if packets:
+                return packets
+        call.message_id, packets = self.fragmenter.split(call.request_packet, None, call.sequence_number)
+        if not self.piggyback:
+            self._awaiting_ack.append(call.sequence_number)
+        return packets
+
+    def _schedule(self, call, deadline):
+        if call.expires is not None and call.expires < deadline:
+            deadline = call.expires
+        call.deadline = deadline
+        heapq.heappush(self._timers, (deadline, call.sequence_number))
+
+    def next_deadline(self):
+        while self._timers:
+            deadline, sequence_number = self._timers[0]
+            call = self.calls.get(sequence_number)
+            if call is not None and call.deadline == deadline:
+                break
+            heapq.heappop(self._timers)
+        else:
+            return self._ack_deadline
+        if self._ack_deadline is not None and self._ack_deadline < deadline:
+            return self._ack_deadline
+        return deadline
+
+    def expire(self, now):
+        packets, completed = [], []
+        if self._ack_deadline is not None and self._ack_deadline <= now:
+            packets.extend(self._credit(self.calls[seq]) for seq in self._stream_acks if seq in self.calls)
+            self._stream_acks.clear()
+            if self._unacked_responses:
+                packets.append(self.flush_ack())
+            self._ack_deadline = None
+        while self._timers and self._timers[0][0] <= now:
+            deadline, sequence_number = heapq.heappop(self._timers)
+            call = self.calls.get(sequence_number)
+            if call is None or call.deadline != deadline:
+                continue
+            if call.expires is not None and now >= call.expires:
+                # The server holds the same deadline and drops the request itself.
+                self.on_log('Deadline passed, request %s failed.', sequence_number)
+                self.failures += 1
+                completed.append(self._finish(call, DEADLINE_ERROR, None))
+                continue
+            if call.acked and call.stream is not None and call.stream.stalled():
+                # The server has sent all our consumer allowed; no item is overdue.
+                self._schedule(call, now + RESPONSE_TIMEOUT)
+                continue
+            if call.attempts >= MAX_RETRIES:
+                self.on_log('Max retries reached. Request %s failed.', sequence_number)
+                self.failures += 1
+                completed.append(self._finish(call, None, None))
+                continue
+            if not call.acked and not call.busy and now - call.unacked_since >= MAX_RETRY_TIME:
+                # Backoff from the initial RTO would otherwise keep a dead server's caller waiting for most of a minute.
+                self.on_log('No ACK for %.1f s. Request %s failed.', now - call.unacked_since, sequence_number)
+                self.failures += 1
+                completed.append(self._finish(call, None, None))
+                continue
+            if call.busy:
+                call.busy = False
+                self.on_log('Sending sequence %s again after the server was busy', sequence_number)
+            elif call.acked:
+                self.on_log('No response for sequence %s, asking again...', sequence_number)
+                if call.stream is not None:
+                    packets.append(self._credit(call))  # In case the last one was lost
+            else:
+                self._congested(sequence_number)
+                self.rtt.expired(call.sent_at, now)
+                self.on_log('No ACK, retrying... %s/%s (RTO %.0f ms)', call.attempts, MAX_RETRIES, self.rtt.rto * 1000)
+            packets.extend(self._transmit(call, now))
+        return packets, completed
+
+    def receive(self, data, now):
+        if is_fragment(data):
+            data, packets, sequence_number = self.fragmenter.receive(data, None, now)
+            call = self.calls.get(sequence_number)
+            if call is not None and not call.acked:
+                self._acknowledged(call, now)
+            if data is None:
+                return packets, []
+        codec = codec_for(data)
+        if codec.is_ack(data):
+            self._receive_ack(data, codec, now)
+            return [], []
+        if codec.is_busy(data):
+            return [], self._receive_busy(data, codec, now)
+        if codec.is_stream(data):
+            return self._receive_stream(data, codec, now), []
+
+        try:
+            response, sequence_number, window = codec.decode_response(data)
+        except Exception:
+            if data[:len(INVALID_REQUEST)] == INVALID_REQUEST:
+                return self._downgrade(now), []
+            self.on_log('Ignoring malformed packet: %r', bytes(data[:80]))
+            return [], []
+        if window:
+            self.peer_window = window
+
+        call = self.calls.get(sequence_number)
+        if call is None:
+            # Our ACK for this response was lost; answer straight away.
+            self.on_log('Duplicate response for sequence %s, re-sending acknowledgment', sequence_number)
+            if self.piggyback:
+                self._unacked_responses.append(sequence_number)
+                return [self.flush_ack()], []
+            return [self.codec.ack_for(sequence_number, False)], []
+
+        if self.piggyback and not call.acked:
+            self._acknowledged(call, now)
+        if call.attempts == 1:
+            self._grow()
+        response_time = (now - call.start_time) * 1000  # Convert to milliseconds
+        self.on_log('Received response: %s', response)
+        self.on_log('Response time: %.2f ms', response_time)
+        completed = [self._finish(call, response, response_time)]
+        if not self.piggyback:
+            self.on_log('Sent acknowledgment for response')
+            return [self.codec.ack_for(sequence_number, False)], completed
+
+        self._unacked_responses.append(sequence_number)
+        if len(self._unacked_responses) >= ACK_EVERY:
+            return [self.flush_ack()], completed
+        if self._ack_deadline is None:
+            self._ack_deadline = now + ACK_DELAY
+        return [], completed
+
+    def _receive_busy(self, data, codec, now):
+        # The server refused the request without running it. Nothing was
+        # lost, so the window stays; retry_after already paces the retries,
+        # and the retry is not a lost attempt.
+        try:
+            sequence_number, retry_after = codec.decode_busy(data)
+        except Exception:
+            return []
+        call = self.calls.get(sequence_number)
+        if call is None or call.acked or call.busy:
+            return []
+        self.busy_answers += 1
+        call.unacked_since = None  # The server is there; the retry starts a new wait
+        if now + retry_after - call.start_time > MAX_BUSY_WAIT:
+            self.on_log('Server still busy, request %s failed.', sequence_number)
+            self.failures += 1
+            return [self._finish(call, BUSY_ERROR, None)]
+        if call.expires is not None and now + retry_after >= call.expires:
+            self.on_log('Server busy past the deadline, request %s failed.', sequence_number)
+            self.failures += 1
+            return [self._finish(call, DEADLINE_ERROR, None)]
+        call.busy = True
+        call.attempts -= 1
+        # Refused calls go out again one retry_after apart, not all at once.
+        self._busy_spacing = retry_after
+        self._defer(call, now)
+        self.on_log('Server busy, sending sequence %s again in %.0f ms', sequence_number, retry_after * 1000)
+        return []
+
+    def _receive_stream(self, data, codec, now):
+        try:
+            sequence_number, index, item = codec.decode_stream(data)
+        except Exception:
+            return []
+        call = self.calls.get(sequence_number)
+        if call is None or call.stream is None:
+            # An item of a call we gave up on.
+            return [self.codec.encode_cancel(sequence_number)]
+        if not call.acked:
+            self._acknowledged(call, now)
+        elif call.deadline - now < RESPONSE_TIMEOUT / 2:
+            self._schedule(call, now + RESPONSE_TIMEOUT)
+        stream = call.stream
+        delivered, holding = stream.received, stream.holding()
+        fresh = stream.receive(index, item)
+        if stream.received > delivered:
+            call.attempts = min(call.attempts, 1)  # MAX_RETRIES counts attempts without progress
+        # An item seen before means our last CREDIT was lost, and the first
+        # one past a gap that an item is missing: the server resends it.
+        if not fresh or (stream.holding() and not holding) or stream.received - stream.acknowledged >= STREAM_ACK_EVERY:
+            self._stream_acks.discard(sequence_number)
+            return [self._credit(call)]
+        self._stream_acks.add(sequence_number)
+        if self._ack_deadline is None:
+            self._ack_deadline = now + ACK_DELAY
+        return []
+
+    def _receive_ack(self, data, codec, now):
+        try:
+            cumulative, selective = codec.decode_ack(data)
+        except Exception:
+            return
+        if cumulative is None:
+            # Plain ACKs carry no sequence number; the server sends one per
+            # request datagram, in the order it receives them. Entries for
+            # calls that already finished or were acknowledged belong to lost
+            # datagrams and are skipped.
+            while self._awaiting_ack:
+                call = self.calls.get(self._awaiting_ack.popleft())
+                if call is not None and not call.acked:
+                    self._acknowledged(call, now)
+                    break
+            return
+        for sequence_number in [seq for seq in self.calls if seq <= cumulative] + sorted(selective):
+            call = self.calls.get(sequence_number)
+            if call is not None and not call.acked:
+                self._acknowledged(call, now)
+
+    def _acknowledged(self, call, now):
+        call.acked = True
+        self.fragmenter.release(call.message_id)
+        call.message_id = None
+        if call.attempts == 1:
+            self.rtt.sample(now - call.sent_at)
+        self._schedule(call, now + RESPONSE_TIMEOUT)
+        self.on_log('Received ACK for sequence %s', call.sequence_number)
+        if call.progress is not None:
+            call.progress(ACKED, call.attempts)
+
+    def _take_ack_fields(self):
+        cumulative = self._base() - 1
+        selective = sorted(seq for seq in self._unacked_responses if seq > cumulative)
+        self._unacked_responses = selective[MAX_SELECTIVE_ACKS:]
+        self._ack_deadline = None
+        return cumulative, selective[:MAX_SELECTIVE_ACKS]
+
+    def _downgrade(self, now):
+        # Every request datagram already sent in the old format draws its own
+        # error; skip those before judging the new format.
+        if self._stale_rejections:
+            self._stale_rejections -= 1
+            return []
+        if self.codec is not JSON:
+            self.codec = JSON
+            self.on_log('Server rejected the binary format, falling back to JSON')
+        elif self.piggyback:
+            self.piggyback = False
+            self.peer_window = None
+            self._unacked_responses = []
+            self._ack_deadline = None
+            self.on_log('Server rejected piggybacked acknowledgments, falling back to plain ACKs')
+        else:
+            return []
+        self._stale_rejections = sum(call.attempts for call in self.calls.values()) - 1
+        packets = []
+        for call in self.calls.values():
+            call.request_packet = self._encode(call, self._options(call))
+            call.attempts = 0
+            self.fragmenter.release(call.message_id)
+            call.message_id = None
+            packets.extend(self._transmit(call, now))
+        return packets
+
+    def pending_acks(self):
+        return bool(self._unacked_responses)
+
+    def flush_ack(self):
+        cumulative, selective = self._take_ack_fields()
+        if selective:
+            self.on_log('Sent acknowledgment for responses up to %s and %s', cumulative, selective)
+        else:
+            self.on_log('Sent acknowledgment for responses up to %s', cumulative)
+        return self.codec.encode_ack(cumulative, selective)
+
+    def fail_all(self):
+        return [self._finish(call, None, None) for call in list(self.calls.values())]
+
+    def _finish(self, call, response, response_time):
+        del self.calls[call.sequence_number]
+        self._stream_acks.discard(call.sequence_number)
+        self.fragmenter.release(call.message_id)
+        self.on_log("------------------------")
+        return call, response, response_time
+
+
+class ResultStream:
+    """The items of a streamed call, from ReliableUDPClient.stream().
+
+    Iterating blocks for each item in turn and ends with the call, raising
+    StreamError if it failed; result is then (response, response_time), the
+    response being the number of items. Every item taken lets the server
+    send another, so a slow consumer slows the server down instead of
+    piling items up here. close() cancels the call.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._items = deque()
+        self._ready = threading.Condition()
+        self.future = None
+        self.sequence_number = None
+        self.result = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._ready:
+            while not self._items and self.result is None:
+                self._ready.wait()
+            if not self._items:
+                error = _stream_error(self.result)
+                if error is not None:
+                    raise StreamError(error)
+                raise StopIteration
+            item = self._items.popleft()
+        self._client._consumed(self.sequence_number)
+        return item
+
+    def close(self):
+        self.future.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _push(self, item):
+        with self._ready:
+            self._items.append(item)
+            self._ready.notify()
+
+    def _done(self, future):
+        with self._ready:
+            self.result = ('Error: Call cancelled', None) if future.cancelled() else future.result()
+            self._ready.notify_all()
+
+
+class ReliableUDPClient:
+    """Blocking-socket client with many calls in flight.
+
+    submit() returns a concurrent.futures.Future resolving to
+    (response, response_time); send_request() is submit().result(). A
+    background thread receives datagrams and drives retransmissions, and
+    calls progress(event, attempt) as the request is sent and acknowledged.
+    Cancelling the future abandons the call, on the server too. With a
+    timeout in seconds the call fails with DEADLINE_ERROR once it runs out.
+    """
+
+    def __init__(self, server_address, window=WINDOW_SIZE, on_log=_ignore, piggyback=True, codec=BINARY):
+        self.server_address = server_address
+        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client_socket.setblocking(False)
+        set_buffer_sizes(self.client_socket)
+        self._io = BulkSocket(self.client_socket, RECV_BATCH)
+        self.tracker = CallTracker(window, on_log, piggyback, codec, path_mtu(server_address))
+        self._lock = threading.Condition()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._receiver = None
+        self._closed = False
+
+    @property
+    def sequence_number(self):
+        return self.tracker.sequence_number
+
+    def submit(self, function_name, args=(), kwargs=None, progress=None, timeout=None):
+        future = Future()
+        self._start(future, function_name, args, kwargs or {}, functools.partial(_resolve_future, future),
+                    progress=progress, timeout=timeout)
+        return future
+
+    def submit_batch(self, calls, timeout=None):
+        """Send many (function_name, args, kwargs) calls as one request.
+
+        The future resolves to (responses, response_time), with responses in
+        the order of calls.
+        """
+        calls = list(calls)
+        future = Future()
+        function_name, entries = encode_batch(calls)
+        self._start(future, function_name, entries, {}, functools.partial(_resolve_batch, future, len(calls)), batch=True,
+                    timeout=timeout)
+        return future
+
+    def stream(self, function_name, args=(), kwargs=None, timeout=None, window=STREAM_WINDOW):
+        """Call a method and iterate over the items it streams back.
+
+        The call starts at once; the ResultStream returned yields the items
+        as they arrive, with at most window of them sent ahead of the
+        consumer. A method that is not a generator streams its one result.
+        """
+        results = ResultStream(self)
+        results.future = Future()
+        results.future.add_done_callback(results._done)
+        results.sequence_number = self._start(results.future, function_name, args, kwargs or {},
+                                              functools.partial(_resolve_future, results.future), timeout=timeout,
+                                              stream=IncomingStream(results._push, window))
+        return results
+
+    def submit_describe(self):
+        """Ask the server for its methods.
+
+        The future resolves to a list of dicts with each method's name, id,
+        doc and argument schema, or to None when the server has no discovery
+        method or does not answer. Calls made afterwards name the methods by
+        id in the binary format.
+        """
+        future = Future()
+        self._start(future, DESCRIBE, [], {}, functools.partial(_resolve_methods, future, self.tracker))
+        return future
+
+    def describe(self):
+        return self.submit_describe().result()
+
+    def submit_login(self, username, password):
+        """Log in to the server; the future resolves to the session token,
+        which every later call carries, or to an error string."""
+        future = Future()
+        self._start(future, LOGIN, [username, password], {}, functools.partial(_resolve_login, future, self.tracker))
+        return future
+
+    def login(self, username, password):
+        return self.submit_login(username, password).result()
+
+    def logout(self):
+        with self._lock:
+            self.tracker.token = None
+
+    def _start(self, future, function_name, args, kwargs, callback, batch=False, progress=None, timeout=None,
+               stream=None):
+        with self._lock:
+            while not self._closed and not self.tracker.window_open():
+                self._lock.wait()
+            if self._closed:
+                raise ConnectionError('Client is closed')
+            sequence_number, packets = self.tracker.start(function_name, args, kwargs, callback, time.monotonic(),
+                                                          batch, progress, timeout, stream)
+            future.add_done_callback(functools.partial(self._cancelled, sequence_number))
+            if self._receiver is None:
+                self._receiver = threading.Thread(target=self._receive_loop, name='rpc-client-receiver', daemon=True)
+                self._receiver.start()
+            # Sent under the lock so a retransmit probe can never overtake the fragments it probes for.
+            self._send_all(packets)
+        self._wakeup()
+        return sequence_number
+
+    def send_request(self, function_name, args=[], kwargs={}, timeout=None):
+        return self.submit(function_name, args, kwargs, timeout=timeout).result()
+
+    def send_batch(self, calls, timeout=None):
+        return self.submit_batch(calls, timeout).result()
+
+    def call_many(self, calls):
+        futures = [self.submit(function_name, args, kwargs) for function_name, args, kwargs in calls]
+        return [future.result() for future in futures]
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            packets = [self.tracker.flush_ack()] if self.tracker.pending_acks() else []
+            completed = self.tracker.fail_all()
+            self._lock.notify_all()
+        self._send_all(packets)
+        self._resolve(completed)
+        self._wakeup()
+        if self._receiver is not None and self._receiver is not threading.current_thread():
+            self._receiver.join()
+        self.client_socket.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+    def _cancelled(self, sequence_number, future):
+        if not future.cancelled():
+            return
+        with self._lock:
+            packets = None if self._closed else self.tracker.cancel(sequence_number)
+            if packets is None:
+                return
+            self._lock.notify_all()
+            self._send_all(packets)
+
+    def _consumed(self, sequence_number):
+        with self._lock:
+            if not self._closed:
+                self._send_all(self.tracker.consumed(sequence_number))
+
+    def _wakeup(self):
+        # Lets the receiver re-arm its select timeout for the new call.
+        try:
+            self._wakeup_writer.send(b'\0')
+        except BlockingIOError:
+            pass
+
+    def _resolve(self, completed):
+        for call, response, response_time in completed:
+            call.callback((response, response_time))
+
+    def _send_all(self, packets):
+        for packet in packets:
+            while True:
+                try:
+                    self.client_socket.sendto(packet, self.server_address)
+                    break
+                except BlockingIOError:
+                    # A burst of fragments filled the send buffer.
+                    select.select([], [self.client_socket], [], POLL_INTERVAL)
+
+    def _receive_loop(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.client_socket, selectors.EVENT_READ)
+        selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        try:
+            while True:
+                with self._lock:
+                    if self._closed:
+                        return
+                    now = time.monotonic()
+                    packets, completed = self.tracker.expire(now)
+                    deadline = self.tracker.next_deadline()
+                    if completed:
+                        self._lock.notify_all()
+                self._send_all(packets)
+                self._resolve(completed)
+
+                timeout = POLL_INTERVAL if deadline is None else min(max(deadline - now, 0), POLL_INTERVAL)
+                for key, _ in selector.select(timeout):
+                    if key.fileobj is self._wakeup_reader:
+                        self._wakeup_reader.recv(RECV_SIZE)
+                    else:
+                        self._drain()
+        finally:
+            selector.close()
+
+    def _drain(self):
+        while True:
+            try:
+                datagrams = self._io.recv_batch()
+            except OSError:
+                if self._closed:
+                    return
+                raise
+            if not datagrams:
+                return
+            packets, completed = [], []
+            with self._lock:
+                now = time.monotonic()
+                for data, _ in datagrams:
+                    more_packets, more_completed = self.tracker.receive(data, now)
+                    packets += more_packets
+                    completed += more_completed
+                if completed:
+                    self._lock.notify_all()
+            self._send_all(packets)
+            self._resolve(completed)
+
+
+class RPCClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client._handle_datagram(data)
+
+    def error_received(self, exc):
+        self.client.on_log('Socket error: %s', exc)
+
+    def connection_lost(self, exc):
+        self.client._fail_all()
+
+
+class AsyncResultStream:
+    """The items of a streamed call, from AsyncRPCClient.stream(), for
+    async for. The call starts with the first item asked for; otherwise it
+    behaves as ResultStream.
+    """
+
+    def __init__(self, client, function_name, args, kwargs, timeout, window):
+        self._client = client
+        self._request = function_name, args, kwargs, timeout, window
+        self._items = deque()
+        self._waiter = None
+        self.future = None
+        self.sequence_number = None
+        self.result = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.future is None:
+            await self._start()
+        while not self._items and self.result is None:
+            self._waiter = asyncio.get_running_loop().create_future()
+            await self._waiter
+        if not self._items:
+            error = _stream_error(self.result)
+            if error is not None:
+                raise StreamError(error)
+            raise StopAsyncIteration
+        item = self._items.popleft()
+        self._client._consumed(self.sequence_number)
+        return item
+
+    def close(self):
+        if self.future is not None:
+            self.future.cancel()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    async def _start(self):
+        function_name, args, kwargs, timeout, window = self._request
+        self.future = asyncio.get_running_loop().create_future()
+        self.future.add_done_callback(self._done)
+        self.sequence_number = await self._client._start(self.future, function_name, args, kwargs or {},
+                                                         functools.partial(_resolve_future, self.future),
+                                                         timeout=timeout, stream=IncomingStream(self._push, window))
+        if self.sequence_number is None:
+            self.result = (None, None)
+
+    def _push(self, item):
+        self._items.append(item)
+        self._wake()
+
+    def _done(self, future):
+        self.result = ('Error: Call cancelled', None) if future.cancelled() else future.result()
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+
+class AsyncRPCClient:
+    """asyncio counterpart of ReliableUDPClient.
+
+    Any number of send_request() coroutines may run concurrently; at most
+    `window` sequence numbers are outstanding at once, and responses are
+    matched to callers by sequence number even when they arrive out of order.
+    Cancelling a send_request() task cancels the call on the server too.
+    """
+
+    def __init__(self, server_address, window=WINDOW_SIZE, on_log=_ignore, piggyback=True, codec=BINARY):
+        self.server_address = server_address
+        self.on_log = on_log
+        self.transport = None
+        self.tracker = CallTracker(window, on_log, piggyback, codec, path_mtu(server_address))
+        self._timer = None
+        self._window_waiters = deque()
+
+    @classmethod
+    async def connect(cls, server_address, window=WINDOW_SIZE, on_log=_ignore, piggyback=True, codec=BINARY):
+        client = cls(server_address, window, on_log, piggyback, codec)
+        loop = asyncio.get_running_loop()
+        client.transport, _ = await loop.create_datagram_endpoint(
+            lambda: RPCClientProtocol(client), remote_addr=server_address)
+        set_buffer_sizes(client.transport.get_extra_info('socket'))
+        return client
+
+    @property
+    def sequence_number(self):
+        return self.tracker.sequence_number
+
+    def close(self):
+        if self.transport is not None:
+            if self.tracker.pending_acks() and not self.transport.is_closing():
+                self.transport.sendto(self.tracker.flush_ack())
+            self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    async def send_request(self, function_name, args=(), kwargs=None, progress=None, timeout=None):
+        future = asyncio.get_running_loop().create_future()
+        if await self._start(future, function_name, args, kwargs or {}, functools.partial(_resolve_future, future),
+                             progress=progress, timeout=timeout) is None:
+            return None, None
+        return await future
+
+    async def describe(self):
+        """The server's methods, as ReliableUDPClient.submit_describe() gives them."""
+        response, response_time = await self.send_request(DESCRIBE)
+        return self.tracker.learn_methods(response)
+
+    async def login(self, username, password):
+        """The session token, kept for later calls, or an error string."""
+        response, response_time = await self.send_request(LOGIN, [username, password])
+        return self.tracker.learn_token(response, response_time)
+
+    async def send_batch(self, calls, timeout=None):
+        """Send many (function_name, args, kwargs) calls as one request and
+        return (responses, response_time)."""
+        calls = list(calls)
+        future = asyncio.get_running_loop().create_future()
+        function_name, entries = encode_batch(calls)
+        if await self._start(future, function_name, entries, {},
+                             functools.partial(_resolve_batch, future, len(calls)), batch=True, timeout=timeout) is None:
+            return [None] * len(calls), None
+        return await future
+
+    def stream(self, function_name, args=(), kwargs=None, timeout=None, window=STREAM_WINDOW):
+        """The items the method streams back, as an AsyncResultStream:
+        async for item in client.stream('count', [10]): ..."""
+        return AsyncResultStream(self, function_name, args, kwargs, timeout, window)
+
+    async def _start(self, future, function_name, args, kwargs, callback, batch=False, progress=None, timeout=None,
+                     stream=None):
+        loop = asyncio.get_running_loop()
+        while not self.tracker.window_open():
+            waiter = loop.create_future()
+            self._window_waiters.append(waiter)
+            await waiter
+        if self.transport is None or self.transport.is_closing():
+            return None
+        sequence_number, packets = self.tracker.start(function_name, args, kwargs, callback, loop.time(), batch, progress,
+                                                      timeout, stream)
+        # Cancelling the awaiting task cancels the future, which abandons the call.
+        future.add_done_callback(functools.partial(self._cancelled, sequence_number))
+        self._send_all(packets)
+        self._arm_timer()
+        return sequence_number
+
+    def _cancelled(self, sequence_number, future):
+        if not future.cancelled():
+            return
+        packets = self.tracker.cancel(sequence_number)
+        if packets is None:
+            return
+        if not self.transport.is_closing():
+            self._send_all(packets)
+        self._wake_window_waiters(self.tracker.window_free())
+        self._arm_timer()
+
+    def _consumed(self, sequence_number):
+        packets = self.tracker.consumed(sequence_number)
+        if packets and not self.transport.is_closing():
+            self._send_all(packets)
+
+    async def call(self, function_name, *args, **kwargs):
+        response, _ = await self.send_request(function_name, args, kwargs)
+        return response
+
+    async def call_many(self, calls):
+        return await asyncio.gather(*(self.send_request(function_name, args, kwargs)
+                                      for function_name, args, kwargs in calls))
+
+    def _arm_timer(self):
+        deadline = self.tracker.next_deadline()
+        if self._timer is not None:
+            if deadline is not None and self._timer.when() <= deadline:
+                return
+            self._timer.cancel()
+            self._timer = None
+        if deadline is not None:
+            self._timer = asyncio.get_running_loop().call_at(deadline, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        packets, completed = self.tracker.expire(asyncio.get_running_loop().time())
+        self._send_all(packets)
+        self._resolve(completed)
+        self._arm_timer()
+
+    def _handle_datagram(self, data):
+        packets, completed = self.tracker.receive(data, asyncio.get_running_loop().time())
+        self._send_all(packets)
+        self._resolve(completed)
+        self._arm_timer()
+
+    def _send_all(self, packets):
+        for packet in packets:
+            self.transport.sendto(packet)
+
+    def _resolve(self, completed):
+        for call, response, response_time in completed:
+            call.callback((response, response_time))
+        if completed:
+            self._wake_window_waiters(self.tracker.window_free())
+
+    def _wake_window_waiters(self, count=None):
+        while self._window_waiters and (count is None or count > 0):
+            waiter = self._window_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                if count is not None:
+                    count -= 1
+
+    def _fail_all(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._resolve(self.tracker.fail_all())
+        self._wake_window_waiters()
+
+
+async def _call_once(host, port, function_name, args, codec, user=None, password=None, timeout=None):
+    client = await AsyncRPCClient.connect((host, port), codec=codec)
+    try:
+        if user is not None:
+            token = await client.login(user, password)
+            if token.startswith('Error'):
+                return token, 0.0
+        return await client.send_request(function_name, args, timeout=timeout)
+    finally:
+        client.close()
+
+
+async def _stream_once(host, port, function_name, args, codec, user=None, password=None, timeout=None):
+    client = await AsyncRPCClient.connect((host, port), codec=codec)
+    try:
+        if user is not None:
+            token = await client.login(user, password)
+            if token.startswith('Error'):
+                print(token)
+                return 1
+        results = client.stream(function_name, args, timeout=timeout)
+        try:
+            async for item in results:
+                print(item, flush=True)
+        except StreamError as e:
+            print(e)
+            return 1
+        response, response_time = results.result
+        print(f"Items: {response}\nResponse time: {response_time:.2f} ms")
+        return 0
+    finally:
+        client.close()
+
+
+async def _describe_once(host, port, codec):
+    client = await AsyncRPCClient.connect((host, port), codec=codec)
+    try:
+        return await client.describe()
+    finally:
+        client.close()
+
+
+def format_method(method):
+    """'add(*number)  at least 2 args  Sum of the arguments.' from a method description."""
+    params = list(method['params'])
+    if method['varargs']:
+        params.append(f"*{method['varargs']}")
+    params.extend(f'{name}={kind}' for name, kind in (method['keywords'] or {}).items())
+    arity = f"at least {method['min_args']} args" if method['max_args'] is None else f"{method['max_args']} args"
+    return f"{method['name']}({', '.join(params)})  {arity}  {method['doc']}".rstrip()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='client_backend', description='Headless UDP RPC client')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    call = subparsers.add_parser('call', help='call a remote function once')
+    call.add_argument('function')
+    call.add_argument('args', nargs='*', type=json.loads, help='JSON-encoded arguments')
+    call.add_argument('--host', default='127.0.0.1')
+    call.add_argument('--port', type=int, default=8000)
+    call.add_argument('--codec', choices=sorted(CODECS), default=BINARY.name, help='wire format (default: binary)')
+    call.add_argument('--user', help='log in first (the password is read from RPC_PASSWORD or prompted for)')
+    call.add_argument('--timeout', type=float, metavar='SECONDS',
+                      help='give up after this long; the server drops the call if it has not run by then')
+    call.add_argument('--stream', action='store_true', help='print the items of a streaming method as they arrive')
+    methods = subparsers.add_parser('methods', help="list the server's methods")
+    methods.add_argument('--host', default='127.0.0.1')
+    methods.add_argument('--port', type=int, default=8000)
+    methods.add_argument('--codec', choices=sorted(CODECS), default=BINARY.name, help='wire format (default: binary)')
+    options = parser.parse_args(argv)
+
+    if options.command == 'methods':
+        described = asyncio.run(_describe_once(options.host, options.port, CODECS[options.codec]))
+        if described is None:
+            print('Error: The server did not list its methods')
+            return 1
+        for method in described:
+            print(format_method(method))
+        return 0
+
+    password = None
+    if options.user is not None:
+        password = os.environ.get('RPC_PASSWORD') or getpass.getpass(f'Password for {options.user}: ')
+    if options.stream:
+        return asyncio.run(_stream_once(options.host, options.port, options.function, options.args,
+                                        CODECS[options.codec], options.user, password, options.timeout))
+    response, response_time = asyncio.run(_call_once(options.host, options.port, options.function, options.args,
+                                                     CODECS[options.codec], options.user, password, options.timeout))
+    if response_time is None:
+        print(response if isinstance(response, str) else 'Error: Function call failed')
+        return 1
+    print(f"Result: {response}\nResponse time: {response_time:.2f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
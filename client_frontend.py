@@ -1,77 +1,35 @@
 import sys
-import json
-import socket
-import time
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QPushButton, QVBoxLayout, QWidget, QTextEdit, 
                              QLabel, QHBoxLayout, QLineEdit, QComboBox, QScrollArea, QFrame, QProgressDialog,
                              QDialog, QMessageBox, QTabWidget)
 from PyQt6.QtGui import QFont
 from PyQt6.QtCore import Qt, QTimer, pyqtSignal, QObject
 
-SIZE = 1024
-ACK_TIMEOUT = 1 
-MAX_RETRIES = 5 
+import client_backend
+from auth import LOGIN
+from registry import SYSTEM_PREFIX
+from credentials import CREDENTIALS_FILE, VALID, WRONG_PASSWORD, CredentialStore
+from logsink import FLUSH_INTERVAL, MAX_VIEW_LINES, LogSink, format_line
+
+PROGRESS_DELAY_MS = 300  # Calls that finish sooner never show the progress dialog
 
 class SignalEmitter(QObject):
     status_update = pyqtSignal(str)
-    log_update = pyqtSignal(str)
+    # Emitted from the receiver thread; Qt queues them to the GUI thread.
+    call_progress = pyqtSignal(int, str, int)
+    call_finished = pyqtSignal(int, object)
+    methods_found = pyqtSignal(object)
 
-class ReliableUDPClient:
+class ReliableUDPClient(client_backend.ReliableUDPClient):
     def __init__(self, server_address):
-        self.server_address = server_address
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sequence_number = 0
         self.signal_emitter = SignalEmitter()
+        self.log_sink = LogSink()
+        super().__init__(server_address, on_log=self.log_sink.hook('log'))
 
-    def send_request(self, function_name, args=[], kwargs={}):
-        request_packet = json.dumps([function_name, args, kwargs, self.sequence_number]).encode()
-        start_time = time.time()
-
-        self.signal_emitter.log_update.emit(f"--- Request {self.sequence_number} ---")
-        self.signal_emitter.log_update.emit(f"Function: {function_name}")
-        self.signal_emitter.log_update.emit(f"Arguments: {args}")
-        self.signal_emitter.log_update.emit(f"Keyword Arguments: {kwargs}")
-
-        for attempt in range(MAX_RETRIES):
-            self.client_socket.sendto(request_packet, self.server_address)
-            self.signal_emitter.log_update.emit(f'Sent request with sequence {self.sequence_number} (Attempt {attempt + 1}/{MAX_RETRIES})')
-
-            self.client_socket.settimeout(ACK_TIMEOUT)
-            try:
-                ack, _ = self.client_socket.recvfrom(SIZE)
-                if ack == b'ACK':
-                    self.signal_emitter.log_update.emit(f'Received ACK for sequence {self.sequence_number}')
-                    break
-            except socket.timeout:
-                self.signal_emitter.log_update.emit(f'No ACK, retrying... {attempt + 1}/{MAX_RETRIES}')
-
-        if attempt == MAX_RETRIES - 1:
-            self.signal_emitter.log_update.emit('Max retries reached. Request failed.')
-            self.signal_emitter.log_update.emit("------------------------")
-            return None, None
-
-        self.client_socket.settimeout(None)
-        response_packet, _ = self.client_socket.recvfrom(SIZE)
-        end_time = time.time()
-        response_time = (end_time - start_time) * 1000  # Convert to milliseconds
-
-        response, seq = json.loads(response_packet.decode())
-
-        if seq == self.sequence_number:
-            self.signal_emitter.log_update.emit(f'Received response: {response}')
-            self.signal_emitter.log_update.emit(f'Response time: {response_time:.2f} ms')
-            
-            # Send acknowledgment
-            self.client_socket.sendto("ACK".encode(), self.server_address)
-            self.signal_emitter.log_update.emit('Sent acknowledgment for response')
-            
-            self.sequence_number += 1
-        else:
-            self.signal_emitter.log_update.emit('Mismatched response sequence number.')
-            response, response_time = None, None
-
-        self.signal_emitter.log_update.emit("------------------------")
-        return response, response_time
+def _login_status(response):
+    if isinstance(response, str) and response.startswith('Error'):
+        return f"Server login failed: {response}"
+    return "Signed in to the server"
 
 class LoginWindow(QDialog):
     def __init__(self, parent=None):
@@ -101,19 +59,21 @@ class LoginWindow(QDialog):
         self.setLayout(layout)
     
     def login(self):
-        with open("login_data.txt", "r") as login_database:
-            data = login_database.readlines()
-            users = [line.strip().split() for line in data]
-            for current_user, current_password in users:
-                if current_user == self.username_input.text() and current_password == self.password_input.text():
-                    QMessageBox.information(self, 'Login Successful', f'Welcome {self.username_input.text()}')
-                    self.accept()
-                    return
-                elif current_user == self.username_input.text():
-                    QMessageBox.warning(self, 'Login Failed', 'Password is wrong')
-                    return 
-        
-        QMessageBox.warning(self, 'Login Failed', 'Username not found in database')
+        result = self.parent().credentials.verify(self.username_input.text(), self.password_input.text())
+        if result == VALID:
+            if LOGIN in self.parent().server_methods:
+                # The server checks the password again and issues the token later calls carry.
+                # A server without rpc.login never asked for the password, so it is not sent.
+                client = self.parent().udp_client
+                emitter = client.signal_emitter
+                client.submit_login(self.username_input.text(), self.password_input.text()).add_done_callback(
+                    lambda future: emitter.status_update.emit(_login_status(future.result())))
+            QMessageBox.information(self, 'Login Successful', f'Welcome {self.username_input.text()}')
+            self.accept()
+        elif result == WRONG_PASSWORD:
+            QMessageBox.warning(self, 'Login Failed', 'Password is wrong')
+        else:
+            QMessageBox.warning(self, 'Login Failed', 'Username not found in database')
 
     def show_signup(self):
         self.hide()
@@ -157,8 +117,11 @@ class SignupWindow(QDialog):
         if self.password_input.text() != self.confirm_password_input.text():
             QMessageBox.warning(self, 'Sign Up Failed', 'Passwords do not match')
             return
-        with open("login_data.txt", "a") as login_database:
-            login_database.write(f"{self.username_input.text()} {self.password_input.text()}\n")
+        try:
+            self.parent().credentials.add(self.username_input.text(), self.password_input.text(), self.email_input.text())
+        except ValueError as e:
+            QMessageBox.warning(self, 'Sign Up Failed', str(e))
+            return
         QMessageBox.information(self, 'Sign Up Successful', 'You can now log in with your new account')
         self.accept()
 
@@ -166,10 +129,25 @@ class UDPRPCClient(QMainWindow):
     def __init__(self):
         super().__init__()
         self.logged_in_user = ""
+        self.server_methods = set()  # Names from the server's method list
+        # Loaded once; logins and sign-ups then look accounts up in memory.
+        self.credentials = CredentialStore(CREDENTIALS_FILE)
         self.initUI()
         self.udp_client = ReliableUDPClient(('127.0.0.1', 8000))
         self.udp_client.signal_emitter.status_update.connect(self.update_status)
-        self.udp_client.signal_emitter.log_update.connect(self.update_log)
+        self.udp_client.signal_emitter.call_progress.connect(self.update_progress)
+        self.udp_client.signal_emitter.call_finished.connect(self.show_response)
+        self.udp_client.signal_emitter.methods_found.connect(self.update_functions)
+        self.call_id = 0
+        self.pending_call_id = None  # The call whose events are shown; None once it has finished
+        self.current_call = None
+        self.udp_client.log_sink.add_handler(self.update_log)
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.udp_client.log_sink.flush)
+        self.log_timer.start(int(FLUSH_INTERVAL * 1000))
+        # The combo box starts with the built-in methods and is replaced by the server's list when it arrives.
+        emitter = self.udp_client.signal_emitter
+        self.udp_client.submit_describe().add_done_callback(lambda future: emitter.methods_found.emit(future.result()))
         self.show_login()
 
     def initUI(self):
@@ -391,6 +369,7 @@ class UDPRPCClient(QMainWindow):
         log_layout = QVBoxLayout()
         self.log_text = QTextEdit()
         self.log_text.setReadOnly(True)
+        self.log_text.document().setMaximumBlockCount(MAX_VIEW_LINES)
         log_layout.addWidget(self.log_text)
         log_tab.setLayout(log_layout)
         self.tab_widget.addTab(log_tab, "Log")
@@ -422,6 +401,7 @@ class UDPRPCClient(QMainWindow):
 
     def logout(self):
         self.logged_in_user = ""
+        self.udp_client.logout()
         self.hide()
         self.show_login()
 
@@ -476,51 +456,89 @@ class UDPRPCClient(QMainWindow):
                 self.call_button.setEnabled(True)
                 return
 
+        # Only shows up if the call takes a while, so fast calls do not flash a dialog.
         self.progress = QProgressDialog("Calling remote function...", "Cancel", 0, 100, self)
         self.progress.setWindowModality(Qt.WindowModality.WindowModal)
         self.progress.setAutoReset(False)
         self.progress.setAutoClose(False)
+        self.progress.setMinimumDuration(PROGRESS_DELAY_MS)
         self.progress.setValue(0)
-        self.progress.show()
+        self.progress.canceled.connect(self.cancel_call)
+
+        # The call runs on the client's receiver thread; its events come back as signals.
+        self.call_id += 1
+        call_id = self.call_id
+        self.current_function = function
+        self.current_params = params
+        # Set before submitting: submit() reports the first send before it returns.
+        self.pending_call_id = call_id
+        emitter = self.udp_client.signal_emitter
+        self.current_call = self.udp_client.submit(
+            function, params, progress=lambda event, attempt: emitter.call_progress.emit(call_id, event, attempt))
+        self.current_call.add_done_callback(lambda future: emitter.call_finished.emit(call_id, future))
+
+    def update_progress(self, call_id, event, attempt):
+        if call_id != self.pending_call_id:
+            return
+        if event == client_backend.SENT:
+            message = "Request sent" if attempt == 1 else f"No acknowledgment, retrying ({attempt}/{client_backend.MAX_RETRIES})"
+            self.progress.setValue(max(self.progress.value(), 30))
+        else:
+            message = "Request acknowledged, waiting for response..."
+            self.progress.setValue(max(self.progress.value(), 60))
+        self.update_status(message)
 
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(lambda: self.update_progress(function, params))
-        self.timer.start(100) 
+    def cancel_call(self):
+        if self.current_call is not None:
+            self.current_call.cancel()
 
-    def update_progress(self, function, params):
-        if self.progress.wasCanceled():
+    def show_response(self, call_id, future):
+        if call_id != self.pending_call_id:
+            return
+        self.pending_call_id = None
+        self.current_call = None
+        function, params = self.current_function, self.current_params
+        if future.cancelled():
             self.status_label.setText("Status: Operation canceled")
             self.call_button.setEnabled(True)
-            self.timer.stop()
+            self.progress.close()
             return
 
-        current_value = self.progress.value()
-        if current_value < 100:
-            self.progress.setValue(current_value + 5)
+        response, response_time = future.result()
+        if response_time is not None:
+            self.result_text.setPlainText(f"Result: {response}\nResponse time: {response_time:.2f} ms")
+            summary = f"""
+            <table border='1' cellpadding='5'>
+            <tr><th>Function</th><td>{function}</td></tr>
+            <tr><th>Arguments</th><td>{', '.join(map(str, params))}</td></tr>
+            <tr><th>Response</th><td>{response}</td></tr>
+            <tr><th>Response Time</th><td>{response_time:.2f} ms</td></tr>
+            </table>
+            """
+            self.summary_table.setHtml(summary)
+            self.status_label.setText("Status: Function call successful, sent acknowledgment")
         else:
-            self.timer.stop()
-            self.status_label.setText("Status: Waiting for response...")
-
-            response, response_time = self.udp_client.send_request(function, args=params)
-
-            if response is not None:
-                self.result_text.setPlainText(f"Result: {response}\nResponse time: {response_time:.2f} ms")
-                summary = f"""
-                <table border='1' cellpadding='5'>
-                <tr><th>Function</th><td>{function}</td></tr>
-                <tr><th>Arguments</th><td>{', '.join(map(str, params))}</td></tr>
-                <tr><th>Response</th><td>{response}</td></tr>
-                <tr><th>Response Time</th><td>{response_time:.2f} ms</td></tr>
-                </table>
-                """
-                self.summary_table.setHtml(summary)
-                self.status_label.setText("Status: Function call successful, sent acknowledgment")
-            else:
-                self.result_text.setPlainText("Error: Function call failed")
-                self.status_label.setText("Status: Function call failed")
+            # Lost, refused while the server stayed busy, or out of time.
+            self.result_text.setPlainText(response or "Error: Function call failed")
+            self.status_label.setText("Status: Function call failed")
 
-            self.call_button.setEnabled(True)
-            self.progress.close()
+        self.call_button.setEnabled(True)
+        self.progress.close()
+
+    def update_functions(self, methods):
+        if not methods:
+            return
+        self.server_methods = {method['name'] for method in methods}
+        current = self.function_combo.currentText()
+        self.function_combo.clear()
+        for method in methods:
+            if method['name'].startswith(SYSTEM_PREFIX):
+                continue
+            self.function_combo.addItem(method['name'])
+            self.function_combo.setItemData(self.function_combo.count() - 1, client_backend.format_method(method),
+                                            Qt.ItemDataRole.ToolTipRole)
+        index = self.function_combo.findText(current)
+        self.function_combo.setCurrentIndex(max(index, 0))
 
     def update_status(self, message):
         self.status_label.setText(f"Status: {message}")
@@ -528,14 +546,9 @@ class UDPRPCClient(QMainWindow):
         if hasattr(self, 'progress') and self.progress.isVisible():
             self.progress.setLabelText(message)
 
-        QApplication.processEvents()
-
-    def update_log(self, message):
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-        formatted_message = f"{timestamp} - {message}"
-        self.log_text.append(formatted_message)
+    def update_log(self, records):
+        self.log_text.append('\n'.join(format_line(created, text) for created, level, channel, text in records))
         self.log_text.ensureCursorVisible()
-        QApplication.processEvents()
 
     def update_user_info(self):
         self.user_info_label.setText(f"Welcome, {self.logged_in_user}")
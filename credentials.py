@@ -0,0 +1,191 @@
+import os
+import hmac
+import base64
+import hashlib
+import threading
+
+# Accounts are kept in an append-only log, one line per change:
+#   username <TAB> pbkdf2_sha256$<iterations>$<salt>$<hash> <TAB> email
+#   username <TAB> -                                 (account removed)
+# The last line for a username wins. Lines of the original format,
+# 'username password' in plaintext, are still read; such a password is
+# hashed the next time its owner logs in. The whole log is read once into a
+# dict, so a lookup costs the same for ten accounts as for a million.
+
+CREDENTIALS_FILE = 'login_data.txt'
+ITERATIONS = 600_000  # PBKDF2-HMAC-SHA256 rounds for new hashes; about 0.3 s on a laptop core
+SALT_BYTES = 16
+COMPACT_MIN = 1000  # Superseded lines tolerated before the log is rewritten
+SCHEME = 'pbkdf2_sha256'
+_REMOVED = '-'
+
+# Results of CredentialStore.verify().
+VALID = 'valid'
+WRONG_PASSWORD = 'wrong password'
+UNKNOWN_USER = 'unknown user'
+
+
+class DuplicateUser(ValueError):
+    pass
+
+
+def hash_password(password, iterations=ITERATIONS, salt=None):
+    salt = os.urandom(SALT_BYTES) if salt is None else salt
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f'{SCHEME}${iterations}${_b64(salt)}${_b64(digest)}'
+
+
+def check_password(password, encoded):
+    # -> (matches, iterations); iterations is None for a plaintext password.
+    scheme, _, rest = encoded.partition('$')
+    if scheme != SCHEME:
+        return hmac.compare_digest(password.encode(), encoded.encode()), None
+    iterations, salt, digest = rest.split('$')
+    iterations = int(iterations)
+    candidate = hashlib.pbkdf2_hmac('sha256', password.encode(), base64.b64decode(salt), iterations)
+    return hmac.compare_digest(candidate, base64.b64decode(digest)), iterations
+
+
+def _b64(data):
+    return base64.b64encode(data).decode()
+
+
+def _check_username(username):
+    if not username or username != username.strip() or any(character.isspace() for character in username):
+        raise ValueError('Usernames cannot be empty or contain spaces')
+
+
+class Account:
+    __slots__ = ('username', 'password', 'email')
+
+    def __init__(self, username, password, email=''):
+        self.username = username
+        self.password = password  # Encoded hash, or the plaintext of a legacy line
+        self.email = email
+
+
+class CredentialStore:
+    """Accounts by username, loaded once from an append-only log file.
+
+    add() refuses a username that is taken, verify() checks a password in
+    constant time and returns VALID, WRONG_PASSWORD or UNKNOWN_USER, and
+    both cost one dict lookup plus the password hash. Every change is
+    appended and fsynced before it is applied in memory. Passwords are
+    stored as salted PBKDF2 hashes of iterations rounds; a login with a
+    weaker or plaintext entry rewrites it at the current cost. Once more
+    than compact_min lines are superseded, and more of them than live
+    accounts, the log is rewritten with only the current lines.
+    """
+
+    def __init__(self, path=CREDENTIALS_FILE, iterations=ITERATIONS, compact_min=COMPACT_MIN):
+        self.path = path
+        self.iterations = iterations
+        self.compact_min = compact_min
+        self._accounts = {}
+        self._stale = 0  # Lines in the file that a later line supersedes
+        self._unterminated = False  # The file does not end with a line break
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def __contains__(self, username):
+        return username in self._accounts
+
+    def get(self, username):
+        return self._accounts.get(username)
+
+    def add(self, username, password, email=''):
+        _check_username(username)
+        if '\t' in email or '\n' in email:
+            raise ValueError('Email addresses cannot contain tabs or line breaks')
+        encoded = hash_password(password, self.iterations)
+        with self._lock:
+            if username in self._accounts:
+                raise DuplicateUser(f"Username '{username}' is already taken")
+            self._write(Account(username, encoded, email))
+
+    def verify(self, username, password):
+        account = self._accounts.get(username)
+        if account is None:
+            return UNKNOWN_USER
+        matches, iterations = check_password(password, account.password)
+        if not matches:
+            return WRONG_PASSWORD
+        if iterations is None or iterations < self.iterations:
+            self.set_password(username, password)
+        return VALID
+
+    def set_password(self, username, password):
+        encoded = hash_password(password, self.iterations)
+        with self._lock:
+            account = self._accounts.get(username)
+            if account is None:
+                raise KeyError(username)
+            self._write(Account(username, encoded, account.email))
+
+    def remove(self, username):
+        with self._lock:
+            if username not in self._accounts:
+                raise KeyError(username)
+            self._write(Account(username, _REMOVED))
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as log:
+                text = log.read()
+        except FileNotFoundError:
+            return
+        self._unterminated = bool(text) and not text.endswith('\n')
+        lines = text.splitlines()
+        accounts = self._accounts
+        for line in lines:
+            if '\t' in line:
+                username, password, *email = line.split('\t')
+                email = email[0] if email else ''
+            else:
+                fields = line.split()
+                if len(fields) != 2:
+                    continue
+                (username, password), email = fields, ''
+            if username in accounts:
+                self._stale += 1
+            if password == _REMOVED:
+                self._stale += 1
+                accounts.pop(username, None)
+                continue
+            accounts[username] = Account(username, password, email)
+
+    def _write(self, account):
+        with open(self.path, 'a', encoding='utf-8') as log:
+            log.write('\n' * self._unterminated + self._line(account))
+            log.flush()
+            os.fsync(log.fileno())
+        self._unterminated = False
+        if account.username in self._accounts:
+            self._stale += 1
+        if account.password == _REMOVED:
+            self._stale += 1
+            del self._accounts[account.username]
+        else:
+            self._accounts[account.username] = account
+        if self._stale > max(self.compact_min, len(self._accounts)):
+            self._compact()
+
+    def _compact(self):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as log:
+            log.writelines(map(self._line, self._accounts.values()))
+            log.flush()
+            os.fsync(log.fileno())
+        os.replace(temporary, self.path)
+        self._stale = 0
+
+    @staticmethod
+    def _line(account):
+        return f'{account.username}\t{account.password}\t{account.email}\n'
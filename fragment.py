@@ -0,0 +1,249 @@
+import socket
+import random
+import struct
+import threading
+from collections import OrderedDict, deque
+
+from rtt import MAX_PEERS
+
+# Messages larger than one datagram are split into fragments, each with
+#   magic (2s) | version (B) | kind (B) | flags (B) | message id (I) | index (H) | count (H)
+# The receiver reassembles them and answers gaps with a NACK listing the
+# missing indices; only those fragments are sent again. A retransmit of a
+# whole fragmented message is replaced by a probe (its last fragment), which
+# draws either a NACK or, when the message already arrived, a DONE frame.
+MAGIC = b'RF'
+VERSION = 1
+HEADER = struct.Struct('!2sBBBIHH')
+
+FRAG_DATA = 1
+FRAG_NACK = 2
+FRAG_DONE = 3
+
+FLAG_PROBE = 0x01
+
+MAX_DATAGRAM = 1400  # Payload bytes per datagram when the path MTU is unknown
+UDP_MAX_PAYLOAD = 65507
+IP_UDP_OVERHEAD = 28
+SOCKET_BUFFER = 4 * 1024 * 1024
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+MAX_REASSEMBLY_BYTES = 64 * 1024 * 1024  # Across all partially received messages
+SEND_CACHE_BYTES = 64 * 1024 * 1024  # Fragments kept for NACKs until the message is acknowledged
+REASSEMBLY_TIMEOUT = 10.0
+COMPLETED_HISTORY = 4096
+MAX_NACK_INDICES = 512
+
+
+def is_fragment(data):
+    return data[:2] == MAGIC
+
+
+def path_mtu(address):
+    """Largest UDP payload that should reach address without IP fragmentation."""
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        probe.connect(address)
+        mtu = probe.getsockopt(socket.IPPROTO_IP, getattr(socket, 'IP_MTU', 14))
+    except OSError:
+        return MAX_DATAGRAM
+    finally:
+        probe.close()
+    return max(MAX_DATAGRAM, min(mtu - IP_UDP_OVERHEAD, UDP_MAX_PAYLOAD))
+
+
+def set_buffer_sizes(sock, size=SOCKET_BUFFER):
+    # Fragment bursts overflow the default buffers long before the link is busy.
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, size)
+        except OSError:
+            pass
+
+
+class _Outgoing:
+    __slots__ = ('peer', 'tag', 'fragments', 'size')
+
+    def __init__(self, peer, tag, fragments):
+        self.peer = peer
+        self.tag = tag
+        self.fragments = fragments
+        self.size = sum(map(len, fragments))
+
+
+class _Partial:
+    __slots__ = ('fragments', 'received', 'size', 'highest', 'touched')
+
+    def __init__(self, count, now):
+        self.fragments = [None] * count
+        self.received = 0
+        self.size = 8 * count  # Count the slot list too, so a bogus count cannot dodge the limits
+        self.highest = -1
+        self.touched = now
+
+
+class Fragmenter:
+    """Splits outgoing messages and reassembles incoming ones, per peer.
+
+    split() hands back the datagrams for a message and keeps the fragments
+    until release() so NACKs can be answered; receive() takes every datagram
+    for which is_fragment() is true and returns (message, replies, tag), where
+    message is a reassembled datagram or None and tag identifies one of our
+    own messages the peer reported as complete.
+    """
+
+    def __init__(self, max_datagram=None, cache_bytes=SEND_CACHE_BYTES, max_message=MAX_MESSAGE_BYTES,
+                 max_reassembly=MAX_REASSEMBLY_BYTES, timeout=REASSEMBLY_TIMEOUT):
+        self.max_datagram = max_datagram
+        self.cache_bytes = cache_bytes
+        self.max_message = max_message
+        self.max_reassembly = max_reassembly
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # Random like a TCP initial sequence number, so a peer that reuses our
+        # address does not collide with our recent message ids.
+        self._message_id = random.getrandbits(32)
+        self._outgoing = OrderedDict()  # message_id -> _Outgoing
+        self._outgoing_size = 0
+        self._partial = OrderedDict()  # (peer, message_id) -> _Partial, least recently touched first
+        self._partial_size = 0
+        self._completed = deque(maxlen=COMPLETED_HISTORY)
+        self._completed_set = set()
+        self._mtu = OrderedDict()
+
+    def datagram_size(self, peer):
+        if self.max_datagram is not None:
+            return self.max_datagram
+        with self._lock:
+            size = self._mtu.get(peer)
+            if size is not None:
+                self._mtu.move_to_end(peer)
+                return size
+        size = path_mtu(peer)
+        with self._lock:
+            self._mtu[peer] = size
+            if len(self._mtu) > MAX_PEERS:
+                self._mtu.popitem(last=False)
+        return size
+
+    def split(self, data, peer, tag=None):
+        chunk = self.datagram_size(peer) - HEADER.size
+        if len(data) <= chunk + HEADER.size:
+            return None, [data]
+        count = -(-len(data) // chunk)
+        if count > 0xffff:
+            raise ValueError(f'Message of {len(data)} bytes needs more than {0xffff} fragments')
+        with self._lock:
+            message_id = self._message_id
+            self._message_id = (message_id + 1) & 0xffffffff
+        view = memoryview(data)
+        fragments = [HEADER.pack(MAGIC, VERSION, FRAG_DATA, 0, message_id, index, count) + view[offset:offset + chunk]
+                     for index, offset in enumerate(range(0, len(data), chunk))]
+        outgoing = _Outgoing(peer, tag, fragments)
+        with self._lock:
+            self._outgoing[message_id] = outgoing
+            self._outgoing_size += outgoing.size
+            while self._outgoing_size > self.cache_bytes and len(self._outgoing) > 1:
+                self._outgoing_size -= self._outgoing.popitem(last=False)[1].size
+        return message_id, fragments
+
+    def probe(self, message_id):
+        with self._lock:
+            outgoing = self._outgoing.get(message_id)
+        if outgoing is None:
+            return None
+        last = bytearray(outgoing.fragments[-1])
+        last[4] = FLAG_PROBE
+        return [bytes(last)]
+
+    def release(self, message_id):
+        if message_id is None:
+            return
+        with self._lock:
+            outgoing = self._outgoing.pop(message_id, None)
+            if outgoing is not None:
+                self._outgoing_size -= outgoing.size
+
+    def receive(self, data, peer, now):
+        try:
+            magic, version, kind, flags, message_id, index, count = HEADER.unpack_from(data)
+        except struct.error:
+            return None, [], None
+        if version != VERSION:
+            return None, [], None
+        if kind == FRAG_DATA:
+            return self._receive_fragment(data, peer, now, flags, message_id, index, count)
+        with self._lock:
+            outgoing = self._outgoing.get(message_id)
+            if outgoing is None or outgoing.peer != peer:
+                return None, [], None
+            if kind == FRAG_DONE:
+                self._outgoing_size -= self._outgoing.pop(message_id).size
+                return None, [], outgoing.tag
+        if kind != FRAG_NACK:
+            return None, [], None
+        missing = struct.unpack_from(f'!{(len(data) - HEADER.size) // 2}H', data, HEADER.size)
+        return None, [outgoing.fragments[index] for index in missing if index < len(outgoing.fragments)], None
+
+    def _receive_fragment(self, data, peer, now, flags, message_id, index, count):
+        key = (peer, message_id)
+        probe = flags & FLAG_PROBE
+        with self._lock:
+            self._expire(now)
+            if key in self._completed_set:
+                return None, [self._frame(FRAG_DONE, message_id)] if probe else [], None
+            partial = self._partial.get(key)
+            if partial is None:
+                if index >= count:
+                    return None, [], None
+                partial = self._partial[key] = _Partial(count, now)
+                self._partial_size += partial.size
+            elif index >= len(partial.fragments):
+                return None, [], None
+            else:
+                self._partial.move_to_end(key)
+            partial.touched = now
+
+            gap = range(0)
+            if partial.fragments[index] is None:
+                chunk = bytes(data[HEADER.size:])  # data may be a view into a reused receive buffer
+                partial.fragments[index] = chunk
+                partial.received += 1
+                partial.size += len(chunk)
+                self._partial_size += len(chunk)
+                if partial.size > self.max_message:
+                    self._drop(key)
+                    return None, [], None
+                if partial.received == len(partial.fragments):
+                    self._drop(key)
+                    if len(self._completed) == self._completed.maxlen:
+                        self._completed_set.discard(self._completed[0])
+                    self._completed.append(key)
+                    self._completed_set.add(key)
+                    return b''.join(partial.fragments), [], None
+                if index > partial.highest + 1:
+                    gap = range(partial.highest + 1, index)
+                partial.highest = max(partial.highest, index)
+            if probe:
+                gap = range(len(partial.fragments))
+            while self._partial_size > self.max_reassembly and self._partial:
+                self._drop(next(iter(self._partial)))
+            if key not in self._partial:
+                return None, [], None
+            missing = [i for i in gap if partial.fragments[i] is None][:MAX_NACK_INDICES]
+        if not missing:
+            return None, [], None
+        return None, [self._frame(FRAG_NACK, message_id, struct.pack(f'!{len(missing)}H', *missing))], None
+
+    def _frame(self, kind, message_id, payload=b''):
+        return HEADER.pack(MAGIC, VERSION, kind, 0, message_id, 0, 0) + payload
+
+    def _drop(self, key):
+        partial = self._partial.pop(key)
+        self._partial_size -= partial.size
+
+    def _expire(self, now):
+        while self._partial:
+            key, partial = next(iter(self._partial.items()))
+            if now - partial.touched < self.timeout:
+                break
+            self._drop(key)
@@ -0,0 +1,82 @@
+SUB_BUCKET_BITS = 8  # 256 linear steps per power of two: under 1% relative error
+MAX_VALUE = 1 << 40  # Larger values are clamped
+
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+_HALF = _SUB_BUCKETS >> 1
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def _index(value):
+    if value < _SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return _SUB_BUCKETS + (shift - 1) * _HALF + (value >> shift) - _HALF
+
+
+def _highest(index):
+    # Largest value that lands in the bucket at index.
+    if index < _SUB_BUCKETS:
+        return index
+    shift, sub = divmod(index - _SUB_BUCKETS, _HALF)
+    return ((sub + _HALF + 1) << (shift + 1)) - 1
+
+
+class Histogram:
+    """Log-linear histogram of non-negative integers, in the style of HdrHistogram.
+
+    Values below 256 are counted exactly; above that every power of two is
+    split into 128 buckets, so a percentile is reported within 1% of the
+    true value with a fixed 4 k counters however many values are recorded.
+    Not thread-safe: give each thread its own and merge() them.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (_index(MAX_VALUE) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value, count=1):
+        value = min(max(int(value), 0), MAX_VALUE)
+        self.counts[_index(value)] += count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percent):
+        if not self.count:
+            return None
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(_highest(index), self.max)
+        return self.max
+
+    def summary(self, percentiles=PERCENTILES):
+        summary = {'count': self.count, 'min': self.min, 'max': self.max, 'mean': self.mean()}
+        summary.update((f'p{percent:g}'.replace('.', ''), self.percentile(percent)) for percent in percentiles)
+        return summary
+
+    def buckets(self):
+        """[highest value, count] for every non-empty bucket."""
+        return [[_highest(index), count] for index, count in enumerate(self.counts) if count]
@@ -0,0 +1,143 @@
+import sys
+import time
+import reprlib
+import itertools
+import threading
+from logging import DEBUG, INFO, WARNING, ERROR
+
+# The network loops log through hooks called as hook(message, *args), where
+# message is a %-format string. Nothing is formatted on the calling thread.
+
+RING_SIZE = 16384
+FLUSH_INTERVAL = 0.1  # Seconds between flushes to the handlers
+MAX_FLUSH_LINES = 1000  # Older records beyond this many per flush are counted, not shown
+MAX_VIEW_LINES = 5000  # Lines a log view keeps
+
+_brief = reprlib.Repr()
+_brief.maxlist = _brief.maxtuple = _brief.maxset = _brief.maxfrozenset = 32
+_brief.maxdict = 16
+_brief.maxstring = _brief.maxother = 256
+_brief.maxlong = 64
+
+
+def _shorten(value):
+    # A call with a million arguments should not cost a million-element repr in the log.
+    if isinstance(value, (list, tuple, dict, set, frozenset, bytes, bytearray)):
+        return _brief.repr(value)
+    if isinstance(value, int) and value.bit_length() > 256:
+        return _brief.repr(value)
+    return value
+
+
+def format_message(message, args):
+    if not args:
+        return message
+    try:
+        return message % tuple(map(_shorten, args))
+    except (TypeError, ValueError):
+        return f'{message} {args!r}'
+
+
+def format_line(created, text):
+    return f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))} - {text}"
+
+
+def stream_handler(stream=None):
+    """Handler writing each batch to stream (stdout by default) with one write."""
+    def write(records):
+        out = stream or sys.stdout
+        out.write(''.join(format_line(created, text) + '\n' for created, level, channel, text in records))
+        out.flush()
+    return write
+
+
+class LogSink:
+    """Log records in a fixed-size ring buffer, formatted only when flushed.
+
+    emit() is cheap enough for the packet path: it takes the next slot and
+    stores a tuple, with no lock and no formatting. flush() formats whatever
+    arrived since the last flush and passes each handler one list of
+    (created, level, channel, text) tuples. Records the writers overwrote
+    before a flush, and any beyond max_lines in one flush, are dropped and
+    reported as a count instead. start() flushes from a background thread;
+    a GUI can call flush() from a timer instead.
+    """
+
+    def __init__(self, capacity=RING_SIZE, max_lines=MAX_FLUSH_LINES):
+        self.capacity = capacity
+        self.max_lines = max_lines
+        self._ring = [None] * capacity
+        self._counter = itertools.count()
+        self._read = 0
+        self._handlers = []  # (handler, channels or None for all, minimum level)
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._flusher = None
+
+    def hook(self, channel, level=INFO):
+        emit = self.emit
+
+        def log(message, *args):
+            emit(level, channel, message, args)
+        return log
+
+    def emit(self, level, channel, message, args=()):
+        # next() on itertools.count is atomic under the GIL, so concurrent
+        # writers never share a slot.
+        index = next(self._counter)
+        self._ring[index % self.capacity] = (index, time.time(), level, channel, message, args)
+
+    def add_handler(self, handler, channels=None, level=DEBUG):
+        self._handlers.append((handler, frozenset(channels) if channels is not None else None, level))
+
+    def flush(self):
+        with self._flush_lock:
+            records, dropped = self._take()
+            if not records and not dropped:
+                return
+            lines = [(created, level, channel, format_message(message, args))
+                     for index, created, level, channel, message, args in records]
+            if dropped:
+                lines.insert(0, (time.time(), WARNING, None, f'{dropped} log messages dropped'))
+            for handler, channels, minimum in self._handlers:
+                batch = [line for line in lines
+                         if line[1] >= minimum and (channels is None or line[2] is None or line[2] in channels)]
+                if batch:
+                    handler(batch)
+
+    def start(self, interval=FLUSH_INTERVAL):
+        self._flusher = threading.Thread(target=self._flush_loop, args=(interval,), name='log-flusher', daemon=True)
+        self._flusher.start()
+        return self
+
+    def close(self):
+        self._stopped.set()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join()
+        self.flush()
+
+    def _flush_loop(self, interval):
+        while not self._stopped.wait(interval):
+            self.flush()
+
+    def _take(self):
+        records = []
+        dropped = 0
+        position = self._read
+        while len(records) < self.capacity:
+            record = self._ring[position % self.capacity]
+            if record is None or record[0] < position:
+                break  # Not written yet
+            if record[0] > position:
+                # The writers lapped us; only the last ring's worth survives.
+                oldest = record[0] - self.capacity + 1
+                dropped += oldest - position
+                position = oldest
+                continue
+            records.append(record)
+            position += 1
+        self._read = position
+        if len(records) > self.max_lines:
+            dropped += len(records) - self.max_lines
+            records = records[-self.max_lines:]
+        return records, dropped
@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+MEMO_SIZE = 4096
+MAX_KEY_ITEMS = 256  # Calls with bigger arguments are not worth hashing
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize currsize')
+
+_SCALARS = (type(None), bool, int, str, bytes)
+
+
+class Uncacheable(Exception):
+    pass
+
+
+def canonical_key(args, kwargs):
+    """Hashable form of a call's arguments in which equal values of different
+    types stay distinct (1, 1.0 and True; 0.0 and -0.0), lists and tuples are
+    the same, and kwargs order does not matter. Raises Uncacheable for
+    arguments that are too large or of types it does not know."""
+    budget = [MAX_KEY_ITEMS]
+    return _freeze(args, budget), _freeze(kwargs, budget)
+
+
+def _freeze(value, budget):
+    budget[0] -= 1
+    if budget[0] < 0:
+        raise Uncacheable('arguments too large')
+    kind = type(value)
+    if kind is float:
+        return float, value.hex()
+    if kind in _SCALARS:
+        return kind, value
+    if kind is list or kind is tuple:
+        return list, tuple(_freeze(item, budget) for item in value)
+    if kind is dict:
+        try:
+            return dict, tuple(sorted((key, _freeze(item, budget)) for key, item in value.items()))
+        except TypeError:
+            raise Uncacheable('dict keys cannot be ordered') from None
+    raise Uncacheable(f'cannot hash arguments of type {kind.__name__}')
+
+
+class ResultCache:
+    """Least recently used results of a pure method, with hit/miss counters."""
+
+    def __init__(self, maxsize=MEMO_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                result = self._results[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._results.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            if len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.hits = self.misses = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._results))
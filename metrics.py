@@ -0,0 +1,221 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from histogram import Histogram
+
+# Upper bounds, in seconds, of the buckets exported for Prometheus histograms.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+UNKNOWN_METHOD = '<unknown>'  # Label for calls to methods that are not registered
+BATCH_METHOD = '<batch>'  # Label for a batch of calls to several methods
+
+
+class Counter:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Timer:
+    """Durations in seconds, kept in a Histogram of microseconds."""
+
+    __slots__ = ('histogram', '_lock')
+
+    def __init__(self):
+        self.histogram = Histogram()
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.histogram.record(seconds * 1e6)
+
+    def snapshot(self):
+        with self._lock:
+            summary = self.histogram.summary()
+        return {key: value if key == 'count' or value is None else value / 1e6 for key, value in summary.items()}
+
+    def cumulative(self, bounds):
+        # Counts of observations at or below each bound, to within the histogram's 1%.
+        with self._lock:
+            buckets = self.histogram.buckets()
+            count, total = self.histogram.count, self.histogram.total
+        counts, seen, position = [], 0, 0
+        for bound in bounds:
+            while position < len(buckets) and buckets[position][0] <= bound * 1e6:
+                seen += buckets[position][1]
+                position += 1
+            counts.append(seen)
+        return counts, count, total / 1e6
+
+
+class _Family:
+    """A metric name with one child per value of its label."""
+
+    def __init__(self, kind, name, description, label, factory):
+        self.kind = kind
+        self.name = name
+        self.description = description
+        self.label = label
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, value):
+        child = self._children.get(value)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(value, self._factory())
+        return child
+
+    def children(self):
+        with self._lock:
+            return sorted(self._children.items())
+
+
+class MetricsRegistry:
+    """Named counters and timers, readable as a dict or as Prometheus text.
+
+    counter() and timer() return the metric itself, or with label= a family
+    whose labels(value) returns one per label value. Updates take a
+    per-metric lock, so they are safe from any thread and cost well under a
+    microsecond.
+    """
+
+    def __init__(self):
+        self._metrics = {}  # name -> (kind, description, metric or _Family)
+        self._lock = threading.Lock()
+
+    def counter(self, name, description, label=None):
+        return self._register('counter', name, description, label, Counter)
+
+    def timer(self, name, description, label=None):
+        return self._register('histogram', name, description, label, Timer)
+
+    def _register(self, kind, name, description, label, factory):
+        metric = factory() if label is None else _Family(kind, name, description, label, factory)
+        with self._lock:
+            if name in self._metrics:
+                raise ValueError(f'Metric {name} is already registered')
+            self._metrics[name] = (kind, description, metric)
+        return metric
+
+    def snapshot(self):
+        snapshot = {}
+        with self._lock:
+            metrics = list(self._metrics.items())
+        for name, (kind, description, metric) in metrics:
+            if isinstance(metric, _Family):
+                snapshot[name] = {value: child.snapshot() for value, child in metric.children()}
+            else:
+                snapshot[name] = metric.snapshot()
+        return snapshot
+
+    def render(self):
+        """The registry in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.items())
+        for name, (kind, description, metric) in metrics:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            if isinstance(metric, _Family):
+                children = [(f'{metric.label}="{_escape(value)}"', child) for value, child in metric.children()]
+            else:
+                children = [('', metric)]
+            for labels, child in children:
+                if kind == 'counter':
+                    lines.append(f'{name}{_braces(labels)} {child.value}')
+                    continue
+                counts, count, total = child.cumulative(LATENCY_BUCKETS)
+                prefix = labels + ',' if labels else ''
+                for bound, seen in zip(LATENCY_BUCKETS, counts):
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound:g}"}} {seen}')
+                lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {count}')
+                lines.append(f'{name}_sum{_braces(labels)} {total:.6f}')
+                lines.append(f'{name}_count{_braces(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _braces(labels):
+    return f'{{{labels}}}' if labels else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RPCMetrics:
+    """The server's metrics; see README for what each one counts."""
+
+    def __init__(self, registry=None):
+        self.registry = registry if registry is not None else MetricsRegistry()
+        counter, timer = self.registry.counter, self.registry.timer
+        self.requests = counter('rpc_requests_total', 'Calls executed, per method.', 'method')
+        self.errors = counter('rpc_errors_total', 'Calls that raised or returned an error string, per method.', 'method')
+        self.execution = timer('rpc_execution_seconds', 'Time spent running the method, per method.', 'method')
+        self.latency = timer('rpc_latency_seconds', 'From receiving a request to sending its response, per method.',
+                             'method')
+        self.retransmissions = counter('rpc_retransmissions_total', 'Responses sent again for lack of an ACK.')
+        self.duplicates = counter('rpc_duplicate_requests_total', 'Retransmitted requests answered without running.')
+        self.ack_timeouts = counter('rpc_ack_timeouts_total', 'Responses given up on after the last retransmission.')
+        self.bytes_received = counter('rpc_received_bytes_total', 'UDP payload bytes received.')
+        self.bytes_sent = counter('rpc_sent_bytes_total', 'UDP payload bytes sent.')
+        self.datagrams_received = counter('rpc_received_datagrams_total', 'Datagrams received.')
+        self.datagrams_sent = counter('rpc_sent_datagrams_total', 'Datagrams sent.')
+        self.user_requests = counter('rpc_user_requests_total', 'Requests from logged-in users, per user.', 'user')
+        self.rejected = counter('rpc_rejected_total', 'Requests refused unexecuted, by reason (queue or rate).', 'reason')
+        self.abandoned = counter('rpc_abandoned_total', 'Requests dropped, or responses no longer resent, because the '
+                                 'client cancelled or the deadline passed, by reason (cancelled or deadline).', 'reason')
+        self.auth_failures = counter('rpc_auth_failures_total', 'Requests refused for lack of a valid session token.')
+
+    def received(self, size):
+        self.datagrams_received.inc()
+        self.bytes_received.inc(size)
+
+    def sent(self, size):
+        self.datagrams_sent.inc()
+        self.bytes_sent.inc(size)
+
+    def executed(self, method, seconds, errors=0, calls=1):
+        # A vectorized batch is calls requests timed as one execution.
+        self.requests.labels(method).inc(calls)
+        self.execution.labels(method).observe(seconds)
+        if errors:
+            self.errors.labels(method).inc(errors)
+
+    def answered(self, method, received_at, now):
+        self.latency.labels(method).observe(now - received_at)
+
+
+def serve_metrics(registry, host='127.0.0.1', port=9100):
+    """Serve registry.render() at /metrics from a daemon thread; returns the
+    HTTP server, whose shutdown() stops it."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
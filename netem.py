@@ -0,0 +1,228 @@
+import sys
+import time
+import heapq
+import random
+import signal
+import socket
+import argparse
+import itertools
+import selectors
+import threading
+
+# A UDP proxy that impairs traffic like Linux netem: it drops, duplicates,
+# delays, jitters, reorders and rate-limits datagrams between clients and a
+# server, with seeded randomness so a run can be repeated. Each client gets
+# its own upstream socket, so the server still sees one address per client.
+
+RECV_SIZE = 65535
+POLL_INTERVAL = 0.5
+REORDER_DELAY = 0.01  # Extra delay for a reordered datagram, so later ones overtake it
+QUEUE_BYTES = 1024 * 1024  # Backlog a rate-limited link holds before dropping
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class Impairment:
+    """What happens to datagrams travelling one way through the proxy.
+
+    loss, duplicate and reorder are probabilities per datagram; delay and
+    jitter are in seconds (jitter is uniform in +/- jitter and can reorder on
+    its own); bandwidth, in bytes per second, queues datagrams behind each
+    other and drops them once queue_bytes are waiting.
+    """
+
+    def __init__(self, loss=0.0, duplicate=0.0, reorder=0.0, delay=0.0, jitter=0.0, bandwidth=None,
+                 queue_bytes=QUEUE_BYTES, reorder_delay=REORDER_DELAY):
+        self.loss = loss
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.delay = delay
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.queue_bytes = queue_bytes
+        self.reorder_delay = reorder_delay
+
+    def active(self):
+        return bool(self.loss or self.duplicate or self.reorder or self.delay or self.jitter or self.bandwidth)
+
+
+class _Link:
+    def __init__(self, impairment, seed):
+        self.impairment = impairment
+        self.random = random.Random(seed)
+        self.next_free = 0.0
+        self.stats = dict.fromkeys(('received', 'sent', 'lost', 'duplicated', 'reordered', 'overflowed'), 0)
+
+    def schedule(self, size, now):
+        """Departure times for a datagram arriving now: none, one or two."""
+        impairment, rng = self.impairment, self.random
+        self.stats['received'] += 1
+        if rng.random() < impairment.loss:
+            self.stats['lost'] += 1
+            return []
+        copies = 1
+        if rng.random() < impairment.duplicate:
+            self.stats['duplicated'] += 1
+            copies = 2
+        departures = []
+        for _ in range(copies):
+            departure = now + impairment.delay
+            if impairment.jitter:
+                departure += rng.uniform(-impairment.jitter, impairment.jitter)
+            if impairment.reorder and rng.random() < impairment.reorder:
+                self.stats['reordered'] += 1
+                departure += impairment.reorder_delay
+            if impairment.bandwidth:
+                start = max(now, self.next_free)
+                if (start - now) * impairment.bandwidth + size > impairment.queue_bytes:
+                    self.stats['overflowed'] += 1
+                    continue
+                self.next_free = start + size / impairment.bandwidth
+                departure += self.next_free - now
+            departures.append(max(departure, now))
+        return departures
+
+
+class NetemProxy:
+    """Forwards datagrams between clients on listen and the server at target,
+    impairing upstream (client to server) and downstream traffic.
+
+    serve_forever() runs the proxy on the calling thread; start() runs it on
+    a background thread. stats() reports per-direction counters.
+    """
+
+    def __init__(self, target, listen=('127.0.0.1', 0), upstream=None, downstream=None, seed=0):
+        self.target = target
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(listen)
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+        self.upstream = _Link(upstream or Impairment(), seed * 2)
+        self.downstream = _Link(downstream or Impairment(), seed * 2 + 1)
+        self._clients = {}  # client address -> upstream socket
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.sock, selectors.EVENT_READ)
+        self._queue = []  # heap of (departure, order, socket, data, destination, link)
+        self._order = itertools.count()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='netem-proxy', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._running = True
+        try:
+            while self._running:
+                now = time.monotonic()
+                timeout = min(max(self._queue[0][0] - now, 0), POLL_INTERVAL) if self._queue else POLL_INTERVAL
+                for key, _ in self._selector.select(timeout):
+                    self._receive(key.fileobj, key.data)
+                self._send_due(time.monotonic())
+        finally:
+            self._selector.close()
+            for sock in [self.sock, *self._clients.values()]:
+                sock.close()
+
+    def close(self):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def stats(self):
+        return {'upstream': dict(self.upstream.stats), 'downstream': dict(self.downstream.stats)}
+
+    def _upstream_socket(self, client_address):
+        sock = self._clients.get(client_address)
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.connect(self.target)
+            sock.setblocking(False)
+            self._selector.register(sock, selectors.EVENT_READ, client_address)
+            self._clients[client_address] = sock
+        return sock
+
+    def _receive(self, sock, client_address):
+        while True:
+            try:
+                if client_address is None:
+                    data, source = sock.recvfrom(RECV_SIZE)
+                else:
+                    data = sock.recv(RECV_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return  # An ICMP error from an earlier send; the datagram is simply lost
+            now = time.monotonic()
+            if client_address is None:
+                link, out, destination = self.upstream, self._upstream_socket(source), None
+            else:
+                link, out, destination = self.downstream, self.sock, client_address
+            for departure in link.schedule(len(data), now):
+                heapq.heappush(self._queue, (departure, next(self._order), out, data, destination, link))
+
+    def _send_due(self, now):
+        while self._queue and self._queue[0][0] <= now:
+            _, _, sock, data, destination, link = heapq.heappop(self._queue)
+            try:
+                if destination is None:
+                    sock.send(data)
+                else:
+                    sock.sendto(data, destination)
+                link.stats['sent'] += 1
+            except OSError:
+                pass
+
+
+def add_impairment_arguments(parser):
+    group = parser.add_argument_group('network emulation (applied in both directions)')
+    group.add_argument('--loss', type=float, default=0.0, help='probability a datagram is dropped')
+    group.add_argument('--duplicate', type=float, default=0.0, help='probability a datagram is sent twice')
+    group.add_argument('--reorder', type=float, default=0.0, help=f'probability a datagram is held back {REORDER_DELAY * 1000:g} ms')
+    group.add_argument('--delay-ms', type=float, default=0.0, help='one-way delay')
+    group.add_argument('--jitter-ms', type=float, default=0.0, help='uniform +/- variation of the delay')
+    group.add_argument('--rate-kbit', type=float, default=0.0, help='bandwidth cap per direction')
+    group.add_argument('--netem-seed', type=int, default=0, help='seed for the random impairments')
+
+
+def impairment_from(options):
+    return Impairment(loss=options.loss, duplicate=options.duplicate, reorder=options.reorder,
+                      delay=options.delay_ms / 1000, jitter=options.jitter_ms / 1000,
+                      bandwidth=options.rate_kbit * 125 or None)
+
+
+def impairment_argv(options):
+    """The same options as command-line arguments, for a proxy in a child process."""
+    return ['--loss', str(options.loss), '--duplicate', str(options.duplicate), '--reorder', str(options.reorder),
+            '--delay-ms', str(options.delay_ms), '--jitter-ms', str(options.jitter_ms),
+            '--rate-kbit', str(options.rate_kbit), '--netem-seed', str(options.netem_seed)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='netem', description='UDP proxy that emulates a lossy, slow network')
+    parser.add_argument('--listen', default='127.0.0.1:9000', help='host:port clients send to')
+    parser.add_argument('--target', default='127.0.0.1:8000', help='host:port of the server')
+    add_impairment_arguments(parser)
+    options = parser.parse_args(argv)
+
+    impairment = impairment_from(options)
+    proxy = NetemProxy(parse_address(options.target), parse_address(options.listen), impairment, impairment,
+                       options.netem_seed)
+    signal.signal(signal.SIGTERM, lambda signum, frame: proxy.close())
+    print(f'Proxying {proxy.address[0]}:{proxy.address[1]} -> {options.target}', flush=True)
+    try:
+        proxy.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    for direction, stats in proxy.stats().items():
+        print(f"{direction:<11}" + '  '.join(f'{key} {value}' for key, value in stats.items()), flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
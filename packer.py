@@ -0,0 +1,285 @@
+import sys
+import struct
+from array import array
+from collections import namedtuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Payload encoding for the binary wire format: the subset of MessagePack we
+# need, plus two extension types so homogeneous numeric lists travel as raw
+# little-endian arrays instead of one tagged value per element. When the
+# msgpack package is installed it does the work; otherwise the pure-Python
+# codec below produces identical bytes.
+
+EXT_FLOAT64_ARRAY = 1
+EXT_INT64_ARRAY = 2
+EXT_INT8_ARRAY = 3
+EXT_INT16_ARRAY = 4
+EXT_INT32_ARRAY = 5
+EXT_BIGINT = 6  # Python ints beyond 64 bits, as signed big-endian bytes
+TYPED_ARRAY_MIN = 4  # Shorter lists are cheaper as plain MessagePack arrays
+
+_INT64_MIN = -(1 << 63)
+_INT64_MAX = (1 << 63) - 1
+# Narrowest array typecode for a range of ints: (bits, ext code, typecode)
+_INT_ARRAYS = [(8, EXT_INT8_ARRAY, 'b'), (16, EXT_INT16_ARRAY, 'h'), (32, EXT_INT32_ARRAY, 'i'),
+               (64, EXT_INT64_ARRAY, 'q')]
+_TYPECODES = {EXT_FLOAT64_ARRAY: 'd', EXT_INT8_ARRAY: 'b', EXT_INT16_ARRAY: 'h', EXT_INT32_ARRAY: 'i',
+              EXT_INT64_ARRAY: 'q'}
+_FLOAT64 = struct.Struct('>Bd')
+
+if msgpack is not None:
+    ExtType = msgpack.ExtType
+else:
+    ExtType = namedtuple('ExtType', 'code data')
+
+
+def _le_array(typecode, values):
+    packed = array(typecode, values)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _from_le_array(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tolist()
+
+
+def typed(values):
+    """Wrap a homogeneous float or int list as a typed-array extension value.
+
+    Nested lists (e.g. one vector argument) are converted recursively.
+    """
+    if not isinstance(values, (list, tuple)):
+        return values
+    kinds = set(map(type, values))
+    if list in kinds or tuple in kinds:
+        return [typed(value) for value in values]
+    if len(values) < TYPED_ARRAY_MIN:
+        return values
+    if kinds == {float}:
+        return ExtType(EXT_FLOAT64_ARRAY, _le_array('d', values))
+    if kinds == {int}:
+        low, high = min(values), max(values)
+        for bits, code, typecode in _INT_ARRAYS:
+            if -(1 << bits - 1) <= low and high < 1 << bits - 1:
+                return ExtType(code, _le_array(typecode, values))
+    return values
+
+
+def _bigint(value):
+    return ExtType(EXT_BIGINT, value.to_bytes(value.bit_length() // 8 + 1, 'big', signed=True))
+
+
+def _default(obj):
+    # msgpack calls this for ints it cannot pack natively
+    if isinstance(obj, int):
+        return _bigint(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} cannot be packed')
+
+
+def _ext_hook(code, data):
+    if code == EXT_BIGINT:
+        return int.from_bytes(data, 'big', signed=True)
+    typecode = _TYPECODES.get(code)
+    if typecode is None:
+        return ExtType(code, bytes(data))
+    return _from_le_array(typecode, data)
+
+
+def _pack(obj, out):
+    kind = type(obj)
+    if kind is int:
+        if 0 <= obj < 128:
+            out.append(obj)
+        elif -32 <= obj < 0:
+            out.append(obj & 0xff)
+        elif 0 <= obj < 1 << 64:
+            out += _pack_uint(obj)
+        elif _INT64_MIN <= obj < 0:
+            out += _pack_int(obj)
+        else:
+            _pack(_bigint(obj), out)
+    elif kind is float:
+        out += _FLOAT64.pack(0xcb, obj)
+    elif kind is str:
+        data = obj.encode()
+        n = len(data)
+        if n < 32:
+            out.append(0xa0 | n)
+        elif n < 1 << 8:
+            out += struct.pack('>BB', 0xd9, n)
+        elif n < 1 << 16:
+            out += struct.pack('>BH', 0xda, n)
+        else:
+            out += struct.pack('>BI', 0xdb, n)
+        out += data
+    elif kind is list or kind is tuple:
+        n = len(obj)
+        if n < 16:
+            out.append(0x90 | n)
+        elif n < 1 << 16:
+            out += struct.pack('>BH', 0xdc, n)
+        else:
+            out += struct.pack('>BI', 0xdd, n)
+        for item in obj:
+            _pack(item, out)
+    elif kind is dict:
+        n = len(obj)
+        if n < 16:
+            out.append(0x80 | n)
+        elif n < 1 << 16:
+            out += struct.pack('>BH', 0xde, n)
+        else:
+            out += struct.pack('>BI', 0xdf, n)
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    elif obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif isinstance(obj, ExtType):
+        n = len(obj.data)
+        if n < 1 << 8:
+            out += struct.pack('>BBb', 0xc7, n, obj.code)
+        elif n < 1 << 16:
+            out += struct.pack('>BHb', 0xc8, n, obj.code)
+        else:
+            out += struct.pack('>BIb', 0xc9, n, obj.code)
+        out += obj.data
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        data = bytes(obj)
+        n = len(data)
+        if n < 1 << 8:
+            out += struct.pack('>BB', 0xc4, n)
+        elif n < 1 << 16:
+            out += struct.pack('>BH', 0xc5, n)
+        else:
+            out += struct.pack('>BI', 0xc6, n)
+        out += data
+    # Subclasses of the built-in types, e.g. IntEnum or namedtuple
+    elif isinstance(obj, int):
+        _pack(int(obj), out)
+    elif isinstance(obj, float):
+        _pack(float(obj), out)
+    elif isinstance(obj, str):
+        _pack(str(obj), out)
+    elif isinstance(obj, (list, tuple)):
+        _pack(list(obj), out)
+    elif isinstance(obj, dict):
+        _pack(dict(obj), out)
+    else:
+        raise TypeError(f'Object of type {type(obj).__name__} cannot be packed')
+
+
+def _pack_uint(obj):
+    if obj < 1 << 8:
+        return struct.pack('>BB', 0xcc, obj)
+    if obj < 1 << 16:
+        return struct.pack('>BH', 0xcd, obj)
+    if obj < 1 << 32:
+        return struct.pack('>BI', 0xce, obj)
+    return struct.pack('>BQ', 0xcf, obj)
+
+
+def _pack_int(obj):
+    if obj >= -(1 << 7):
+        return struct.pack('>Bb', 0xd0, obj)
+    if obj >= -(1 << 15):
+        return struct.pack('>Bh', 0xd1, obj)
+    if obj >= -(1 << 31):
+        return struct.pack('>Bi', 0xd2, obj)
+    return struct.pack('>Bq', 0xd3, obj)
+
+
+_FIXED = {
+    0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+    0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q',
+    0xca: '>f', 0xcb: '>d',
+}
+_LENGTH = {0xd9: '>B', 0xda: '>H', 0xdb: '>I', 0xc4: '>B', 0xc5: '>H', 0xc6: '>I',
+           0xdc: '>H', 0xdd: '>I', 0xde: '>H', 0xdf: '>I', 0xc7: '>B', 0xc8: '>H', 0xc9: '>I'}
+
+
+def _unpack(data, offset):
+    tag = data[offset]
+    offset += 1
+    if tag < 0x80:
+        return tag, offset
+    if tag >= 0xe0:
+        return tag - 0x100, offset
+    if tag <= 0x8f:
+        return _unpack_map(data, offset, tag & 0x0f)
+    if tag <= 0x9f:
+        return _unpack_array(data, offset, tag & 0x0f)
+    if tag <= 0xbf:
+        n = tag & 0x1f
+        return str(data[offset:offset + n], 'utf-8'), offset + n
+    if tag == 0xc0:
+        return None, offset
+    if tag == 0xc2:
+        return False, offset
+    if tag == 0xc3:
+        return True, offset
+    fmt = _FIXED.get(tag)
+    if fmt is not None:
+        return struct.unpack_from(fmt, data, offset)[0], offset + struct.calcsize(fmt)
+    fmt = _LENGTH.get(tag)
+    if fmt is None:
+        raise ValueError(f'Unsupported MessagePack tag 0x{tag:02x}')
+    n = struct.unpack_from(fmt, data, offset)[0]
+    offset += struct.calcsize(fmt)
+    if tag in (0xd9, 0xda, 0xdb):
+        return str(data[offset:offset + n], 'utf-8'), offset + n
+    if tag in (0xc4, 0xc5, 0xc6):
+        return bytes(data[offset:offset + n]), offset + n
+    if tag in (0xdc, 0xdd):
+        return _unpack_array(data, offset, n)
+    if tag in (0xde, 0xdf):
+        return _unpack_map(data, offset, n)
+    code = struct.unpack_from('b', data, offset)[0]
+    offset += 1
+    return _ext_hook(code, data[offset:offset + n]), offset + n
+
+
+def _unpack_array(data, offset, n):
+    items = []
+    for _ in range(n):
+        item, offset = _unpack(data, offset)
+        items.append(item)
+    return items, offset
+
+
+def _unpack_map(data, offset, n):
+    items = {}
+    for _ in range(n):
+        key, offset = _unpack(data, offset)
+        items[key], offset = _unpack(data, offset)
+    return items, offset
+
+
+def packb(obj):
+    if msgpack is not None:
+        return msgpack.packb(obj, use_bin_type=True, default=_default)
+    out = bytearray()
+    _pack(obj, out)
+    return bytes(out)
+
+
+def unpackb(data):
+    if msgpack is not None:
+        return msgpack.unpackb(data, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+    obj, offset = _unpack(data, 0)
+    if offset != len(data):
+        raise ValueError('Extra data after MessagePack value')
+    return obj
@@ -0,0 +1,330 @@
+import json
+import struct
+
+from packer import packb, unpackb, typed
+
+# Sends of a datagram before giving up. The RTO doubles after each one,
+# from INITIAL_RTO (1 s) until the first RTT sample and capped at MAX_RTO
+# (10 s), so with no sample eight sends span 1+2+4+8+10+10+10+10 = 55 s.
+# Servers retransmit a response that long; clients also fail a request
+# left unacknowledged for MAX_RETRY_TIME (client_backend.py).
+MAX_RETRIES = 8
+ACK = b'ACK'
+BUSY = b'BUSY'
+CANCEL = b'CANCEL'
+STREAM = b'STREAM'
+CREDIT = b'CREDIT'
+MAX_BUSY_DELAY_MS = 0xFFFF  # Retry-after of a busy answer, capped to fit the binary header
+ACK_DELAY = 0.005  # Longest an acknowledgment is held back hoping to piggyback it
+ACK_EVERY = 16  # Send a held-back acknowledgment once it covers this many responses
+MAX_SELECTIVE_ACKS = 64
+
+
+def encode_request(function_name, args, kwargs, sequence_number, options=None):
+    request = [function_name, args, kwargs, sequence_number]
+    if options:
+        request.append(options)
+    return json.dumps(request).encode()
+
+
+def decode_request(data):
+    request = json.loads(str(data, 'utf-8'))
+    if len(request) == 4:
+        function_name, args, kwargs, sequence_number = request
+        options = {}
+    else:
+        function_name, args, kwargs, sequence_number, options = request
+    return function_name, args, kwargs, sequence_number, options
+
+
+def is_ack(data):
+    return data[:3] == ACK
+
+
+def encode_ack(cumulative, selective=()):
+    # 'ACK <cumulative> <seq>,<seq>...': every sequence number up to and
+    # including <cumulative> is acknowledged, plus the listed ones above it.
+    # The plain b'ACK' frame of the original protocol has no sequence number.
+    if selective:
+        return b'ACK %d %s' % (cumulative, ','.join(map(str, selective)).encode())
+    return b'ACK %d' % cumulative
+
+
+def decode_ack(data):
+    if data == ACK:
+        return None, frozenset()
+    fields = bytes(data).split()
+    cumulative = int(fields[1])
+    selective = frozenset(int(seq) for seq in fields[2].split(b',')) if len(fields) > 2 else frozenset()
+    return cumulative, selective
+
+
+def encode_busy(sequence_number, retry_after):
+    # 'BUSY <seq> <ms>': the request was refused unexecuted; send it again
+    # after <ms> milliseconds.
+    return b'BUSY %d %d' % (sequence_number, _busy_delay_ms(retry_after))
+
+
+def is_busy(data):
+    return data[:4] == BUSY
+
+
+def decode_busy(data):
+    # -> (sequence_number, retry_after in seconds)
+    _, sequence_number, delay = bytes(data).split()
+    return int(sequence_number), int(delay) / 1000
+
+
+def _busy_delay_ms(retry_after):
+    return min(max(int(retry_after * 1000), 1), MAX_BUSY_DELAY_MS)
+
+
+def encode_cancel(sequence_number):
+    # 'CANCEL <seq>': the client gave up on the call; the server need not run
+    # it, or resend its response.
+    return b'CANCEL %d' % sequence_number
+
+
+def is_cancel(data):
+    return data[:6] == CANCEL
+
+
+def decode_cancel(data):
+    return int(bytes(data).split()[1])
+
+
+def encode_stream(sequence_number, index, item):
+    # 'STREAM <seq> <index> <item as JSON>': one item of a streamed result (see streaming.py).
+    return b'STREAM %d %d %s' % (sequence_number, index, json.dumps(item).encode())
+
+
+def is_stream(data):
+    return data[:6] == STREAM
+
+
+def decode_stream(data):
+    # -> (sequence_number, index, item)
+    _, sequence_number, index, item = bytes(data).split(b' ', 3)
+    return int(sequence_number), int(index), json.loads(item)
+
+
+def encode_credit(sequence_number, received, limit):
+    # 'CREDIT <seq> <received> <limit>': every item below <received> arrived;
+    # send those below <limit>.
+    return b'CREDIT %d %d %d' % (sequence_number, received, limit)
+
+
+def is_credit(data):
+    return data[:6] == CREDIT
+
+
+def decode_credit(data):
+    # -> (sequence_number, received, limit)
+    _, sequence_number, received, limit = bytes(data).split()
+    return int(sequence_number), int(received), int(limit)
+
+
+def encode_response(response, sequence_number, window=0):
+    # window, the server's receive window, is only sent to clients that asked
+    # for flow control; the original client expects a two-element list.
+    fields = [response, sequence_number, window] if window else [response, sequence_number]
+    try:
+        return response, json.dumps(fields).encode()
+    except (TypeError, ValueError) as e:
+        response = f"Error while encoding response: {e}"
+        fields[0] = response
+        return response, json.dumps(fields).encode()
+
+
+def decode_response(data):
+    # -> (response, sequence_number, window); window is 0 when not advertised.
+    fields = json.loads(str(data, 'utf-8'))
+    response, sequence_number = fields[:2]
+    return response, sequence_number, fields[2] if len(fields) > 2 else 0
+
+
+class JSONCodec:
+    """The original text framing: JSON lists and 'ACK' frames."""
+
+    name = 'json'
+    encode_request = staticmethod(encode_request)
+    decode_request = staticmethod(decode_request)
+    encode_response = staticmethod(encode_response)
+    decode_response = staticmethod(decode_response)
+    is_ack = staticmethod(is_ack)
+    encode_ack = staticmethod(encode_ack)
+    decode_ack = staticmethod(decode_ack)
+    encode_busy = staticmethod(encode_busy)
+    is_busy = staticmethod(is_busy)
+    decode_busy = staticmethod(decode_busy)
+    encode_cancel = staticmethod(encode_cancel)
+    is_cancel = staticmethod(is_cancel)
+    decode_cancel = staticmethod(decode_cancel)
+    encode_stream = staticmethod(encode_stream)
+    is_stream = staticmethod(is_stream)
+    decode_stream = staticmethod(decode_stream)
+    encode_credit = staticmethod(encode_credit)
+    is_credit = staticmethod(is_credit)
+    decode_credit = staticmethod(decode_credit)
+
+    @staticmethod
+    def ack_for(sequence_number, sequenced):
+        # The original protocol's plain ACK, unless the peer asked for
+        # sequenced acknowledgments.
+        return encode_ack(-1, [sequence_number]) if sequenced else ACK
+
+
+# Binary framing. Every datagram starts with a fixed header
+#   magic (2s) | version (B) | flags (B) | msg type (B) | sequence (i) | method id (H)
+# followed by a MessagePack payload (see packer.py):
+#   request:  [function_name, args, kwargs] or [function_name, args, kwargs, options]
+#             (a batch request, see batch.py, has FLAG_BATCH set)
+#   response: the result
+#   ack:      the selective sequence numbers; the header carries the cumulative one
+#   busy:     no payload; the request was refused without running
+#   cancel:   no payload; the client gave up on the request with this sequence number
+#   stream:   [index, item], one item of a streamed result (see streaming.py)
+#   credit:   [received, limit], the client's acknowledgment of streamed items
+# Method id 0 means the payload names the function. In responses the method id
+# field carries the server's receive window instead (0 when not advertised),
+# and in busy answers the milliseconds to wait before sending the request again.
+MAGIC = b'RU'
+VERSION = 1
+HEADER = struct.Struct('!2sBBBiH')
+
+MSG_REQUEST = 1
+MSG_RESPONSE = 2
+MSG_ACK = 3
+MSG_BUSY = 4
+MSG_CANCEL = 5
+MSG_STREAM = 6
+MSG_CREDIT = 7
+
+FLAG_PIGGYBACK = 0x01
+FLAG_BATCH = 0x02
+FLAG_FLOW = 0x04
+FLAG_STREAM = 0x08
+
+
+class BinaryCodec:
+    name = 'binary'
+
+    def encode_request(self, function_name, args, kwargs, sequence_number, options=None, method_id=0):
+        flags = 0
+        fields = [None if method_id else function_name, typed(list(args)), kwargs]
+        if options:
+            options = dict(options)
+            if options.pop('piggyback', False):
+                flags |= FLAG_PIGGYBACK
+            if options.pop('batch', False):
+                flags |= FLAG_BATCH
+            if options.pop('flow', False):
+                flags |= FLAG_FLOW
+            if options.pop('stream', False):
+                flags |= FLAG_STREAM
+            if options:
+                fields.append(options)
+        return HEADER.pack(MAGIC, VERSION, flags, MSG_REQUEST, sequence_number, method_id) + packb(fields)
+
+    def decode_request(self, data):
+        flags, _, sequence_number, method_id = self._header(data, MSG_REQUEST)
+        fields = unpackb(memoryview(data)[HEADER.size:])
+        function_name, args, kwargs = fields[:3]
+        options = fields[3] if len(fields) > 3 else {}
+        if flags & FLAG_PIGGYBACK:
+            options['piggyback'] = True
+        if flags & FLAG_BATCH:
+            options['batch'] = True
+        if flags & FLAG_FLOW:
+            options['flow'] = True
+        if flags & FLAG_STREAM:
+            options['stream'] = True
+        if method_id:
+            options['method_id'] = method_id
+        return function_name, args, kwargs, sequence_number, options
+
+    def encode_response(self, response, sequence_number, window=0):
+        header = HEADER.pack(MAGIC, VERSION, 0, MSG_RESPONSE, sequence_number, min(window, 0xFFFF))
+        try:
+            return response, header + packb(typed(response))
+        except (TypeError, OverflowError, ValueError) as e:
+            response = f"Error while encoding response: {e}"
+            return response, header + packb(response)
+
+    def decode_response(self, data):
+        _, _, sequence_number, window = self._header(data, MSG_RESPONSE)
+        return unpackb(memoryview(data)[HEADER.size:]), sequence_number, window
+
+    def is_ack(self, data):
+        return len(data) >= HEADER.size and data[4] == MSG_ACK
+
+    def encode_ack(self, cumulative, selective=()):
+        header = HEADER.pack(MAGIC, VERSION, 0, MSG_ACK, cumulative, 0)
+        return header + packb(list(selective)) if selective else header
+
+    def decode_ack(self, data):
+        _, _, cumulative, _ = self._header(data, MSG_ACK)
+        selective = unpackb(memoryview(data)[HEADER.size:]) if len(data) > HEADER.size else ()
+        return cumulative, frozenset(selective)
+
+    def ack_for(self, sequence_number, sequenced):
+        return self.encode_ack(-1, [sequence_number])
+
+    def encode_busy(self, sequence_number, retry_after):
+        return HEADER.pack(MAGIC, VERSION, 0, MSG_BUSY, sequence_number, _busy_delay_ms(retry_after))
+
+    def is_busy(self, data):
+        return len(data) >= HEADER.size and data[4] == MSG_BUSY
+
+    def decode_busy(self, data):
+        _, _, sequence_number, delay = self._header(data, MSG_BUSY)
+        return sequence_number, delay / 1000
+
+    def encode_cancel(self, sequence_number):
+        return HEADER.pack(MAGIC, VERSION, 0, MSG_CANCEL, sequence_number, 0)
+
+    def is_cancel(self, data):
+        return len(data) >= HEADER.size and data[4] == MSG_CANCEL
+
+    def decode_cancel(self, data):
+        return self._header(data, MSG_CANCEL)[2]
+
+    def encode_stream(self, sequence_number, index, item):
+        return HEADER.pack(MAGIC, VERSION, 0, MSG_STREAM, sequence_number, 0) + packb([index, typed(item)])
+
+    def is_stream(self, data):
+        return len(data) >= HEADER.size and data[4] == MSG_STREAM
+
+    def decode_stream(self, data):
+        _, _, sequence_number, _ = self._header(data, MSG_STREAM)
+        index, item = unpackb(memoryview(data)[HEADER.size:])
+        return sequence_number, index, item
+
+    def encode_credit(self, sequence_number, received, limit):
+        return HEADER.pack(MAGIC, VERSION, 0, MSG_CREDIT, sequence_number, 0) + packb([received, limit])
+
+    def is_credit(self, data):
+        return len(data) >= HEADER.size and data[4] == MSG_CREDIT
+
+    def decode_credit(self, data):
+        _, _, sequence_number, _ = self._header(data, MSG_CREDIT)
+        received, limit = unpackb(memoryview(data)[HEADER.size:])
+        return sequence_number, received, limit
+
+    def _header(self, data, expected_type):
+        magic, version, flags, msg_type, sequence_number, method_id = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'Unsupported binary frame (magic {magic!r}, version {version})')
+        if msg_type != expected_type:
+            raise ValueError(f'Unexpected message type {msg_type}')
+        return flags, msg_type, sequence_number, method_id
+
+
+JSON = JSONCodec()
+BINARY = BinaryCodec()
+CODECS = {codec.name: codec for codec in (JSON, BINARY)}
+
+
+def codec_for(data):
+    # data may be bytes or a memoryview (see bulkio.py); neither is copied here.
+    return BINARY if data[:2] == MAGIC else JSON
@@ -0,0 +1,177 @@
+import itertools
+
+from admission import NORMAL
+
+# Methods are called by name or, once a client has looked them up with the
+# discovery method, by the integer id the binary header carries (protocol.py).
+# Ids are handed out in registration order, so every process of a server that
+# registers the same methods agrees on them.
+
+DESCRIBE = 'rpc.describe'  # Discovery method every server registers
+SYSTEM_PREFIX = 'rpc.'  # Reserved for methods of the server itself, such as rpc.login
+MAX_METHOD_ID = 0xFFFF  # The method id field of the binary header is 16 bits
+
+NUMBER = (int, float)
+ANY = object
+
+_TYPE_NAMES = {int: 'int', float: 'float', bool: 'bool', str: 'str', bytes: 'bytes', list: 'list', dict: 'dict',
+               type(None): 'null', object: 'any'}
+
+
+def _allowed(kind):
+    # Exact types accepted, or None for any: type(value) in allowed is the
+    # cheapest check there is, and keeps True from passing as a number.
+    if kind is ANY:
+        return None
+    return frozenset(kind) if isinstance(kind, tuple) else frozenset([kind])
+
+
+def type_name(kind):
+    if kind == NUMBER:
+        return 'number'
+    if isinstance(kind, tuple):
+        return '|'.join(map(type_name, kind))
+    return _TYPE_NAMES.get(kind, kind.__name__)
+
+
+def _plural(count, noun):
+    return f'{count} {noun}' if count == 1 else f'{count} {noun}s'
+
+
+class Schema:
+    """Types and arity of a method's arguments.
+
+    params gives the type of each leading positional argument and varargs
+    the type of any further ones (None allows no more). min_args is the
+    fewest positional arguments accepted, all of params by default. keywords
+    maps the keyword arguments accepted to their types. A type is a class or
+    a tuple of classes, matched exactly, or ANY. The checks are compiled once
+    into validate(args, kwargs), which returns None for a valid call and the
+    reason otherwise.
+    """
+
+    def __init__(self, params=(), varargs=None, min_args=None, keywords=None):
+        self.params = tuple(params)
+        self.varargs = varargs
+        self.min_args = len(self.params) if min_args is None else min_args
+        self.max_args = None if varargs is not None else len(self.params)
+        self.keywords = dict(keywords or {})
+        self.validate = self._compile()
+
+    def describe(self):
+        return {
+            'params': [type_name(kind) for kind in self.params],
+            'varargs': None if self.varargs is None else type_name(self.varargs),
+            'min_args': self.min_args,
+            'max_args': self.max_args,
+            'keywords': {name: type_name(kind) for name, kind in self.keywords.items()},
+        }
+
+    def _compile(self):
+        min_args, max_args = self.min_args, self.max_args
+        fixed = [(position, _allowed(kind)) for position, kind in enumerate(self.params)]
+        fixed = [(position, allowed) for position, allowed in fixed if allowed is not None]
+        rest = None if self.varargs is None else _allowed(self.varargs)
+        skip = len(self.params)
+        keywords = {name: _allowed(kind) for name, kind in self.keywords.items()}
+        describe_type = self._describe_type
+
+        def validate(args, kwargs):
+            count = len(args)
+            if count < min_args:
+                return f'At least {_plural(min_args, "argument")} required'
+            if max_args is not None and count > max_args:
+                return f'At most {_plural(max_args, "argument")} accepted'
+            for position, allowed in fixed:
+                if position < count and type(args[position]) not in allowed:
+                    return describe_type(position, args[position])
+            if rest is not None and count > skip and not rest.issuperset(map(type, itertools.islice(args, skip, None))):
+                position = next(position for position in range(skip, count) if type(args[position]) not in rest)
+                return describe_type(position, args[position])
+            if kwargs:
+                for name, value in kwargs.items():
+                    if name not in keywords:
+                        return f"Unexpected keyword argument '{name}'"
+                    allowed = keywords[name]
+                    if allowed is not None and type(value) not in allowed:
+                        return f"Keyword argument '{name}' must be {type_name(self.keywords[name])}, not {type(value).__name__}"
+            return None
+
+        return validate
+
+    def _describe_type(self, position, value):
+        kind = self.params[position] if position < len(self.params) else self.varargs
+        return f'Argument {position + 1} must be {type_name(kind)}, not {type(value).__name__}'
+
+
+def accepts(*params, varargs=None, min_args=None, keywords=None):
+    """Decorator declaring a method's Schema; register_method() picks it up."""
+
+    def decorate(function):
+        function.__rpc_schema__ = Schema(params, varargs, min_args, keywords)
+        return function
+
+    return decorate
+
+
+class Method:
+    __slots__ = ('name', 'method_id', 'function', 'schema', 'validate', 'cache', 'priority', 'doc')
+
+    def __init__(self, name, method_id, function, schema, cache, priority=NORMAL):
+        self.name = name
+        self.method_id = method_id
+        self.function = function
+        self.schema = schema
+        self.validate = None if schema is None else schema.validate
+        self.cache = cache
+        self.priority = priority
+        self.doc = (getattr(function, '__doc__', None) or '').strip().split('\n', 1)[0]
+
+    def describe(self):
+        description = {'name': self.name, 'id': self.method_id, 'doc': self.doc, 'pure': self.cache is not None,
+                       'priority': self.priority}
+        description.update(self.schema.describe() if self.schema is not None else
+                           {'params': [], 'varargs': 'any', 'min_args': 0, 'max_args': None, 'keywords': None})
+        return description
+
+
+class MethodRegistry:
+    """The server's methods by name and by wire id.
+
+    register() keeps the id of a method registered again under the same
+    name, so clients holding ids stay valid. describe() lists every method
+    but the discovery method itself with its id and schema, as the
+    discovery method returns it; a SYSTEM_PREFIX method listed there, such
+    as rpc.login, tells clients what the server supports.
+    """
+
+    def __init__(self):
+        self._methods = {}  # name -> Method
+        self._names = {}  # method id -> name
+        self._ids = itertools.count(1)
+
+    def register(self, name, function, schema=None, cache=None, priority=NORMAL):
+        if schema is None:
+            schema = getattr(function, '__rpc_schema__', None)
+        previous = self._methods.get(name)
+        method_id = previous.method_id if previous is not None else next(self._ids)
+        if method_id > MAX_METHOD_ID:
+            raise ValueError(f'More than {MAX_METHOD_ID} methods registered')
+        method = self._methods[name] = Method(name, method_id, function, schema, cache, priority)
+        self._names[method_id] = name
+        return method
+
+    def get(self, name):
+        return self._methods.get(name)
+
+    def name_for(self, method_id):
+        return self._names.get(method_id)
+
+    def __contains__(self, name):
+        return name in self._methods
+
+    def __iter__(self):
+        return iter(list(self._methods.values()))
+
+    def describe(self):
+        return [method.describe() for method in self if method.name != DESCRIBE]
@@ -0,0 +1,94 @@
+import zlib
+import threading
+from collections import OrderedDict
+
+MAX_REPLIES = 65536
+MAX_REPLY_BYTES = 32 * 1024 * 1024
+REPLY_TTL = 60.0  # Seconds a finished reply stays available for retransmitted requests
+
+# Returned by ReplyCache.begin() for a request that is still executing.
+IN_PROGRESS = object()
+
+
+def fingerprint(data):
+    # Works on a memoryview of the receive buffer without copying it.
+    return len(data), zlib.crc32(data)
+
+
+class _Reply:
+    __slots__ = ('fingerprint', 'data', 'finished_at')
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.data = None
+        self.finished_at = None
+
+
+class ReplyCache:
+    """Encoded responses by (client address, sequence number).
+
+    A retransmitted request gets the stored response instead of running the
+    method again, which makes execution at-most-once. Each entry remembers a
+    fingerprint of the request datagram, so a different request that reuses
+    an address and sequence number (a restarted client) is not mistaken for a
+    retransmission. Finished replies expire after ttl seconds, and the least
+    recently used ones are evicted beyond max_entries or max_bytes.
+    """
+
+    def __init__(self, max_entries=MAX_REPLIES, max_bytes=MAX_REPLY_BYTES, ttl=REPLY_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._replies = OrderedDict()  # key -> _Reply, least recently used first
+        self._size = 0
+
+    def begin(self, key, fingerprint, now):
+        """None if the caller should execute the request (it is then marked
+        in progress), IN_PROGRESS, or the stored response."""
+        with self._lock:
+            reply = self._replies.get(key)
+            if reply is not None and reply.fingerprint == fingerprint and not self._expired(reply, now):
+                self._replies.move_to_end(key)
+                return IN_PROGRESS if reply.data is None else reply.data
+            if reply is not None:
+                self._remove(key)
+            self._replies[key] = _Reply(fingerprint)
+            self._evict(now)
+        return None
+
+    def finish(self, key, data, now):
+        with self._lock:
+            reply = self._replies.get(key)
+            if reply is None or reply.data is not None:
+                return
+            reply.data = data
+            reply.finished_at = now
+            self._size += len(data)
+            self._evict(now)
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._replies:
+                self._remove(key)
+
+    def __len__(self):
+        return len(self._replies)
+
+    def _expired(self, reply, now):
+        return reply.finished_at is not None and now - reply.finished_at > self.ttl
+
+    def _remove(self, key):
+        reply = self._replies.pop(key)
+        if reply.data is not None:
+            self._size -= len(reply.data)
+
+    def _evict(self, now):
+        while self._replies and (len(self._replies) > self.max_entries or self._size > self.max_bytes):
+            self._remove(next(iter(self._replies)))
+        # Least recently used first is close enough to oldest first for the TTL.
+        while self._replies:
+            key, reply = next(iter(self._replies.items()))
+            if not self._expired(reply, now):
+                break
+            self._remove(key)
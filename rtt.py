@@ -0,0 +1,47 @@
+INITIAL_RTO = 1.0  # Seconds, until the first RTT sample arrives
+MIN_RTO = 0.02
+MAX_RTO = 10.0
+CLOCK_GRANULARITY = 0.001
+MAX_PEERS = 4096
+
+
+class RTTEstimator:
+    """Retransmission timeout for one peer, following RFC 6298.
+
+    sample() takes round trips measured on packets that were sent exactly
+    once (Karn's algorithm: the caller must not sample retransmitted
+    packets), and backoff() doubles the timeout after every expiry until
+    a fresh sample arrives. expired() is backoff() for one of many packets
+    in flight: it backs off only for a packet sent since the last backoff,
+    so a burst of timeouts doubles the timeout once rather than once each.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(self, initial_rto=INITIAL_RTO, min_rto=MIN_RTO, max_rto=MAX_RTO):
+        self.srtt = None
+        self.rttvar = None
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.rto = initial_rto
+        self.backed_off_at = float('-inf')
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.rto = min(max(self.srtt + max(CLOCK_GRANULARITY, self.K * self.rttvar), self.min_rto), self.max_rto)
+
+    def backoff(self):
+        self.rto = min(self.rto * 2, self.max_rto)
+
+    def expired(self, sent_at, now):
+        if sent_at >= self.backed_off_at:
+            self.backoff()
+            self.backed_off_at = now
+
@@ -0,0 +1,1523 @@
+import os
+import sys
+import math
+import heapq
+import signal
+import inspect
+import socket
+import select
+import asyncio
+import argparse
+import threading
+import time
+import functools
+import multiprocessing
+from multiprocessing.connection import wait
+from concurrent.futures import ThreadPoolExecutor
+
+from protocol import (MAX_RETRIES, ACK, ACK_DELAY, codec_for)
+from fragment import Fragmenter, is_fragment, set_buffer_sizes
+from batch import BUILTIN_KERNELS, VECTORIZE_MIN, decode_batch
+from replies import IN_PROGRESS, ReplyCache, fingerprint
+from memo import ResultCache, Uncacheable, canonical_key
+from session import SessionTable
+from registry import DESCRIBE, NUMBER, MethodRegistry, Schema, accepts
+from auth import LOGIN, PUBLIC_METHODS, SECRET_BYTES, Authenticator
+from credentials import CredentialStore
+from admission import HIGH, LOW, MAX_QUEUE, NORMAL, AdmissionControl
+from streaming import OutgoingStream, is_stream
+from logsink import LogSink, format_message, stream_handler
+from metrics import BATCH_METHOD, UNKNOWN_METHOD, RPCMetrics, serve_metrics
+from bulkio import BATCH_SIZE, BulkDatagramTransport, BulkSocket
+
+WORKER_THREADS = 8
+POLL_INTERVAL = 0.5  # How often the receiver loop checks for shutdown
+DRAIN_TIMEOUT = 10.0  # Longest a draining server waits for outstanding responses to be acknowledged
+RESTART_DELAY = 1.0  # Least time between two starts of the same worker process
+
+# Reasons a request is abandoned, as counted in the metrics.
+CANCELLED = 'cancelled'
+DEADLINE = 'deadline'
+
+_RETRANSMIT = 0
+_DELAYED_ACK = 1
+_STREAM = 2
+_MISSING = object()
+
+
+def _ignore(message, *args):
+    pass
+
+
+def _is_error(result):
+    return isinstance(result, str) and result.startswith('Error')
+
+
+def _single(result):
+    # A plain method called for a stream sends its result as the only item.
+    yield result
+
+
+def _is_ack_fields(ack):
+    return (isinstance(ack, list) and len(ack) == 2 and type(ack[0]) is int and isinstance(ack[1], list)
+            and all(type(seq) is int for seq in ack[1]))
+
+
+def _check_request(request):
+    # decode_request() only unpacks. Whatever the server reads before the
+    # method runs is checked here, so a malformed request gets an error.
+    function_name, args, kwargs, sequence_number, options = request
+    if type(sequence_number) is not int:
+        raise ValueError('Sequence number must be an integer')
+    if function_name is not None and type(function_name) is not str:
+        raise ValueError('Function name must be a string')  # None for a batch, or a call by method id
+    if not isinstance(options, dict):
+        raise ValueError('Options must be an object')
+    if 'ack' in options and not _is_ack_fields(options['ack']):
+        raise ValueError('Acknowledgment must be [cumulative, [sequence numbers]]')
+    if 'method_id' in options and type(options['method_id']) is not int:
+        raise ValueError('Method id must be an integer')
+    if options.get('batch') and not isinstance(args, list):
+        raise ValueError('A batch must be a list of calls')  # Admission control costs it by length
+
+
+@accepts(varargs=NUMBER, min_args=2)
+def add(*args):
+    """Sum of the arguments."""
+    return sum(args)
+
+
+@accepts(varargs=NUMBER, min_args=2)
+def multiply(*args):
+    """Product of the arguments."""
+    return math.prod(args)
+
+
+@accepts(varargs=NUMBER, min_args=2)
+def subtract(first, *rest):
+    """The first argument minus all the others."""
+    return first - sum(rest)
+
+
+def register_builtin_methods(server):
+    for method in (add, multiply, subtract):
+        server.register_method(method.__name__, method, pure=True)
+    for name, kernel in BUILTIN_KERNELS.items():
+        server.register_kernel(name, kernel)
+
+
+def with_admission(setup, max_queue, rate, burst, server):
+    # Wraps a setup, picklably, to give every worker the same admission limits.
+    setup(server)
+    server.admission = AdmissionControl(max_queue, rate, burst)
+
+
+def register_with_auth(credentials_path, secret, required, server):
+    # A picklable setup for Supervisor: every worker checks tokens with the same secret.
+    register_builtin_methods(server)
+    server.enable_auth(Authenticator(CredentialStore(credentials_path), secret, required=required))
+
+
+class _OutstandingResponse:
+    __slots__ = ('data', 'message_id', 'attempts', 'sent_at', 'deadline', 'timer', 'expires')
+
+    def __init__(self, data, sent_at, deadline=None, timer=None, expires=None):
+        self.data = data
+        self.message_id = None
+        self.attempts = 1
+        self.sent_at = sent_at
+        self.deadline = deadline  # Of the retransmit timer
+        self.timer = timer
+        self.expires = expires  # The caller's deadline; the response is not resent after it
+
+
+class BaseRPCServer:
+    """Method table, dispatch, acknowledgment bookkeeping and logging hooks
+    shared by the server engines."""
+
+    def __init__(self, host='localhost', port=8000, on_log=_ignore, on_request=_ignore, on_response=_ignore,
+                 metrics=None, admission=None):
+        self.registry = MethodRegistry()
+        self.host = host
+        self.port = port
+        self.on_log = on_log
+        self.on_request = on_request
+        self.on_response = on_response
+        self.sessions = SessionTable()
+        self.fragmenter = Fragmenter()
+        self.replies = ReplyCache()
+        self._pending = {}  # client_address -> {sequence_number: _OutstandingResponse}
+        self._work = {}  # (client_address, sequence_number) -> Future or Task of a request still executing
+        self._streams = {}  # (client_address, sequence_number) -> OutgoingStream
+        self._kernels = {}
+        self._inflight = 0  # Requests still executing
+        self._draining = False
+        self._drain_deadline = None
+        self.metrics = metrics if metrics is not None else RPCMetrics()
+        self.auth = None
+        self.admission = admission if admission is not None else AdmissionControl()
+        self.register_method(DESCRIBE, self.registry.describe, schema=Schema(), priority=HIGH)
+
+    def register_method(self, name, method, pure=False, cache=None, schema=None, priority=NORMAL):
+        # pure=True memoizes results in a ResultCache; cache= supplies one
+        # (to choose its size or share it) and implies pure. schema= (a
+        # registry.Schema) overrides one declared with @accepts; calls that
+        # do not match it are rejected before the method runs. priority is
+        # the admission class (admission.py) under overload.
+        if cache is None and pure:
+            cache = ResultCache()
+        self._kernels.pop(name, None)
+        return self.registry.register(name, method, schema, cache, priority)
+
+    def method(self, name=None, pure=False, cache=None, schema=None, priority=NORMAL):
+        """Decorator form of register_method(), named after the function by default."""
+
+        def decorate(function):
+            self.register_method(name or function.__name__, function, pure, cache, schema, priority)
+            return function
+
+        return decorate
+
+    def enable_auth(self, authenticator):
+        """Register rpc.login and accept the session tokens it issues; see auth.py."""
+        self.auth = authenticator
+        self.register_method(LOGIN, self._login, schema=Schema((str, str)), priority=HIGH)
+
+    def _login(self, username, password):
+        return self.auth.login(username, password)
+
+    def describe_methods(self):
+        return self.registry.describe()
+
+    def cache_info(self):
+        return {method.name: method.cache.info() for method in self.registry if method.cache is not None}
+
+    def metrics_snapshot(self):
+        return self.metrics.registry.snapshot()
+
+    def register_kernel(self, name, kernel):
+        # kernel(list of argument lists) -> list of results, or None to run
+        # the batch through the method one entry at a time.
+        self._kernels[name] = kernel
+
+    def _window(self, options, client_address):
+        # Only clients that asked for flow control get a receive window.
+        return self.sessions.window(client_address) if options.get('flow') else 0
+
+    def _dispatch_request(self, function_name, args, kwargs, options):
+        user = options.get('user')
+        if user is not None:
+            self.metrics.user_requests.labels(user).inc()
+        elif self.auth is not None and self.auth.required and function_name not in PUBLIC_METHODS:
+            self.metrics.auth_failures.inc()
+            return "Error: Authentication required"
+        if options.get('batch'):
+            return self._dispatch_batch(function_name, args)
+        return self._dispatch(function_name, args, kwargs, options.get('stream', False))
+
+    def _dispatch_batch(self, function_name, entries):
+        try:
+            calls = decode_batch(function_name, entries)
+        except (TypeError, IndexError, KeyError) as e:
+            return f"Error: Invalid batch request. {e}"
+        kernel = self._kernels.get(function_name)
+        if kernel is not None and len(entries) >= VECTORIZE_MIN:
+            started = time.perf_counter()
+            try:
+                results = kernel(entries)
+            except Exception:
+                results = None
+            if results is not None:
+                self.metrics.executed(function_name, time.perf_counter() - started, sum(map(_is_error, results)),
+                                      len(results))
+                return results
+        return [self._dispatch(name, args, kwargs) for name, args, kwargs in calls]
+
+    def _dispatch(self, function_name, args, kwargs, stream=False):
+        started = time.perf_counter()
+        method = self.registry.get(function_name)
+        if method is None:
+            self.metrics.executed(UNKNOWN_METHOD, 0.0, 1)
+            return f"Error: Function '{function_name}' not found."
+        try:
+            error = method.validate(args, kwargs) if method.validate is not None else None
+            if error is not None:
+                result = f"Error: {error}"
+            elif method.cache is None:
+                result = method.function(*args, **kwargs)
+            else:
+                result = self._memoized(method, args, kwargs)
+        except Exception as e:
+            result = f"Error while executing function: {e}"
+        if is_stream(result):
+            # Timed as it is drained, by the engine's _stream() or by _collect().
+            return result if stream else self._collect(result, function_name, started)
+        if asyncio.iscoroutine(result):
+            return self._timed(result, function_name, started)
+        self.metrics.executed(function_name, time.perf_counter() - started, _is_error(result))
+        return result
+
+    def _collect(self, items, function_name, started):
+        # A caller that did not ask for a stream gets all the items in one list.
+        if inspect.isasyncgen(items):
+            return self._timed(self._collect_async(items), function_name, started)
+        try:
+            result = list(items)
+        except Exception as e:
+            result = f"Error while executing function: {e}"
+        self.metrics.executed(function_name, time.perf_counter() - started, _is_error(result))
+        return result
+
+    @staticmethod
+    async def _collect_async(items):
+        return [item async for item in items]
+
+    async def _timed(self, coroutine, function_name, started):
+        try:
+            result = await coroutine
+        except BaseException:
+            self.metrics.executed(function_name, time.perf_counter() - started, 1)
+            raise
+        self.metrics.executed(function_name, time.perf_counter() - started, _is_error(result))
+        return result
+
+    def _method_label(self, function_name, options):
+        # Latency is reported per method; unknown names share one label so a
+        # client cannot grow the registry without bound.
+        if options.get('batch') and not function_name:
+            return BATCH_METHOD
+        return function_name if function_name in self.registry or function_name in self._kernels else UNKNOWN_METHOD
+
+    def _memoized(self, method, args, kwargs):
+        try:
+            key = canonical_key(args, kwargs)
+        except Uncacheable:
+            return method.function(*args, **kwargs)
+        result = method.cache.get(key, _MISSING)
+        if result is _MISSING:
+            # An exception propagates before put(), so errors are never cached.
+            result = method.function(*args, **kwargs)
+            if not asyncio.iscoroutine(result) and not is_stream(result):
+                method.cache.put(key, result)
+        return result
+
+    def _reassemble(self, data, client_address, now):
+        message, packets, sequence_number = self.fragmenter.receive(data, client_address, now)
+        for packet in packets:
+            self._sendto(packet, client_address)
+        if sequence_number is not None:
+            # The client already has this whole response, so our probe was answered with DONE.
+            self._acknowledge(client_address, -1, frozenset([sequence_number]))
+        return message
+
+    def _response_packets(self, entry, client_address, sequence_number):
+        # Retransmits of a fragmented response only probe; the client asks for what it lacks.
+        if entry.message_id is not None and entry.attempts > 1:
+            packets = self.fragmenter.probe(entry.message_id)
+            if packets:
+                return packets
+        entry.message_id, packets = self.fragmenter.split(entry.data, client_address, sequence_number)
+        return packets
+
+    def _answer_duplicate(self, data, sequence_number, options, codec, client_address, now):
+        # True when the request is a retransmission that was already answered
+        # from the reply cache, so the method must not run again.
+        reply = self.replies.begin((client_address, sequence_number), fingerprint(data), now)
+        if reply is None:
+            return False
+        self.metrics.duplicates.inc()
+        client_ip, client_port = client_address
+        piggyback = bool(options.get('piggyback'))
+        if reply is IN_PROGRESS:
+            self.on_log("Duplicate request from %s:%s is still running (Sequence: %s).", client_ip, client_port, sequence_number)
+            self._sendto(codec.ack_for(sequence_number, piggyback), client_address)
+            return True
+        self.on_log("Duplicate request from %s:%s, resending cached response (Sequence: %s).", client_ip, client_port, sequence_number)
+        if not piggyback:
+            self._sendto(codec.ack_for(sequence_number, False), client_address)
+        self._deliver(reply, sequence_number, client_address)
+        self.on_response("Sent cached response to %s:%s, Sequence: %s", client_ip, client_port, sequence_number)
+        return True
+
+    def _refuse_while_draining(self, sequence_number, client_address):
+        if not self._draining:
+            return False
+        self.replies.discard((client_address, sequence_number))
+        client_ip, client_port = client_address
+        self.on_log("Draining, ignored new request from %s:%s (Sequence: %s).", client_ip, client_port, sequence_number)
+        return True
+
+    def _refuse_when_busy(self, function_name, args, sequence_number, options, codec, client_address, now):
+        # Overloaded or over its rate: the request is dropped unexecuted, and
+        # clients that understand it are told when to send it again.
+        method = self.registry.get(function_name)
+        priority = method.priority if method is not None else NORMAL
+        cost = 1
+        if options.get('batch'):
+            priority, cost = max(priority, LOW), max(1, len(args))
+        refusal = self.admission.admit(options.get('user') or client_address, priority, self._inflight, now, cost)
+        if refusal is None:
+            return False
+        reason, retry_after = refusal
+        self.replies.discard((client_address, sequence_number))
+        self.metrics.rejected.labels(reason).inc()
+        if options.get('flow'):
+            self._sendto(codec.encode_busy(sequence_number, retry_after), client_address)
+        client_ip, client_port = client_address
+        self.on_log("Busy (%s), refused request from %s:%s (Sequence: %s), retry after %.0f ms.", reason, client_ip,
+                    client_port, sequence_number, retry_after * 1000)
+        return True
+
+    def _refuse_expired(self, sequence_number, options, client_address, now):
+        # A client may send the milliseconds it will wait as options['timeout'].
+        # The deadline runs from the request's arrival; work still queued when
+        # it passes is dropped, and its response is not resent after it.
+        timeout = options.pop('timeout', None)
+        options.pop('deadline', None)  # Only ever computed here, never taken from the client
+        if type(timeout) not in (int, float) or not 0 <= timeout < math.inf:
+            return False
+        options['deadline'] = now + timeout / 1000
+        if timeout > 0:
+            return False
+        self._abandon(DEADLINE, client_address, sequence_number)
+        return True
+
+    def _handle_cancel(self, data, codec, client_address):
+        try:
+            sequence_number = codec.decode_cancel(data)
+        except Exception:
+            return
+        if self._cancel(client_address, sequence_number):
+            self._abandon(CANCELLED, client_address, sequence_number)
+
+    def _handle_credit(self, data, codec, client_address):
+        try:
+            sequence_number, received, limit = codec.decode_credit(data)
+        except Exception:
+            return
+        self._credit(client_address, sequence_number, received, limit)
+
+    def _stream_item(self, stream, codec, sequence_number, item, client_address):
+        # -> (message_id, packets) of the stream's next item; the caller adds them to the stream.
+        data = codec.encode_stream(sequence_number, stream.sent, item)
+        return self.fragmenter.split(data, client_address)
+
+    def _stream_packets(self, entries):
+        # The packets to send again for unacked entries of a stream; a fragmented item is only probed.
+        packets = []
+        for index, message_id, item_packets, sent_at in entries:
+            packets.extend(message_id is not None and self.fragmenter.probe(message_id) or item_packets)
+        return packets
+
+    def _stream_credit(self, stream, client_address, received, limit):
+        # Applies a CREDIT; returns the packets of an item the client reports missing.
+        released, sample = stream.acknowledge(received, limit, time.monotonic())
+        for message_id in released:
+            self.fragmenter.release(message_id)
+        if sample is not None:
+            self.sessions.get(client_address).rtt.sample(sample)
+        missing = stream.missing(received)
+        if missing is None:
+            return []
+        self.metrics.retransmissions.inc()
+        return self._stream_packets([missing])
+
+    def _release_stream(self, stream):
+        for index, message_id, packets, sent_at in stream.unacked:
+            self.fragmenter.release(message_id)
+        stream.unacked.clear()
+
+    def _abandon(self, reason, client_address, sequence_number):
+        self.replies.discard((client_address, sequence_number))
+        self.metrics.abandoned.labels(reason).inc()
+        client_ip, client_port = client_address
+        self.on_log("Dropped request from %s:%s (Sequence: %s): %s.", client_ip, client_port, sequence_number, reason)
+
+    def _execute_failed(self, exc, client_address, sequence_number):
+        client_ip, client_port = client_address
+        self.on_log("Error handling request from %s:%s (Sequence: %s): %r", client_ip, client_port, sequence_number, exc)
+
+    def _begin_drain(self, now, timeout):
+        # New requests are ignored from now on; the server stops once every
+        # response has been acknowledged, or when the timeout runs out.
+        if not self._draining:
+            self._draining = True
+            self._drain_deadline = now + timeout
+            self.on_log('Draining, stopping within %g s', timeout)
+
+    def _drained(self, now):
+        return (not self._pending and not self._inflight) or now >= self._drain_deadline
+
+    def _parse_request(self, data, codec, client_address):
+        client_ip, client_port = client_address
+        self.on_log('Received request from %s:%s', client_ip, client_port)
+        try:
+            request = codec.decode_request(data)
+            _check_request(request)
+        except Exception as e:
+            return None, f"Error: Invalid request format from {client_ip}:{client_port}. {e}".encode()
+        function_name, args, kwargs, sequence_number, options = request
+        method_id = options.get('method_id')
+        if method_id:
+            # Sent by id: the payload left the name out.
+            function_name = self.registry.name_for(method_id) or f'#{method_id}'
+            request = function_name, args, kwargs, sequence_number, options
+        # The caller is whoever the token names, never what the client put in options.
+        token = options.pop('token', None)
+        options['user'] = self.auth.user_for(token) if self.auth is not None and token is not None else None
+        if options.get('batch'):
+            self.on_request('Client: %s:%s, Batch: %s calls to %s, Sequence: %s', client_ip, client_port, len(args), function_name or "several functions", sequence_number)
+        else:
+            self.on_request('Client: %s:%s, Function: %s, Args: %s, Kwargs: %s, Sequence: %s', client_ip, client_port, function_name, args, kwargs, sequence_number)
+        return request, None
+
+    def _receive(self, data, client_address):
+        # One malformed datagram must never stop the receive loop.
+        try:
+            self._handle_datagram(data, client_address)
+        except Exception as e:
+            client_ip, client_port = client_address[:2]
+            self.on_log("Dropped datagram from %s:%s: %r", client_ip, client_port, e)
+
+    def _handle_ack(self, data, codec, client_address):
+        try:
+            cumulative, selective = codec.decode_ack(data)
+        except Exception:
+            return
+        self._acknowledge(client_address, cumulative, selective)
+
+    def _handle_piggybacked_ack(self, options, client_address):
+        ack = options.get('ack')
+        if ack:
+            cumulative, selective = ack
+            self._acknowledge(client_address, cumulative, frozenset(selective))
+
+    def _pop_acknowledged(self, client_address, now, cumulative=None, selective=frozenset()):
+        outstanding = self._pending.get(client_address)
+        if not outstanding:
+            return []
+        if cumulative is None:
+            # Plain ACKs carry no sequence number; they answer the oldest
+            # response still outstanding for that client.
+            acked = [next(iter(outstanding))]
+        else:
+            acked = [seq for seq in outstanding if seq <= cumulative or seq in selective]
+        entries = [outstanding.pop(seq) for seq in acked]
+        if not outstanding:
+            del self._pending[client_address]
+        self.sessions.settled(client_address, len(entries))
+        for entry in entries:
+            self.fragmenter.release(entry.message_id)
+
+        fresh = [entry.sent_at for entry in entries if entry.attempts == 1]
+        if fresh:
+            self.sessions.get(client_address).rtt.sample(now - max(fresh))
+        client_ip, client_port = client_address
+        for sequence_number in acked:
+            self.on_log("Acknowledgment received from client %s:%s for response (Sequence: %s).", client_ip, client_port, sequence_number)
+        return entries
+
+    def _forget_response(self, client_address, sequence_number):
+        # Stops resending a response without an ACK; returns its entry, if it was outstanding.
+        outstanding = self._pending.get(client_address)
+        entry = outstanding.pop(sequence_number, None) if outstanding else None
+        if entry is None:
+            return None
+        if not outstanding:
+            del self._pending[client_address]
+        self.sessions.settled(client_address)
+        self.fragmenter.release(entry.message_id)
+        return entry
+
+
+class RPCServerEngine(BaseRPCServer):
+    """UDP RPC server: one receiver loop, a worker pool and a retransmit timer.
+
+    The receiver never blocks on a particular client. Requests are handed to
+    the worker pool, and every response that has not been acknowledged yet is
+    kept per (client address, sequence number) until its ACK arrives or its
+    retransmit timer gives up. With bulk=True (see bulkio.py) each wakeup of
+    the receiver takes a batch of datagrams, and the ACKs and cached
+    responses it sends while handling them go out together afterwards.
+    """
+
+    def __init__(self, host='localhost', port=8000, workers=WORKER_THREADS, sock=None, bulk=True, **hooks):
+        super().__init__(host, port, **hooks)
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((self.host, self.port))
+        self.host, self.port = sock.getsockname()[:2]  # The port actually bound when asked for port 0
+        self.server_socket = sock
+        self.server_socket.setblocking(False)
+        set_buffer_sizes(self.server_socket)
+        self._io = BulkSocket(sock, BATCH_SIZE if bulk else 1, on_error=self._socket_error, vectored=bulk)
+        self._local = threading.local()  # .outbox: sends held back by the current thread
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rpc-worker')
+        self._unanswered = {}  # (client_address, sequence_number) -> codec, still executing in piggyback mode
+        self._timers = []  # heap of (deadline, kind, client_address, sequence_number)
+        self._lock = threading.Condition()
+        self._running = False
+
+    def serve_forever(self):
+        self._running = True
+        timer_thread = threading.Thread(target=self._timer_loop, name='rpc-timers', daemon=True)
+        timer_thread.start()
+        self.on_log('UDP RPC Server listening on %s:%s', self.host, self.port)
+        try:
+            while self._running:
+                if self._draining and self._drained(time.monotonic()):
+                    break
+                try:
+                    readable, _, _ = select.select([self.server_socket], [], [], POLL_INTERVAL)
+                    datagrams = self._io.recv_batch() if readable else []
+                except (OSError, ValueError):
+                    if not self._running:
+                        break
+                    raise
+                self._local.outbox = []
+                try:
+                    for data, client_address in datagrams:
+                        self._receive(data, client_address)
+                finally:
+                    self._flush_sends()
+        finally:
+            self._running = False
+            with self._lock:
+                self._lock.notify_all()
+            self._executor.shutdown(wait=False)
+
+    def shutdown(self):
+        self._running = False
+        with self._lock:
+            self._lock.notify_all()
+        self.server_socket.close()
+
+    def drain(self, timeout=DRAIN_TIMEOUT):
+        # Only sets flags, so it is safe to call from a signal handler.
+        self._begin_drain(time.monotonic(), timeout)
+
+    def _sendto(self, data, client_address, now=False):
+        outbox = getattr(self._local, 'outbox', None)
+        if outbox is not None and not now:
+            outbox.append((data, client_address))
+        else:
+            self._send_all([(data, client_address)])
+        self.metrics.sent(len(data))
+
+    def _flush_sends(self):
+        outbox, self._local.outbox = self._local.outbox, None
+        if outbox:
+            self._send_all(outbox)
+
+    def _send_all(self, packets):
+        while packets:
+            sent = self._io.send_batch(packets)
+            packets = packets[sent:]
+            if packets:
+                self._io.wait_writable(POLL_INTERVAL)
+
+    def _socket_error(self, exc):
+        self.on_log("Socket error: %s", exc)
+
+    def _handle_datagram(self, data, client_address):
+        received_at = time.monotonic()
+        self.metrics.received(len(data))
+        if is_fragment(data):
+            data = self._reassemble(data, client_address, received_at)
+            if data is None:
+                return
+        codec = codec_for(data)
+        if codec.is_ack(data):
+            self._handle_ack(data, codec, client_address)
+            return
+        if codec.is_cancel(data):
+            self._handle_cancel(data, codec, client_address)
+            return
+        if codec.is_credit(data):
+            self._handle_credit(data, codec, client_address)
+            return
+
+        request, error_data = self._parse_request(data, codec, client_address)
+        if request is None:
+            self._sendto(ACK, client_address)
+            self._sendto(error_data, client_address)
+            return
+
+        function_name, args, kwargs, sequence_number, options = request
+        self._handle_piggybacked_ack(options, client_address)
+        if self._answer_duplicate(data, sequence_number, options, codec, client_address, received_at):
+            return
+        if self._refuse_while_draining(sequence_number, client_address):
+            return
+        if self._refuse_expired(sequence_number, options, client_address, received_at):
+            return
+        if self._refuse_when_busy(function_name, args, sequence_number, options, codec, client_address, received_at):
+            return
+        if options.get('piggyback'):
+            # The response acknowledges the request; an explicit ACK only goes
+            # out if the method is still running after ACK_DELAY.
+            with self._lock:
+                self._unanswered[client_address, sequence_number] = codec
+                self._push_timer(time.monotonic() + ACK_DELAY, _DELAYED_ACK, client_address, sequence_number)
+        else:
+            # Not held back: the plain protocol expects the ACK before the response.
+            self._sendto(codec.ack_for(sequence_number, False), client_address, now=True)
+            client_ip, client_port = client_address
+            self.on_log("Sent acknowledgment to client %s:%s for request.", client_ip, client_port)
+        self.sessions.started(client_address, sequence_number)
+        with self._lock:
+            self._inflight += 1
+            self._work[client_address, sequence_number] = self._executor.submit(
+                self._execute, function_name, args, kwargs, options, sequence_number, client_address, codec, received_at)
+
+    def _push_timer(self, deadline, kind, client_address, sequence_number):
+        heapq.heappush(self._timers, (deadline, kind, client_address, sequence_number))
+        if self._timers[0][0] == deadline:
+            self._lock.notify()
+
+    def _execute(self, function_name, args, kwargs, options, sequence_number, client_address, codec, received_at):
+        key = client_address, sequence_number
+        deadline = options.get('deadline')
+        try:
+            if deadline is not None and time.monotonic() >= deadline:
+                # Queued past the caller's deadline: nobody waits for the result any more.
+                with self._lock:
+                    self._unanswered.pop(key, None)
+                self._abandon(DEADLINE, client_address, sequence_number)
+                return
+            try:
+                response = self._dispatch_request(function_name, args, kwargs, options)
+                if options.get('stream') and not options.get('batch'):
+                    response = self._stream(response, function_name, sequence_number, client_address, codec, deadline)
+            except Exception as e:
+                self._execute_failed(e, client_address, sequence_number)
+                response = f"Error while executing function: {e}"
+            if response is _MISSING:
+                with self._lock:
+                    self._unanswered.pop(key, None)
+                self.replies.discard(key)
+                return
+            response, response_data = codec.encode_response(response, sequence_number, self._window(options, client_address))
+            self.replies.finish(key, response_data, time.monotonic())
+            with self._lock:
+                self._unanswered.pop(key, None)
+            self._deliver(response_data, sequence_number, client_address, deadline)
+            self.metrics.answered(self._method_label(function_name, options), received_at, time.monotonic())
+        except Exception as e:
+            # Nothing was answered; a retransmission runs the request again instead of hearing it is still running.
+            self._execute_failed(e, client_address, sequence_number)
+            with self._lock:
+                self._unanswered.pop(key, None)
+            self.replies.discard(key)
+            return
+        finally:
+            with self._lock:
+                self._inflight -= 1
+                self._work.pop(key, None)
+            self.sessions.finished(client_address)
+        client_ip, client_port = client_address
+        self.on_response("Sent response to %s:%s: %s, Sequence: %s, Attempt: 1", client_ip, client_port, response, sequence_number)
+
+    def _stream(self, response, function_name, sequence_number, client_address, codec, deadline):
+        # Sends the items from this worker as the client's credit allows, and
+        # returns the call's response once every item is acknowledged, or
+        # _MISSING when the stream was cancelled, ran out of time or got no
+        # acknowledgments.
+        if inspect.isasyncgen(response):
+            response.aclose().close()
+            return "Error: Async generator methods need the asyncio engine"
+        generated = is_stream(response)  # Otherwise _dispatch() already timed the method
+        if not generated:
+            if _is_error(response):
+                return response
+            response = _single(response)
+        key = client_address, sequence_number
+        stream = OutgoingStream()
+        with self._lock:
+            self._streams[key] = stream
+        elapsed, error = 0.0, None
+        try:
+            while True:
+                if not self._wait_for_stream(stream, stream.can_send, deadline, client_address, sequence_number):
+                    return _MISSING
+                started = time.perf_counter()
+                try:
+                    item = next(response)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    error = f"Error while executing function: {e}"
+                    break
+                finally:
+                    elapsed += time.perf_counter() - started
+                try:
+                    message_id, packets = self._stream_item(stream, codec, sequence_number, item, client_address)
+                except (TypeError, OverflowError, ValueError) as e:
+                    error = f"Error while encoding response: {e}"
+                    break
+                with self._lock:
+                    stream.add(message_id, packets, time.monotonic())
+                    self._unanswered.pop(key, None)  # The first item acknowledges the request
+                    if stream.deadline is None:
+                        stream.deadline = time.monotonic() + self.sessions.get(client_address).rtt.rto
+                        self._push_timer(stream.deadline, _STREAM, client_address, sequence_number)
+                for packet in packets:
+                    self._sendto(packet, client_address)
+            # The response ends the stream, so it must not overtake an item.
+            if not self._wait_for_stream(stream, lambda: not stream.unacked, deadline, client_address, sequence_number):
+                return _MISSING
+        finally:
+            response.close()
+            with self._lock:
+                del self._streams[key]
+            self._release_stream(stream)
+        result = error if error is not None else stream.sent
+        if generated:
+            self.metrics.executed(function_name, elapsed, _is_error(result))
+        return result
+
+    def _wait_for_stream(self, stream, ready, deadline, client_address, sequence_number):
+        # False once the stream is closed or the call's deadline has passed.
+        with self._lock:
+            while not stream.closed:
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                if ready():
+                    return True
+                self._lock.wait(None if deadline is None else deadline - time.monotonic())
+            else:
+                return False
+        self._abandon(DEADLINE, client_address, sequence_number)
+        return False
+
+    def _credit(self, client_address, sequence_number, received, limit):
+        with self._lock:
+            stream = self._streams.get((client_address, sequence_number))
+            if stream is None:
+                return
+            progressed = received > stream.received
+            packets = self._stream_credit(stream, client_address, received, limit)
+            if progressed:
+                stream.deadline = None
+                if stream.unacked:
+                    stream.deadline = time.monotonic() + self.sessions.get(client_address).rtt.rto
+                    self._push_timer(stream.deadline, _STREAM, client_address, sequence_number)
+            self._lock.notify_all()
+        for packet in packets:
+            self._sendto(packet, client_address)
+
+    def _deliver(self, response_data, sequence_number, client_address, expires=None):
+        entry = _OutstandingResponse(response_data, None, expires=expires)
+        packets = self._response_packets(entry, client_address, sequence_number)
+        with self._lock:
+            now = time.monotonic()
+            entry.sent_at = now
+            entry.deadline = now + self.sessions.get(client_address).rtt.rto
+            outstanding = self._pending.setdefault(client_address, {})
+            previous = outstanding.get(sequence_number)
+            if previous is not None:
+                self.fragmenter.release(previous.message_id)
+            else:
+                self.sessions.sent(client_address)
+            outstanding[sequence_number] = entry
+            self._push_timer(entry.deadline, _RETRANSMIT, client_address, sequence_number)
+
+        for packet in packets:
+            self._sendto(packet, client_address)
+
+    def _acknowledge(self, client_address, cumulative=None, selective=frozenset()):
+        with self._lock:
+            self._pop_acknowledged(client_address, time.monotonic(), cumulative, selective)
+
+    def _cancel(self, client_address, sequence_number):
+        # Work still queued is dropped and a response is no longer resent; a
+        # method already running finishes, as a thread cannot be interrupted.
+        key = client_address, sequence_number
+        with self._lock:
+            work = self._work.pop(key, None)
+            queued = work is not None and work.cancel()
+            if queued:
+                self._inflight -= 1
+                self._unanswered.pop(key, None)
+            stream = self._streams.get(key)
+            if stream is not None:
+                # The worker sending it stops before the next item.
+                stream.closed = True
+                self._lock.notify_all()
+            response = self._forget_response(client_address, sequence_number)
+        if queued:
+            self.sessions.finished(client_address)
+        return queued or stream is not None or response is not None
+
+    def _timer_loop(self):
+        while self._running:
+            due = []
+            with self._lock:
+                now = time.monotonic()
+                while self._timers and self._timers[0][0] <= now:
+                    deadline, kind, client_address, sequence_number = heapq.heappop(self._timers)
+                    if kind == _DELAYED_ACK:
+                        codec = self._unanswered.pop((client_address, sequence_number), None)
+                        if codec is not None:
+                            due.append((kind, client_address, sequence_number, codec))
+                        continue
+                    if kind == _STREAM:
+                        stream = self._streams.get((client_address, sequence_number))
+                        if stream is None or stream.closed or stream.deadline != deadline:
+                            continue
+                        if stream.attempts >= MAX_RETRIES:
+                            stream.closed = True
+                            self._lock.notify_all()
+                            due.append((kind, client_address, sequence_number, None))
+                            continue
+                        estimator = self.sessions.get(client_address).rtt
+                        estimator.backoff()
+                        stream.attempts += 1
+                        stream.deadline = now + estimator.rto
+                        heapq.heappush(self._timers, (stream.deadline, _STREAM, client_address, sequence_number))
+                        due.append((kind, client_address, sequence_number, self._stream_packets(stream.resend_all())))
+                        continue
+                    entry = self._pending.get(client_address, {}).get(sequence_number)
+                    if entry is None or entry.deadline != deadline:
+                        continue
+                    if entry.expires is not None and now >= entry.expires:
+                        self._forget_response(client_address, sequence_number)
+                        due.append((kind, client_address, sequence_number, DEADLINE))
+                        continue
+                    if entry.attempts >= MAX_RETRIES:
+                        self._forget_response(client_address, sequence_number)
+                        due.append((kind, client_address, sequence_number, None))
+                        continue
+                    estimator = self.sessions.get(client_address).rtt
+                    estimator.expired(entry.sent_at, now)
+                    entry.attempts += 1
+                    entry.sent_at = now
+                    entry.deadline = now + estimator.rto
+                    heapq.heappush(self._timers, (entry.deadline, _RETRANSMIT, client_address, sequence_number))
+                    due.append((kind, client_address, sequence_number, entry))
+                if not due:
+                    timeout = self._timers[0][0] - now if self._timers else None
+                    self._lock.wait(timeout)
+                    continue
+
+            try:
+                self._fire(due)
+            except Exception as e:
+                # A failed send must not stop retransmits, delayed ACKs and expiry for good.
+                if not self._running:
+                    return
+                self.on_log("Timer error: %r", e)
+
+    def _fire(self, due):
+        self._local.outbox = []
+        try:
+            for kind, client_address, sequence_number, entry in due:
+                client_ip, client_port = client_address
+                if kind == _DELAYED_ACK:
+                    self._sendto(entry.ack_for(sequence_number, True), client_address)
+                    self.on_log("Sent acknowledgment to client %s:%s for request (Sequence: %s).", client_ip, client_port, sequence_number)
+                elif kind == _STREAM and entry is None:
+                    self.metrics.ack_timeouts.inc()
+                    self.on_log("Failed to receive acknowledgment from client %s:%s for streamed items, stopping the stream (Sequence: %s).", client_ip, client_port, sequence_number)
+                elif kind == _STREAM:
+                    self.metrics.retransmissions.inc()
+                    self.on_log("No acknowledgment from client %s:%s, resending %s streamed items (Sequence: %s)...", client_ip, client_port, len(entry), sequence_number)
+                    for packet in entry:
+                        self._sendto(packet, client_address)
+                elif entry is DEADLINE:
+                    self._abandon(DEADLINE, client_address, sequence_number)
+                elif entry is None:
+                    self.metrics.ack_timeouts.inc()
+                    self.on_log("Failed to receive acknowledgment from client %s:%s after multiple attempts (Sequence: %s).", client_ip, client_port, sequence_number)
+                else:
+                    self.metrics.retransmissions.inc()
+                    self.on_log("No acknowledgment from client %s:%s, resending response (Sequence: %s)...", client_ip, client_port, sequence_number)
+                    for packet in self._response_packets(entry, client_address, sequence_number):
+                        self._sendto(packet, client_address)
+                    self.on_response("Sent response to %s:%s, Sequence: %s, Attempt: %s", client_ip, client_port, sequence_number, entry.attempts)
+        finally:
+            self._flush_sends()
+
+
+class RPCServerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.server._receive(data, addr)
+
+    def error_received(self, exc):
+        self.server.on_log("Socket error: %s", exc)
+
+
+class AsyncRPCServer(BaseRPCServer):
+    """asyncio UDP RPC server built on loop.create_datagram_endpoint.
+
+    Plain methods run inline on the event loop; coroutine methods are
+    scheduled as tasks, so a single loop can keep many calls in flight.
+    Response retransmits are loop timers rather than threads.
+    """
+
+    def __init__(self, host='localhost', port=8000, sock=None, bulk=True, **hooks):
+        super().__init__(host, port, **hooks)
+        self.transport = None
+        self.bulk = bulk
+        self._sock = sock
+        self._closed = None
+
+    async def _login(self, username, password):
+        # Password hashing takes a good fraction of a second; keep it off the loop.
+        return await asyncio.get_running_loop().run_in_executor(None, self.auth.login, username, password)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if self.bulk and not isinstance(loop, getattr(asyncio, 'ProactorEventLoop', ())):  # It has no add_reader
+            sock = self._sock
+            if sock is None:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.bind((self.host, self.port))
+            self.transport = BulkDatagramTransport(loop, sock, RPCServerProtocol(self))
+        else:
+            if self._sock is None:
+                endpoint = {'local_addr': (self.host, self.port)}
+            else:
+                endpoint = {'sock': self._sock}
+            self.transport, _ = await loop.create_datagram_endpoint(lambda: RPCServerProtocol(self), **endpoint)
+        set_buffer_sizes(self.transport.get_extra_info('socket'))
+        self.host, self.port = self.transport.get_extra_info('sockname')[:2]
+        self._closed = loop.create_future()
+        self.on_log('UDP RPC Server listening on %s:%s', self.host, self.port)
+
+    async def serve_forever(self):
+        if self.transport is None:
+            await self.start()
+        await self._closed
+
+    def close(self):
+        for outstanding in self._pending.values():
+            for entry in outstanding.values():
+                entry.timer.cancel()
+        self._pending.clear()
+        if self.transport is not None:
+            self.transport.close()
+        if self._closed is not None and not self._closed.done():
+            self._closed.set_result(None)
+
+    def drain(self, timeout=DRAIN_TIMEOUT):
+        self._begin_drain(asyncio.get_running_loop().time(), timeout)
+        self._close_when_drained()
+
+    def _close_when_drained(self):
+        loop = asyncio.get_running_loop()
+        if self._drained(loop.time()):
+            self.close()
+        elif self.transport is not None and not self.transport.is_closing():
+            loop.call_later(0.05, self._close_when_drained)
+
+    def _sendto(self, data, client_address):
+        self.transport.sendto(data, client_address)
+        self.metrics.sent(len(data))
+
+    def _handle_datagram(self, data, client_address):
+        received_at = asyncio.get_running_loop().time()
+        self.metrics.received(len(data))
+        if is_fragment(data):
+            data = self._reassemble(data, client_address, received_at)
+            if data is None:
+                return
+        codec = codec_for(data)
+        if codec.is_ack(data):
+            self._handle_ack(data, codec, client_address)
+            return
+        if codec.is_cancel(data):
+            self._handle_cancel(data, codec, client_address)
+            return
+        if codec.is_credit(data):
+            self._handle_credit(data, codec, client_address)
+            return
+
+        request, error_data = self._parse_request(data, codec, client_address)
+        if request is None:
+            self._sendto(ACK, client_address)
+            self._sendto(error_data, client_address)
+            return
+
+        function_name, args, kwargs, sequence_number, options = request
+        self._handle_piggybacked_ack(options, client_address)
+        if self._answer_duplicate(data, sequence_number, options, codec, client_address, received_at):
+            return
+        if self._refuse_while_draining(sequence_number, client_address):
+            return
+        if self._refuse_expired(sequence_number, options, client_address, received_at):
+            return
+        if self._refuse_when_busy(function_name, args, sequence_number, options, codec, client_address, received_at):
+            return
+        piggyback = options.get('piggyback')
+        if not piggyback:
+            self._sendto(codec.ack_for(sequence_number, False), client_address)
+        self.sessions.started(client_address, sequence_number)
+
+        method = self._method_label(function_name, options)
+        try:
+            response = self._dispatch_request(function_name, args, kwargs, options)
+        except Exception as e:
+            # Answered like any failed call, so the session and reply cache do not wait on it for good.
+            self._execute_failed(e, client_address, sequence_number)
+            response = f"Error while executing function: {e}"
+        if options.get('batch') and isinstance(response, list) and any(map(asyncio.iscoroutine, response)):
+            response = self._await_batch(response)
+        elif options.get('stream') and not options.get('batch'):
+            response = self._stream(response, function_name, sequence_number, client_address, codec)
+        if asyncio.iscoroutine(response):
+            task = asyncio.ensure_future(self._await_response(response))
+            self._inflight += 1
+            self._work[client_address, sequence_number] = task
+            task.add_done_callback(functools.partial(self._response_ready, sequence_number, client_address, codec, options,
+                                                     method, received_at))
+            loop = asyncio.get_running_loop()
+            if piggyback:
+                loop.call_later(ACK_DELAY, self._delayed_ack, task, sequence_number, client_address, codec)
+            deadline = options.get('deadline')
+            if deadline is not None:
+                expiry = loop.call_at(deadline, self._deadline_passed, task, sequence_number, client_address)
+                task.add_done_callback(lambda task: expiry.cancel())
+        else:
+            self.sessions.finished(client_address)
+            self._send_response(response, sequence_number, client_address, codec, options, method, received_at)
+
+    def _delayed_ack(self, task, sequence_number, client_address, codec):
+        stream = self._streams.get((client_address, sequence_number))
+        if stream is not None and stream.sent:
+            return  # The first item acknowledged the request
+        if not task.done() and not self.transport.is_closing():
+            self._sendto(codec.ack_for(sequence_number, True), client_address)
+
+    def _deadline_passed(self, task, sequence_number, client_address):
+        if task.cancel():
+            self._abandon(DEADLINE, client_address, sequence_number)
+
+    async def _stream(self, response, function_name, sequence_number, client_address, codec):
+        # Sends the items as the client's credit allows, and returns the
+        # call's response once every item is acknowledged. A CANCEL, the
+        # deadline or a lack of acknowledgments cancels the task instead.
+        if asyncio.iscoroutine(response) and not is_stream(response):  # Before 3.12 a generator counts as a coroutine
+            response = await response
+        generated = is_stream(response)  # Otherwise _dispatch() already timed the method
+        if not generated:
+            if _is_error(response):
+                return response
+            response = _single(response)
+        loop = asyncio.get_running_loop()
+        key = client_address, sequence_number
+        stream = self._streams[key] = OutgoingStream()
+        stream.waiter = asyncio.Event()
+        asynchronous = inspect.isasyncgen(response)
+        elapsed, error = 0.0, None
+        try:
+            while True:
+                while not stream.can_send():
+                    stream.waiter.clear()
+                    await stream.waiter.wait()
+                started = time.perf_counter()
+                try:
+                    item = await response.__anext__() if asynchronous else next(response)
+                except (StopIteration, StopAsyncIteration):
+                    break
+                except Exception as e:
+                    error = f"Error while executing function: {e}"
+                    break
+                finally:
+                    elapsed += time.perf_counter() - started
+                try:
+                    message_id, packets = self._stream_item(stream, codec, sequence_number, item, client_address)
+                except (TypeError, OverflowError, ValueError) as e:
+                    error = f"Error while encoding response: {e}"
+                    break
+                stream.add(message_id, packets, loop.time())
+                if stream.timer is None:
+                    stream.timer = loop.call_later(self.sessions.get(client_address).rtt.rto, self._resend_stream, key)
+                for packet in packets:
+                    self._sendto(packet, client_address)
+            # The response ends the stream, so it must not overtake an item.
+            while stream.unacked:
+                stream.waiter.clear()
+                await stream.waiter.wait()
+        finally:
+            if stream.timer is not None:
+                stream.timer.cancel()
+            del self._streams[key]
+            self._release_stream(stream)
+            if asynchronous:
+                await response.aclose()
+            else:
+                response.close()
+        result = error if error is not None else stream.sent
+        if generated:
+            self.metrics.executed(function_name, elapsed, _is_error(result))
+        return result
+
+    def _credit(self, client_address, sequence_number, received, limit):
+        stream = self._streams.get((client_address, sequence_number))
+        if stream is None:
+            return
+        progressed = received > stream.received
+        packets = self._stream_credit(stream, client_address, received, limit)
+        if progressed:
+            if stream.timer is not None:
+                stream.timer.cancel()
+            stream.timer = None
+            if stream.unacked:
+                stream.timer = asyncio.get_running_loop().call_later(self.sessions.get(client_address).rtt.rto,
+                                                                     self._resend_stream, (client_address, sequence_number))
+        stream.waiter.set()
+        for packet in packets:
+            self._sendto(packet, client_address)
+
+    def _resend_stream(self, key):
+        stream = self._streams.get(key)
+        if stream is None:
+            return
+        client_address, sequence_number = key
+        client_ip, client_port = client_address
+        if stream.attempts >= MAX_RETRIES:
+            stream.timer = None
+            self.metrics.ack_timeouts.inc()
+            self.on_log("Failed to receive acknowledgment from client %s:%s for streamed items, stopping the stream (Sequence: %s).", client_ip, client_port, sequence_number)
+            task = self._work.pop(key, None)  # A CANCEL may have got there first
+            if task is not None:
+                task.cancel()
+            return
+        estimator = self.sessions.get(client_address).rtt
+        estimator.backoff()
+        stream.attempts += 1
+        stream.timer = asyncio.get_running_loop().call_later(estimator.rto, self._resend_stream, key)
+        packets = self._stream_packets(stream.resend_all())
+        self.metrics.retransmissions.inc()
+        self.on_log("No acknowledgment from client %s:%s, resending %s streamed items (Sequence: %s)...", client_ip, client_port, len(packets), sequence_number)
+        for packet in packets:
+            self._sendto(packet, client_address)
+
+    async def _await_response(self, coroutine):
+        try:
+            return await coroutine
+        except Exception as e:
+            return f"Error while executing function: {e}"
+
+    async def _await_batch(self, results):
+        awaited = iter(await asyncio.gather(*(self._await_response(result) for result in results
+                                              if asyncio.iscoroutine(result))))
+        return [next(awaited) if asyncio.iscoroutine(result) else result for result in results]
+
+    def _response_ready(self, sequence_number, client_address, codec, options, method, received_at, task):
+        self._inflight -= 1
+        self._work.pop((client_address, sequence_number), None)
+        self.sessions.finished(client_address)
+        if task.cancelled():
+            self.replies.discard((client_address, sequence_number))
+        else:
+            self._send_response(task.result(), sequence_number, client_address, codec, options, method, received_at)
+
+    def _send_response(self, response, sequence_number, client_address, codec, options, method, received_at):
+        if self.transport is None or self.transport.is_closing():
+            return
+        response, response_data = codec.encode_response(response, sequence_number, self._window(options, client_address))
+        self.replies.finish((client_address, sequence_number), response_data, asyncio.get_running_loop().time())
+        self._deliver(response_data, sequence_number, client_address, options.get('deadline'))
+        self.metrics.answered(method, received_at, asyncio.get_running_loop().time())
+        client_ip, client_port = client_address
+        self.on_response("Sent response to %s:%s: %s, Sequence: %s, Attempt: 1", client_ip, client_port, response, sequence_number)
+
+    def _deliver(self, response_data, sequence_number, client_address, expires=None):
+        loop = asyncio.get_running_loop()
+        outstanding = self._pending.setdefault(client_address, {})
+        previous = outstanding.get(sequence_number)
+        if previous is not None:
+            previous.timer.cancel()
+            self.fragmenter.release(previous.message_id)
+        else:
+            self.sessions.sent(client_address)
+        timer = loop.call_later(self.sessions.get(client_address).rtt.rto, self._retransmit, client_address, sequence_number)
+        entry = outstanding[sequence_number] = _OutstandingResponse(response_data, loop.time(), timer=timer, expires=expires)
+        for packet in self._response_packets(entry, client_address, sequence_number):
+            self._sendto(packet, client_address)
+
+    def _acknowledge(self, client_address, cumulative=None, selective=frozenset()):
+        now = asyncio.get_running_loop().time()
+        for entry in self._pop_acknowledged(client_address, now, cumulative, selective):
+            entry.timer.cancel()
+
+    def _cancel(self, client_address, sequence_number):
+        task = self._work.pop((client_address, sequence_number), None)
+        cancelled = task is not None and task.cancel()
+        response = self._forget_response(client_address, sequence_number)
+        if response is not None:
+            response.timer.cancel()
+        return cancelled or response is not None
+
+    def _retransmit(self, client_address, sequence_number):
+        entry = self._pending.get(client_address, {}).get(sequence_number)
+        if entry is None:
+            return
+        loop = asyncio.get_running_loop()
+        if entry.expires is not None and loop.time() >= entry.expires:
+            self._forget_response(client_address, sequence_number)
+            self._abandon(DEADLINE, client_address, sequence_number)
+            return
+        client_ip, client_port = client_address
+        if entry.attempts >= MAX_RETRIES:
+            self._forget_response(client_address, sequence_number)
+            self.metrics.ack_timeouts.inc()
+            self.on_log("Failed to receive acknowledgment from client %s:%s after multiple attempts (Sequence: %s).", client_ip, client_port, sequence_number)
+            return
+        estimator = self.sessions.get(client_address).rtt
+        estimator.expired(entry.sent_at, loop.time())
+        self.metrics.retransmissions.inc()
+        entry.attempts += 1
+        entry.sent_at = loop.time()
+        entry.timer = loop.call_later(estimator.rto, self._retransmit, client_address, sequence_number)
+        for packet in self._response_packets(entry, client_address, sequence_number):
+            self._sendto(packet, client_address)
+        self.on_response("Sent response to %s:%s, Sequence: %s, Attempt: %s", client_ip, client_port, sequence_number, entry.attempts)
+
+
+def reuseport_sockets(host, port, count):
+    """count UDP sockets bound to the same address with SO_REUSEPORT.
+
+    The kernel hashes each datagram's source and destination addresses to
+    pick one of them, so every datagram from a given client socket lands on
+    the same socket for as long as the group does not change. Port 0 binds
+    the first socket to a free port and the rest to the same one.
+    """
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise OSError('SO_REUSEPORT is not supported on this platform')
+    sockets = []
+    try:
+        for _ in range(count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sockets.append(sock)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((host, port))
+            port = sock.getsockname()[1]
+    except OSError:
+        for sock in sockets:
+            sock.close()
+        raise
+    return sockets
+
+
+def sink_hooks(sink):
+    return {'on_log': sink.hook('log'), 'on_request': sink.hook('request'), 'on_response': sink.hook('response')}
+
+
+def _stdout_sink():
+    sink = LogSink()
+    sink.add_handler(stream_handler())
+    return sink.start()
+
+
+def _serve_metrics(server, port):
+    if port is not None:
+        serve_metrics(server.metrics.registry, server.host, port)
+        server.on_log('Metrics at http://%s:%s/metrics', server.host, port)
+
+
+def _run_worker(sock, engine, setup, threads, drain_timeout, worker_sink, metrics_port, bulk):
+    # Ctrl-C reaches the whole process group; the supervisor decides when workers stop.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sink = worker_sink() if worker_sink is not None else None
+    hooks = sink_hooks(sink) if sink is not None else {}
+
+    async def serve():
+        server = AsyncRPCServer(sock=sock, bulk=bulk, **hooks)
+        setup(server)
+        await server.start()
+        _serve_metrics(server, metrics_port)
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.drain, drain_timeout)
+        await server.serve_forever()
+
+    try:
+        if engine == 'threads':
+            server = RPCServerEngine(sock=sock, workers=threads, bulk=bulk, **hooks)
+            setup(server)
+            _serve_metrics(server, metrics_port)
+            signal.signal(signal.SIGTERM, lambda signum, frame: server.drain(drain_timeout))
+            server.serve_forever()
+        else:
+            asyncio.run(serve())
+    finally:
+        if sink is not None:
+            sink.close()
+
+
+class Supervisor:
+    """Runs one server process per socket of a SO_REUSEPORT group.
+
+    The supervisor binds all the sockets itself and keeps them open, so the
+    group never changes: a client keeps reaching the same worker, whose reply
+    cache, retransmit timers and fragment state therefore stay valid, and a
+    worker that dies is restarted on its own socket with any datagrams that
+    queued up meanwhile. shutdown() drains every worker (SIGTERM) and kills
+    the ones that do not finish in time. worker_sink, if given, is called
+    in each worker to create the LogSink its server logs to. With
+    metrics_port, worker i serves its metrics on metrics_port + i.
+    """
+
+    def __init__(self, host='localhost', port=8000, processes=None, engine='asyncio', setup=register_builtin_methods,
+                 threads=WORKER_THREADS, drain_timeout=DRAIN_TIMEOUT, on_log=_ignore, worker_sink=None,
+                 metrics_port=None, bulk=True):
+        self.host = host
+        self.port = port
+        self.processes = processes or os.cpu_count() or 1
+        self.engine = engine
+        self.setup = setup
+        self.threads = threads
+        self.drain_timeout = drain_timeout
+        self.on_log = on_log
+        self.worker_sink = worker_sink
+        self.metrics_port = metrics_port
+        self.bulk = bulk
+        self._sockets = []
+        self._workers = []  # index -> multiprocessing.Process
+        self._started_at = []
+        self._running = False
+
+    def start(self):
+        self._sockets = reuseport_sockets(self.host, self.port, self.processes)
+        self.port = self._sockets[0].getsockname()[1]
+        self._workers = [None] * self.processes
+        self._started_at = [0.0] * self.processes
+        self._running = True
+        for index in range(self.processes):
+            self._start_worker(index)
+        self.on_log('Supervisor running %s %s workers on %s:%s', self.processes, self.engine, self.host, self.port)
+
+    def serve_forever(self):
+        if not self._running:
+            self.start()
+        try:
+            while self._running:
+                self._restart_exited(wait([worker.sentinel for worker in self._workers if worker is not None],
+                                          timeout=POLL_INTERVAL))
+        finally:
+            self._stop_workers()
+
+    def shutdown(self):
+        # Only clears a flag, so it is safe to call from a signal handler.
+        self._running = False
+
+    def _start_worker(self, index):
+        metrics_port = None if self.metrics_port is None else self.metrics_port + index
+        worker = multiprocessing.Process(target=_run_worker, name=f'rpc-worker-{index}', daemon=True,
+                                         args=(self._sockets[index], self.engine, self.setup, self.threads,
+                                               self.drain_timeout, self.worker_sink, metrics_port, self.bulk))
+        worker.start()
+        self._workers[index] = worker
+        self._started_at[index] = time.monotonic()
+        self.on_log('Started worker %s (pid %s)', index, worker.pid)
+
+    def _restart_exited(self, sentinels):
+        now = time.monotonic()
+        for index, worker in enumerate(self._workers):
+            if worker is not None and worker.sentinel in sentinels:
+                worker.join()
+                self._workers[index] = None
+                self.on_log('Worker %s (pid %s) exited with code %s', index, worker.pid, worker.exitcode)
+            if self._workers[index] is None and self._running and now - self._started_at[index] >= RESTART_DELAY:
+                self._start_worker(index)
+
+    def _stop_workers(self):
+        workers = [worker for worker in self._workers if worker is not None and worker.is_alive()]
+        for worker in workers:
+            worker.terminate()
+        deadline = time.monotonic() + self.drain_timeout + 2 * POLL_INTERVAL
+        for worker in workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+            if worker.is_alive():
+                self.on_log('Worker pid %s did not drain in time, killing it', worker.pid)
+                worker.kill()
+                worker.join()
+        for sock in self._sockets:
+            sock.close()
+        self._sockets = []
+        self.on_log('Supervisor stopped')
+
+
+def _print_log(message, *args):
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {format_message(message, args)}", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='server_backend', description='Headless UDP RPC server')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve = subparsers.add_parser('serve', help='run the RPC server without a GUI')
+    serve.add_argument('--host', default='localhost')
+    serve.add_argument('--port', type=int, default=8000)
+    serve.add_argument('--engine', choices=['asyncio', 'threads'], default='asyncio')
+    serve.add_argument('--workers', type=int, default=WORKER_THREADS, help='worker threads for the threads engine')
+    serve.add_argument('--processes', type=int, default=1,
+                       help='server processes sharing the port through SO_REUSEPORT (0 for one per CPU)')
+    serve.add_argument('--metrics-port', type=int,
+                       help='serve Prometheus metrics over HTTP on this port (worker i of --processes on port + i)')
+    serve.add_argument('--io', choices=['bulk', 'plain'], default='bulk',
+                       help='move datagrams in batches (recvmmsg/sendmmsg on Linux) or one at a time')
+    serve.add_argument('--credentials', metavar='PATH',
+                       help='accounts file (see credentials.py); calls then need a token from rpc.login')
+    serve.add_argument('--allow-anonymous', action='store_true',
+                       help='with --credentials, still accept calls without a token')
+    serve.add_argument('--max-queue', type=int, default=MAX_QUEUE,
+                       help='requests executing or queued before new ones are refused as busy')
+    serve.add_argument('--rate-limit', type=float, metavar='CALLS',
+                       help='calls per second allowed to each user (or client address without one)')
+    serve.add_argument('--burst', type=float, help='calls a client may make at once under --rate-limit')
+    serve.add_argument('--quiet', action='store_true', help='do not log individual packets')
+    options = parser.parse_args(argv)
+    setup = register_builtin_methods
+    if options.credentials:
+        setup = functools.partial(register_with_auth, options.credentials, os.urandom(SECRET_BYTES),
+                                  not options.allow_anonymous)
+    setup = functools.partial(with_admission, setup, options.max_queue, options.rate_limit, options.burst)
+
+    if options.quiet:
+        _print_log('UDP RPC Server starting on %s:%s (%s engine)', options.host, options.port, options.engine)
+
+    if options.processes != 1:
+        supervisor = Supervisor(options.host, options.port, options.processes, options.engine, setup, threads=options.workers,
+                                on_log=_print_log, worker_sink=None if options.quiet else _stdout_sink,
+                                metrics_port=options.metrics_port, bulk=options.io == 'bulk')
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda signum, frame: supervisor.shutdown())
+        supervisor.serve_forever()
+        return 0
+
+    sink = None if options.quiet else _stdout_sink()
+    hooks = sink_hooks(sink) if sink is not None else {}
+    try:
+        if options.engine == 'threads':
+            server = RPCServerEngine(options.host, options.port, workers=options.workers, bulk=options.io == 'bulk',
+                                     **hooks)
+            setup(server)
+            _serve_metrics(server, options.metrics_port)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                server.shutdown()
+        else:
+            server = AsyncRPCServer(options.host, options.port, bulk=options.io == 'bulk', **hooks)
+            setup(server)
+            _serve_metrics(server, options.metrics_port)
+            try:
+                asyncio.run(server.serve_forever())
+            except KeyboardInterrupt:
+                pass
+    finally:
+        if sink is not None:
+            sink.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import itertools
+import threading
+from collections import OrderedDict
+
+from rtt import MAX_PEERS, RTTEstimator
+
+MAX_SESSIONS = MAX_PEERS
+MAX_SESSION_WINDOW = 256  # Most calls one peer is invited to keep in flight
+MAX_OUTSTANDING = 4096  # Calls in flight across all peers before windows shrink
+
+
+class Session:
+    __slots__ = ('peer', 'rtt', 'executing', 'unacked', 'highest')
+
+    def __init__(self, peer, rtt):
+        self.peer = peer
+        self.rtt = rtt
+        self.executing = 0  # Requests accepted whose response is not ready
+        self.unacked = 0  # Responses sent and not acknowledged yet
+        self.highest = -1  # Highest sequence number accepted
+
+    def outstanding(self):
+        return self.executing + self.unacked
+
+
+class SessionTable:
+    """Per-peer state of the server, keyed by client address.
+
+    Each session has its RTT estimator and counts the peer's calls in flight:
+    requests still executing and responses still waiting for an ACK. From
+    those counts window() computes the receive window advertised in responses:
+    the calls the peer may keep in flight, which is what it already has plus
+    a fair share of the capacity left under max_outstanding. A flood from one
+    client therefore shrinks its own window first, and many busy clients
+    shrink everyone's, before the socket buffer overflows. Beyond max_sessions
+    the least recently used idle session is forgotten.
+    """
+
+    def __init__(self, max_window=MAX_SESSION_WINDOW, max_outstanding=MAX_OUTSTANDING, max_sessions=MAX_SESSIONS,
+                 **estimator_options):
+        self.max_window = max_window
+        self.max_outstanding = max_outstanding
+        self.max_sessions = max_sessions
+        self.estimator_options = estimator_options
+        self.outstanding = 0
+        self._busy = 0  # Sessions with calls in flight
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, peer):
+        with self._lock:
+            return self._get(peer)
+
+    def started(self, peer, sequence_number):
+        with self._lock:
+            session = self._get(peer)
+            session.highest = max(session.highest, sequence_number)
+            self._adjust(session, 1, 0)
+
+    def finished(self, peer):
+        with self._lock:
+            self._adjust(self._get(peer), -1, 0)
+
+    def sent(self, peer):
+        with self._lock:
+            self._adjust(self._get(peer), 0, 1)
+
+    def settled(self, peer, count=1):
+        with self._lock:
+            self._adjust(self._get(peer), 0, -count)
+
+    def window(self, peer):
+        with self._lock:
+            session = self._get(peer)
+            share = max(0, self.max_outstanding - self.outstanding) // max(1, self._busy)
+            return max(1, min(self.max_window, session.outstanding() + share))
+
+    def info(self):
+        with self._lock:
+            return {peer: {'outstanding': session.outstanding(), 'highest': session.highest, 'rto': session.rtt.rto}
+                    for peer, session in self._sessions.items()}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _get(self, peer):
+        session = self._sessions.get(peer)
+        if session is None:
+            session = self._sessions[peer] = Session(peer, RTTEstimator(**self.estimator_options))
+            self._evict()
+        else:
+            self._sessions.move_to_end(peer)
+        return session
+
+    def _adjust(self, session, executing, unacked):
+        before = session.outstanding()
+        session.executing = max(0, session.executing + executing)
+        session.unacked = max(0, session.unacked + unacked)
+        after = session.outstanding()
+        self.outstanding += after - before
+        self._busy += (after > 0) - (before > 0)
+
+    def _evict(self):
+        # A session with calls in flight is kept, or its counts would be lost.
+        excess = len(self._sessions) - self.max_sessions
+        if excess > 0:
+            idle = [peer for peer, session in itertools.islice(self._sessions.items(), excess)
+                    if not session.outstanding()]
+            for peer in idle:
+                del self._sessions[peer]
@@ -0,0 +1,126 @@
+import inspect
+from collections import deque
+
+# A method that returns a generator or an async generator streams its items
+# to clients that ask for a stream (the 'stream' request option). Each item
+# travels in its own STREAM frame, numbered from 0 (protocol.py). The client
+# answers with CREDIT frames: every item below <received> arrived, and the
+# server may send those below <limit>. The client raises the limit as its
+# consumer takes items, so neither side holds more than about a window of
+# them. Once every item is acknowledged, the call's ordinary response ends
+# the stream: the number of items, or an error string.
+# Clients that do not ask for a stream get the items in one list.
+
+STREAM_WINDOW = 16  # Items the server may send beyond those the consumer has taken
+STREAM_ACK_EVERY = STREAM_WINDOW // 4  # Items received before the client acknowledges them without delay
+
+
+def is_stream(result):
+    return inspect.isgenerator(result) or inspect.isasyncgen(result)
+
+
+class OutgoingStream:
+    """The server's side of one streamed call.
+
+    add() records an item sent as the next index; the items stay in
+    unacked until acknowledge() reports them received, so they can be sent
+    again. can_send() is true while the client's credit allows another.
+    acknowledge() also measures the round trip to the client, leaving out
+    items sent more than once.
+    """
+
+    __slots__ = ('unacked', 'sent', 'received', 'limit', 'resent', 'attempts', 'deadline', 'timer', 'waiter',
+                 'closed')
+
+    def __init__(self, window=STREAM_WINDOW):
+        self.unacked = deque()  # (index, message_id, packets, sent_at) of the items sent but not acknowledged
+        self.sent = 0  # Items sent, so also the index of the next one
+        self.received = 0  # The client has every item below this index
+        self.limit = window
+        self.resent = -1  # Highest index sent again
+        self.attempts = 0  # Retransmits since the client last acknowledged an item
+        self.deadline = None  # Of the retransmit timer
+        self.timer = None
+        self.waiter = None  # What an engine waits on for credit
+        self.closed = False  # Cancelled, or given up on for lack of acknowledgments
+
+    def can_send(self):
+        return self.sent < self.limit
+
+    def add(self, message_id, packets, now):
+        self.unacked.append((self.sent, message_id, packets, now))
+        self.sent += 1
+
+    def acknowledge(self, received, limit, now):
+        """Returns the message ids of the items acknowledged, for the fragmenter
+        to release, and a round trip time sample or None."""
+        released, sample = [], None
+        while self.unacked and self.unacked[0][0] < received:
+            index, message_id, packets, sent_at = self.unacked.popleft()
+            released.append(message_id)
+            if index > self.resent:
+                sample = now - sent_at
+        if received > self.received:
+            self.received = received
+            self.attempts = 0
+        self.limit = max(self.limit, limit)
+        return released, sample
+
+    def missing(self, received):
+        """The first item not acknowledged, when a CREDIT that does not move
+        received shows the client holding later ones; each item once."""
+        if received != self.received or not self.unacked or self.unacked[0][0] <= self.resent:
+            return None
+        self.resent = self.unacked[0][0]
+        return self.unacked[0]
+
+    def resend_all(self):
+        self.resent = self.sent - 1
+        return self.unacked
+
+
+class IncomingStream:
+    """The client's side of one streamed call.
+
+    receive() hands items to on_item in index order, holding back any that
+    arrive ahead of a gap, and returns False for one seen before; holding()
+    is true while it holds any. consume()
+    counts an item taken by the consumer and returns True once the credit
+    should be raised; credit() gives the (received, limit) to send.
+    """
+
+    __slots__ = ('on_item', 'window', 'received', 'acknowledged', 'consumed', 'limit', '_early')
+
+    def __init__(self, on_item, window=STREAM_WINDOW):
+        self.on_item = on_item
+        self.window = window
+        self.received = 0  # Items handed to on_item, so also the index of the next one
+        self.acknowledged = 0  # received as last sent to the server
+        self.consumed = 0
+        self.limit = window  # As last sent to the server
+        self._early = {}  # index -> item received ahead of a gap
+
+    def receive(self, index, item):
+        if index < self.received or index in self._early:
+            return False
+        self._early[index] = item
+        while self.received in self._early:
+            self.on_item(self._early.pop(self.received))
+            self.received += 1
+        return True
+
+    def holding(self):
+        return bool(self._early)
+
+    def consume(self):
+        self.consumed += 1
+        return self.consumed + self.window - self.limit >= self.window // 2
+
+    def stalled(self):
+        # The server has sent all the consumer allowed; silence is expected.
+        return self.received >= self.limit
+
+    def credit(self):
+        self.acknowledged = self.received
+        self.limit = max(self.limit, self.consumed + self.window)
+        return self.received, self.limit
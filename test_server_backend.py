@@ -0,0 +1,78 @@
+import threading
+import unittest
+
+from client_backend import ReliableUDPClient
+from protocol import codec_for
+from server_backend import RPCServerEngine, register_builtin_methods
+
+CLIENT = ('127.0.0.1', 40000)
+
+
+class ParseRequestTest(unittest.TestCase):
+    def setUp(self):
+        self.server = RPCServerEngine('127.0.0.1', 0)
+        register_builtin_methods(self.server)
+
+    def tearDown(self):
+        self.server.server_socket.close()
+        self.server._executor.shutdown(wait=False)
+
+    def parse(self, data):
+        return self.server._parse_request(data, codec_for(data), CLIENT)
+
+    def test_valid_request(self):
+        request, error = self.parse(b'["add",[1,2],{},0]')
+        self.assertIsNone(error)
+        self.assertEqual(request[:4], ('add', [1, 2], {}, 0))
+
+    def test_function_name_must_be_a_string(self):
+        for data in (b'[[1],[1,2],{},0]', b'[{"a":1},[1,2],{},0]', b'[5,[1,2],{},0]'):
+            request, error = self.parse(data)
+            self.assertIsNone(request)
+            self.assertIn(b'Invalid request format', error)
+            self.assertIn(b'Function name must be a string', error)
+
+    def test_batch_without_function_name(self):
+        request, error = self.parse(b'[null,[["add",[1,2],{}]],{},0,{"batch":true}]')
+        self.assertIsNone(error)
+        self.assertIsNone(request[0])
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.server = RPCServerEngine('127.0.0.1', 0)
+        register_builtin_methods(self.server)
+
+    def tearDown(self):
+        self.server.server_socket.close()
+        self.server._executor.shutdown(wait=False)
+
+    def test_mixed_batch(self):
+        response = self.server._dispatch_request(None, [['add', [1, 2], {}], ['multiply', [2, 3]]], {}, {'batch': True})
+        self.assertEqual(response, [3, 6])
+
+    def test_malformed_entries_are_an_error(self):
+        for entries in ([[[1], [1, 2]]], [['add', 5]], [['add', [1, 2], []]], [5]):
+            response = self.server._dispatch_request(None, entries, {}, {'batch': True})
+            self.assertTrue(response.startswith('Error: Invalid batch request'), response)
+
+
+class ServeTest(unittest.TestCase):
+    def test_port_zero_reports_the_bound_port(self):
+        server = RPCServerEngine('127.0.0.1', 0)
+        register_builtin_methods(server)
+        self.assertNotEqual(server.port, 0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        client = ReliableUDPClient((server.host, server.port))
+        try:
+            response, response_time = client.send_request('add', [1, 2])
+            self.assertEqual(response, 3)
+        finally:
+            client.close()
+            server.shutdown()
+            thread.join(5)
+
+
+if __name__ == '__main__':
+    unittest.main()